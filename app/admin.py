@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Portfolio, Stock, Holding, TargetAllocation, StockPrice
+from .models import Portfolio, Stock, Holding, TargetAllocation, StockPrice, StockPriceRollup, ImportCheckpoint, PortfolioDrift, Trade, PositionSnapshot
 
 # Register your models here.
 admin.site.register(Portfolio)
@@ -7,3 +7,22 @@ admin.site.register(Stock)
 admin.site.register(Holding)
 admin.site.register(TargetAllocation)
 admin.site.register(StockPrice)
+admin.site.register(StockPriceRollup)
+admin.site.register(ImportCheckpoint)
+admin.site.register(PortfolioDrift)
+admin.site.register(PositionSnapshot)
+
+
+@admin.register(Trade)
+class TradeAdmin(admin.ModelAdmin):
+    # El ledger es append-only: los trades solo los escriben los servicios, nunca se editan ni borran
+    list_display = ('id', 'portfolio', 'kind', 'stock', 'shares', 'price', 'cash_delta', 'executed_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,89 @@
+from uuid import uuid4
+from django.conf import settings
+from django.core.cache import cache
+
+PRICE_HISTORY_TIMEOUT = getattr(settings, 'PRICE_HISTORY_CACHE_TIMEOUT', 60 * 60)
+NAV_SERIES_TIMEOUT = getattr(settings, 'NAV_SERIES_CACHE_TIMEOUT', 24 * 60 * 60)
+RISK_TIMEOUT = getattr(settings, 'PORTFOLIO_RISK_CACHE_TIMEOUT', 24 * 60 * 60)
+# Lo calculado desde la base porque la matriz no estaba al día se guarda poco: al refrescarla se usa la matriz
+RISK_FALLBACK_TIMEOUT = getattr(settings, 'PORTFOLIO_RISK_FALLBACK_CACHE_TIMEOUT', 60)
+
+
+def _version_key(stock_id: int) -> str:
+    return f'price-history-version:{stock_id}'
+
+
+def _price_history_version(stock_id: int) -> str:
+    # La versión cambia cada vez que llegan precios nuevos para la acción
+    version = cache.get(_version_key(stock_id))
+    if version is None:
+        version = uuid4().hex
+        cache.add(_version_key(stock_id), version, None)
+        version = cache.get(_version_key(stock_id), version)
+    return version
+
+
+def price_history_key(stock_id: int, start_date, end_date) -> str:
+    version = _price_history_version(stock_id)
+    return f'price-history:{stock_id}:{version}:{start_date or ""}:{end_date or ""}'
+
+
+def get_price_history(stock_id: int, start_date, end_date):
+    return cache.get(price_history_key(stock_id, start_date, end_date))
+
+
+def set_price_history(stock_id: int, start_date, end_date, data: dict) -> None:
+    cache.set(price_history_key(stock_id, start_date, end_date), data, PRICE_HISTORY_TIMEOUT)
+
+
+async def _aprice_history_version(stock_id: int) -> str:
+    version = await cache.aget(_version_key(stock_id))
+    if version is None:
+        version = uuid4().hex
+        await cache.aadd(_version_key(stock_id), version, None)
+        version = await cache.aget(_version_key(stock_id), version)
+    return version
+
+
+async def aprice_history_key(stock_id: int, start_date, end_date) -> str:
+    version = await _aprice_history_version(stock_id)
+    return f'price-history:{stock_id}:{version}:{start_date or ""}:{end_date or ""}'
+
+
+async def aget_price_history(stock_id: int, start_date, end_date):
+    return await cache.aget(await aprice_history_key(stock_id, start_date, end_date))
+
+
+async def aset_price_history(stock_id: int, start_date, end_date, data: dict) -> None:
+    await cache.aset(await aprice_history_key(stock_id, start_date, end_date), data, PRICE_HISTORY_TIMEOUT)
+
+
+def invalidate_stock_prices(stock_ids) -> None:
+    # Cambiar la versión deja huérfanas todas las entradas de esas acciones, sin tocar las demás
+    versions = {_version_key(stock_id): uuid4().hex for stock_id in stock_ids}
+    if versions:
+        cache.set_many(versions, None)
+
+
+def get_nav_series(portfolio_id: int):
+    return cache.get(f'nav-series:{portfolio_id}')
+
+
+def set_nav_series(portfolio_id: int, data: dict) -> None:
+    cache.set(f'nav-series:{portfolio_id}', data, NAV_SERIES_TIMEOUT)
+
+
+def get_portfolio_risk(portfolio_id: int, as_of, days: int):
+    return cache.get(f'portfolio-risk:{portfolio_id}:{as_of}:{days}')
+
+
+def set_portfolio_risk(portfolio_id: int, as_of, days: int, data: dict, timeout: int = RISK_TIMEOUT) -> None:
+    cache.set(f'portfolio-risk:{portfolio_id}:{as_of}:{days}', data, timeout)
+
+
+def get_market_returns(version: str, as_of, days: int):
+    return cache.get(f'market-returns:{version}:{as_of}:{days}')
+
+
+def set_market_returns(version: str, as_of, days: int, returns, timeout: int = RISK_TIMEOUT) -> None:
+    cache.set(f'market-returns:{version}:{as_of}:{days}', returns, timeout)
@@ -0,0 +1,241 @@
+import json
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import date, datetime
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment
+from app.models import Portfolio, Stock, Holding, TargetAllocation, StockPrice
+from app.services import PortfolioService, StockDataService
+
+
+class Command(BaseCommand):
+    help = 'Benchmark wall time and query count of the service methods on synthetic datasets'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--scale',
+            action='append',
+            dest='scales',
+            help='Dataset as STOCKS:YEARS:PORTFOLIOS (repeatable, default 100:1:100)'
+        )
+        parser.add_argument(
+            '--holdings',
+            type=int,
+            default=10,
+            help='Holdings per synthetic portfolio'
+        )
+        parser.add_argument(
+            '--order-legs',
+            type=int,
+            default=50,
+            help='Legs per basket when comparing single orders against the batch order endpoint'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='Runs per measured method'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Seed for the synthetic data'
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='Write the JSON report to this file instead of stdout'
+        )
+
+    def parse_scale(self, scale):
+        try:
+            stocks, years, portfolios = (int(value) for value in scale.split(':'))
+        except ValueError:
+            raise CommandError(f'Invalid scale "{scale}", expected STOCKS:YEARS:PORTFOLIOS')
+        if stocks <= 0 or years <= 0 or portfolios < 0:
+            raise CommandError(f'Invalid scale "{scale}"')
+        return stocks, years, portfolios
+
+    def build_dataset(self, stocks, years, portfolios, holdings, seed):
+        rng = random.Random(seed)
+
+        Stock.objects.bulk_create([Stock(symbol=f'B{i}', name=f'Bench {i}') for i in range(stocks)], batch_size=5000)
+        stock_ids = list(Stock.objects.order_by('id').values_list('id', flat=True))
+        start = date(date.today().year - years, 1, 1)
+        StockPrice.objects.bulk_create(
+            [StockPrice(stock_id=stock_id, date=start, price=Decimal(rng.randint(5, 500)), volume=1000000) for stock_id in stock_ids],
+            batch_size=5000
+        )
+
+        # La historia se genera con el mismo simulador vectorizado que usa la app
+        for year in range(years):
+            StockDataService.simulate_time_forward(365, 'days', seed=seed + year)
+
+        owner = User.objects.create(username=f'bench-{seed}')
+        Portfolio.objects.bulk_create(
+            [Portfolio(owner=owner, name=f'Bench {i}', cash_balance=Decimal('10000.00')) for i in range(portfolios)],
+            batch_size=5000
+        )
+        portfolio_ids = list(Portfolio.objects.order_by('id').values_list('id', flat=True))
+        prices = dict(Stock.objects.values_list('id', 'latest_price'))
+
+        new_holdings = []
+        new_allocations = []
+        per_portfolio = min(holdings, len(stock_ids))
+        for portfolio_id in portfolio_ids:
+            for stock_id in rng.sample(stock_ids, per_portfolio):
+                new_holdings.append(Holding(
+                    portfolio_id=portfolio_id,
+                    stock_id=stock_id,
+                    shares=Decimal(rng.randint(1, 100)),
+                    average_price=prices[stock_id]
+                ))
+                new_allocations.append(TargetAllocation(
+                    portfolio_id=portfolio_id,
+                    stock_id=stock_id,
+                    target_percent=100 / per_portfolio
+                ))
+        Holding.objects.bulk_create(new_holdings, batch_size=5000)
+        TargetAllocation.objects.bulk_create(new_allocations, batch_size=5000)
+
+        return stock_ids, portfolio_ids
+
+    def measure(self, repeat, func):
+        # Una corrida de calentamiento que no se mide
+        func(repeat)
+        timings = []
+        queries = []
+        for run in range(repeat):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                func(run)
+                timings.append((time.perf_counter() - started) * 1000)
+            queries.append(len(context.captured_queries))
+        return {
+            'wall_ms_median': statistics.median(timings),
+            'wall_ms_min': min(timings),
+            'wall_ms_max': max(timings),
+            'queries': max(queries),
+        }
+
+    def run_scale(self, stocks, years, portfolios, options):
+        # El cache y la matriz de precios son compartidos con la app real: la corrida usa los suyos
+        with tempfile.TemporaryDirectory() as matrix_dir, override_settings(
+            CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}},
+            PRICE_MATRIX_DIR=matrix_dir,
+        ):
+            return self.measure_scale(stocks, years, portfolios, options)
+
+    def measure_scale(self, stocks, years, portfolios, options):
+        repeat = options['repeat']
+        # Cada escala parte de una base vacía
+        call_command('flush', interactive=False, verbosity=0)
+        cache.clear()
+
+        started = time.perf_counter()
+        stock_ids, portfolio_ids = self.build_dataset(stocks, years, portfolios, options['holdings'], options['seed'])
+        setup_seconds = time.perf_counter() - started
+
+        pick_portfolio = lambda run: portfolio_ids[run % len(portfolio_ids)]
+        pick_stock = lambda run: stock_ids[run % len(stock_ids)]
+        client = Client()
+
+        def price_history(run):
+            cache.clear()
+            StockDataService.get_stock_price_history(pick_stock(run))
+
+        def price_history_long(run):
+            cache.clear()
+            StockDataService.get_stock_price_history(pick_stock(run), start_date=date(date.today().year - years, 1, 1))
+
+        targets = {
+            'get_stock_price_history': price_history,
+            'get_stock_price_history_full_range': price_history_long,
+            'get_stock_price_history_cached': lambda run: StockDataService.get_stock_price_history(pick_stock(0)),
+            'home_view': lambda run: client.get('/'),
+        }
+        if portfolio_ids:
+            targets.update({
+                'get_portfolio_with_holdings': lambda run: PortfolioService.get_portfolio_with_holdings(pick_portfolio(run)),
+                'get_info_to_rebalance_portafolio': lambda run: PortfolioService.get_info_to_rebalance_portafolio(pick_portfolio(run)),
+                'rebalance_portfolio': lambda run: PortfolioService.rebalance_portfolio(pick_portfolio(run)),
+            })
+            # La misma canasta enviada orden por orden y en un solo request
+            basket = stock_ids[:options['order_legs']]
+
+            def single_orders(run):
+                for stock_id in basket:
+                    client.post('/api/buy-stock/', {'portfolio_id': pick_portfolio(run), 'stock_id': stock_id, 'shares': '0.01'})
+
+            def batch_order(run):
+                client.post('/api/orders/', json.dumps({
+                    'portfolio_id': pick_portfolio(run),
+                    'legs': [{'stock_id': stock_id, 'side': 'buy', 'shares': '0.01'} for stock_id in basket],
+                }), content_type='application/json')
+
+            targets.update({
+                f'buy_stock_x{len(basket)}': single_orders,
+                f'batch_order_{len(basket)}_legs': batch_order,
+            })
+        # La simulación agrega precios, así que se mide al final
+        targets['simulate_time_forward'] = lambda run: StockDataService.simulate_time_forward(1, 'days', seed=run)
+
+        results = {}
+        for name, func in targets.items():
+            results[name] = self.measure(repeat, func)
+
+        return {
+            'stocks': stocks,
+            'years': years,
+            'portfolios': portfolios,
+            'holdings_per_portfolio': options['holdings'],
+            'setup_seconds': setup_seconds,
+            'results': results,
+        }
+
+    def handle(self, *args, **options):
+        scales = [self.parse_scale(scale) for scale in (options['scales'] or ['100:1:100'])]
+
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+
+        report = {
+            'generated_at': datetime.now().isoformat(),
+            'commit': commit,
+            'database': connection.vendor,
+            'repeat': options['repeat'],
+            'scales': [],
+        }
+
+        # Todo se mide sobre una base de datos de prueba, nunca sobre la real
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            for stocks, years, portfolios in scales:
+                self.stdout.write(self.style.WARNING(f'Benchmarking {stocks} stocks, {years} year(s), {portfolios} portfolios...'))
+                report['scales'].append(self.run_scale(stocks, years, portfolios, options))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output)
+            self.stdout.write(self.style.SUCCESS(f'Benchmark written to {options["output"]}'))
+        else:
+            self.stdout.write(output)
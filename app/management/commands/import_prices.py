@@ -0,0 +1,79 @@
+import os
+from django.core.management.base import BaseCommand
+from app.services import PriceImportService
+
+
+class Command(BaseCommand):
+    help = 'Import historical OHLCV prices from CSV or Parquet files with resumable checkpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'paths',
+            nargs='+',
+            type=str,
+            help='CSV/Parquet files or directories containing them'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50000,
+            help='Number of rows validated and upserted per transaction'
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Ignore existing checkpoints and import every file from the beginning'
+        )
+
+    def collect_files(self, paths):
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                files.extend(
+                    os.path.join(path, name) for name in sorted(os.listdir(path))
+                    if name.endswith(('.csv', '.parquet'))
+                )
+            else:
+                files.append(path)
+        return files
+
+    def handle(self, *args, **options):
+        files_completed = 0
+        rows_imported = 0
+        rows_rejected = 0
+        
+        for path in self.collect_files(options['paths']):
+            self.stdout.write(self.style.WARNING(f'Importing {path}...'))
+            
+            try:
+                result = PriceImportService.import_file(
+                    path,
+                    batch_size=options['batch_size'],
+                    restart=options['restart']
+                )
+            except FileNotFoundError:
+                self.stdout.write(self.style.ERROR(f'File not found: {path}'))
+                continue
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'Error importing {path}: {str(e)}'))
+                continue
+            
+            if result['already_completed']:
+                self.stdout.write('Already imported (use --restart to import it again)')
+            elif result['resumed_from']:
+                self.stdout.write(f'Resumed from checkpoint at position {result["resumed_from"]}')
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'{path}: {result["rows_imported"]} rows imported, {result["rows_rejected"]} rejected'
+                )
+            )
+            files_completed += 1
+            rows_imported += result['rows_imported']
+            rows_rejected += result['rows_rejected']
+        
+        # Summary
+        self.stdout.write(self.style.SUCCESS('\n' + '='*50))
+        self.stdout.write(self.style.SUCCESS(f'Files completed: {files_completed}'))
+        self.stdout.write(self.style.SUCCESS(f'Rows imported: {rows_imported}'))
+        self.stdout.write(self.style.SUCCESS(f'Rows rejected: {rows_rejected}'))
+        self.stdout.write(self.style.SUCCESS('='*50))
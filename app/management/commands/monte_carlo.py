@@ -0,0 +1,81 @@
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from app.services import MonteCarloService, RISK_DEFAULT_DAYS
+
+
+class Command(BaseCommand):
+    help = 'Run an in-memory Monte Carlo (correlated GBM) simulation of a portfolio without writing prices'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'portfolio_id',
+            type=int,
+            help='Portfolio to simulate'
+        )
+        parser.add_argument(
+            '--paths',
+            type=int,
+            default=10000,
+            help='Number of simulated paths'
+        )
+        parser.add_argument(
+            '--horizon',
+            type=int,
+            default=252,
+            help='Simulated steps (days of price history)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of worker processes'
+        )
+        parser.add_argument(
+            '--lookback',
+            type=int,
+            default=RISK_DEFAULT_DAYS,
+            help='Days of history used to estimate drift and covariance'
+        )
+        parser.add_argument(
+            '--cost-bps',
+            type=Decimal,
+            default=Decimal('10'),
+            help='Trading cost in basis points applied to the rebalance at the horizon'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=None,
+            help='Seed for reproducible paths'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            result = MonteCarloService.simulate_portfolio(
+                options['portfolio_id'],
+                paths=options['paths'],
+                horizon=options['horizon'],
+                seed=options['seed'],
+                workers=options['workers'],
+                lookback_days=options['lookback'],
+                cost_bps=options['cost_bps']
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for step in result['bands']:
+            self.stdout.write(
+                f'Step {step["step"]:>4}: p5 ${step["p5"]:,.2f}  p50 ${step["p50"]:,.2f}  p95 ${step["p95"]:,.2f}'
+            )
+
+        terminal = result['terminal_value']
+        cost = result['rebalance_cost']
+        # Summary
+        self.stdout.write(self.style.SUCCESS('\n' + '='*50))
+        self.stdout.write(self.style.SUCCESS(f'Paths: {result["paths"]} x {result["horizon"]} steps x {len(result["symbols"])} holdings'))
+        self.stdout.write(self.style.SUCCESS(f'Initial value: ${result["initial_value"]:,.2f}'))
+        self.stdout.write(self.style.SUCCESS(f'Terminal value p5/p50/p95: ${terminal["p5"]:,.2f} / ${terminal["p50"]:,.2f} / ${terminal["p95"]:,.2f}'))
+        self.stdout.write(self.style.SUCCESS(f'Probability of loss: {result["probability_of_loss"]:.1%}'))
+        self.stdout.write(self.style.SUCCESS(f'Rebalance cost p50/p95: ${cost["p50"]:,.2f} / ${cost["p95"]:,.2f}'))
+        self.stdout.write(self.style.SUCCESS(f'Elapsed: {result["elapsed_seconds"]:.2f}s'))
+        self.stdout.write(self.style.SUCCESS('='*50))
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from app.services import PortfolioService
+
+
+class Command(BaseCommand):
+    help = 'Rebalance every portfolio using a shared price snapshot and a worker pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Number of portfolios loaded, planned and saved per transaction'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of pool workers computing rebalance plans'
+        )
+        parser.add_argument(
+            '--processes',
+            action='store_true',
+            help='Use a process pool instead of a thread pool'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.WARNING('Rebalancing all portfolios...'))
+        
+        try:
+            report = PortfolioService.rebalance_all(
+                chunk_size=options['chunk_size'],
+                workers=options['workers'],
+                use_processes=options['processes']
+            )
+        except ValueError as e:
+            self.stdout.write(self.style.ERROR(str(e)))
+            return
+        
+        for failure in report['failures']:
+            self.stdout.write(
+                self.style.ERROR(f'Portfolio {failure["portfolio_id"]}: {failure["error"]}')
+            )
+        
+        # Summary
+        self.stdout.write(self.style.SUCCESS('\n' + '='*50))
+        self.stdout.write(self.style.SUCCESS(f'Portfolios processed: {report["portfolios_total"]}'))
+        self.stdout.write(self.style.SUCCESS(f'Portfolios rebalanced: {report["rebalanced"]}'))
+        self.stdout.write(self.style.SUCCESS(f'Portfolios failed: {report["failed"]}'))
+        self.stdout.write(self.style.SUCCESS(f'Operations planned: {report["operations_count"]}'))
+        self.stdout.write(self.style.SUCCESS(f'Elapsed: {report["elapsed_seconds"]:.2f}s'))
+        self.stdout.write(self.style.SUCCESS(f'Throughput: {report["portfolios_per_second"]:.1f} portfolios/s'))
+        self.stdout.write(self.style.SUCCESS('='*50))
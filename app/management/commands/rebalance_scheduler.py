@@ -0,0 +1,170 @@
+import queue
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from app.services import PortfolioService
+
+
+class Command(BaseCommand):
+    help = 'Watch portfolio drift and rebalance only the portfolios outside their band'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--band',
+            type=Decimal,
+            default=None,
+            help='Default drift band in percent for portfolios without their own (default REBALANCE_DRIFT_BAND)'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=30,
+            help='Seconds between drift checks'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=2,
+            help='Number of worker threads running rebalances'
+        )
+        parser.add_argument(
+            '--queue-size',
+            type=int,
+            default=100,
+            help='Maximum portfolios waiting in the queue; the rest wait for the next check'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=50,
+            help='Maximum portfolios a worker rebalances together and saves in one bulk commit'
+        )
+        parser.add_argument(
+            '--cooldown',
+            type=float,
+            default=300,
+            help='Seconds before a portfolio can be rebalanced again'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run a single check, wait for the queue to drain and exit'
+        )
+
+    def handle(self, *args, **options):
+        band = options['band'] if options['band'] is not None else Decimal(str(settings.REBALANCE_DRIFT_BAND))
+        if band < 0 or min(options['workers'], options['queue_size'], options['batch_size'], options['interval']) <= 0:
+            raise CommandError('band must be >= 0 and interval, workers, queue-size and batch-size must be greater than 0')
+
+        self.jobs = queue.Queue(maxsize=options['queue_size'])
+        self.lock = threading.Lock()
+        self.in_flight = set()
+        self.last_attempt = {}
+        self.stats = Counter()
+        self.cooldown = options['cooldown']
+        self.batch_size = options['batch_size']
+
+        workers = [threading.Thread(target=self.work, daemon=True) for _ in range(options['workers'])]
+        for worker in workers:
+            worker.start()
+
+        self.stdout.write(self.style.WARNING(f'Watching drift with a {band}% band and {len(workers)} worker(s)...'))
+        try:
+            while True:
+                self.enqueue_cycle(band, block=options['once'])
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Stopping, waiting for queued rebalances...'))
+        finally:
+            for _ in workers:
+                self.jobs.put(None)
+            for worker in workers:
+                worker.join()
+
+        # Summary
+        self.stdout.write(self.style.SUCCESS('\n' + '='*50))
+        self.stdout.write(self.style.SUCCESS(f'Portfolios enqueued: {self.stats["enqueued"]}'))
+        self.stdout.write(self.style.SUCCESS(f'Portfolios rebalanced: {self.stats["rebalanced"]}'))
+        self.stdout.write(self.style.SUCCESS(f'Portfolios failed: {self.stats["failed"]}'))
+        self.stdout.write(self.style.SUCCESS(f'Deferred by a full queue: {self.stats["deferred"]}'))
+        self.stdout.write(self.style.SUCCESS(f'Operations planned: {self.stats["operations"]}'))
+        self.stdout.write(self.style.SUCCESS('='*50))
+
+    def enqueue_cycle(self, band, block):
+        candidates = PortfolioService.portfolios_over_band(band)
+        now = time.monotonic()
+        enqueued = 0
+        for index, (portfolio_id, drift) in enumerate(candidates):
+            with self.lock:
+                if portfolio_id in self.in_flight:
+                    continue
+                if now - self.last_attempt.get(portfolio_id, float('-inf')) < self.cooldown:
+                    continue
+                self.in_flight.add(portfolio_id)
+
+            # Con la cola llena no seguimos encolando: los que quedan siguen fuera de banda y entran en la próxima revisión
+            try:
+                self.jobs.put(portfolio_id, block=block)
+            except queue.Full:
+                with self.lock:
+                    self.in_flight.discard(portfolio_id)
+                self.stats['deferred'] += len(candidates) - index
+                break
+            enqueued += 1
+
+        self.stats['enqueued'] += enqueued
+        self.stdout.write(f'{len(candidates)} portfolio(s) over band, {enqueued} enqueued, {self.jobs.qsize()} waiting')
+        # No dejamos la conexión del hilo principal abierta mientras esperamos la próxima revisión
+        connection.close()
+
+    def next_batch(self):
+        # Bloquea hasta el primer portafolio y se lleva lo que ya esté esperando, hasta batch_size
+        batch = [self.jobs.get()]
+        while batch[-1] is not None and len(batch) < self.batch_size:
+            try:
+                batch.append(self.jobs.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def work(self):
+        try:
+            stop = False
+            while not stop:
+                batch = self.next_batch()
+                stop = batch[-1] is None
+                portfolio_ids = [portfolio_id for portfolio_id in batch if portfolio_id is not None]
+                try:
+                    if portfolio_ids:
+                        self.rebalance(portfolio_ids)
+                finally:
+                    with self.lock:
+                        for portfolio_id in portfolio_ids:
+                            self.in_flight.discard(portfolio_id)
+                            self.last_attempt[portfolio_id] = time.monotonic()
+                    for _ in batch:
+                        self.jobs.task_done()
+        finally:
+            connection.close()
+
+    def rebalance(self, portfolio_ids):
+        try:
+            report = PortfolioService.rebalance_batch(portfolio_ids)
+        except Exception as e:
+            with self.lock:
+                self.stats['failed'] += len(portfolio_ids)
+            self.stdout.write(self.style.ERROR(f'Batch {portfolio_ids}: {str(e)}'))
+            return
+
+        with self.lock:
+            self.stats['rebalanced'] += report['rebalanced']
+            self.stats['failed'] += len(report['failures'])
+            self.stats['operations'] += report['operations_count']
+        for failure in report['failures']:
+            self.stdout.write(self.style.ERROR(f'Portfolio {failure["portfolio_id"]}: {failure["error"]}'))
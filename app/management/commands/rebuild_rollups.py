@@ -0,0 +1,33 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from app.models import Stock, StockPrice, StockPriceRollup
+
+
+class Command(BaseCommand):
+    help = 'Rebuild weekly and monthly price rollups from StockPrice history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='Number of stocks processed per batch'
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        stock_ids = list(Stock.objects.order_by('id').values_list('id', flat=True))
+        
+        self.stdout.write(self.style.WARNING(f'Rebuilding rollups for {len(stock_ids)} stocks...'))
+        
+        for i in range(0, len(stock_ids), batch_size):
+            chunk = stock_ids[i:i + batch_size]
+            stock_dates = defaultdict(set)
+            for stock_id, price_date in StockPrice.objects.filter(stock_id__in=chunk).values_list('stock_id', 'date'):
+                stock_dates[stock_id].add(price_date)
+            StockPriceRollup.refresh_periods(stock_dates)
+            self.stdout.write(f'Processed {min(i + batch_size, len(stock_ids))}/{len(stock_ids)} stocks')
+        
+        self.stdout.write(self.style.SUCCESS('\n' + '='*50))
+        self.stdout.write(self.style.SUCCESS(f'Rollups stored: {StockPriceRollup.objects.count()}'))
+        self.stdout.write(self.style.SUCCESS('='*50))
@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from app.price_matrix import build_price_matrix, refresh_price_matrix
+
+
+class Command(BaseCommand):
+    help = 'Build or incrementally extend the memory-mapped price matrix used by analytics'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Rebuild the whole matrix from StockPrice (needed after backfilling old dates)'
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['rebuild']:
+            result = build_price_matrix()
+        else:
+            result = refresh_price_matrix()
+
+        # Summary
+        self.stdout.write(self.style.SUCCESS('\n' + '='*50))
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt: {"yes" if result["rebuilt"] else "no"}'))
+        self.stdout.write(self.style.SUCCESS(f'Dates added: {result["rows_added"]}'))
+        self.stdout.write(self.style.SUCCESS(f'Matrix size: {result["rows"]} dates x {result["stocks"]} stocks'))
+        self.stdout.write(self.style.SUCCESS(f'Elapsed: {time.perf_counter() - started:.2f}s'))
+        self.stdout.write(self.style.SUCCESS('='*50))
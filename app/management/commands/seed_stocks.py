@@ -1,7 +1,9 @@
 import csv
 from decimal import Decimal, InvalidOperation
-from datetime import date
+from datetime import date, datetime
+from itertools import islice
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from app.models import Stock, StockPrice
 
 
@@ -15,69 +17,130 @@ class Command(BaseCommand):
             default='data/nasdaq_screener.csv',
             help='Path to the NASDAQ CSV file (relative to project root)'
         )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=100,
+            help='Maximum number of new stocks to create (0 = no limit)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Number of CSV rows read and written per batch'
+        )
+
+    def parse_row(self, row):
+        symbol = row.get('Symbol', '').strip()
+        name = row.get('Name', '').strip()
+        last_sale = row.get('Last Sale', '').strip()
+        volume_str = row.get('Volume', '').strip()
+        date_str = row.get('Date', '').strip()
+
+        try:
+            if last_sale and last_sale.startswith('$'):
+                price = Decimal(last_sale.replace('$', '').replace(',', ''))
+            else:
+                price = None
+        except (InvalidOperation, ValueError):
+            price = None
+
+        try:
+            volume = int(volume_str.replace(',', '')) if volume_str else None
+        except ValueError:
+            volume = None
+
+        # Los archivos de historia traen una columna Date; el screener es el precio de hoy
+        try:
+            price_date = datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else date.today()
+        except ValueError:
+            price_date = None
+
+        return symbol, name, price, volume, price_date
+
+    def ingest_chunk(self, rows, remaining):
+        names = {}
+        prices = {}
+        invalid = 0
+        for symbol, name, price, volume, price_date in rows:
+            if not symbol:
+                invalid += 1
+                continue
+            names.setdefault(symbol, name)
+            if price is not None and price_date is not None:
+                prices[(symbol, price_date)] = (price, volume)
+
+        # Una sola query para saber qué símbolos ya existen
+        stock_ids = dict(Stock.objects.filter(symbol__in=names.keys()).values_list('symbol', 'id'))
+        new_symbols = [symbol for symbol in names if symbol not in stock_ids]
+        existing = len(names) - len(new_symbols)
+        # Los símbolos nuevos que pasan del límite no se crean, pero tampoco son filas descartadas
+        over_limit = 0
+        if remaining is not None:
+            over_limit = max(len(new_symbols) - remaining, 0)
+            new_symbols = new_symbols[:remaining]
+            allowed = set(stock_ids) | set(new_symbols)
+            prices = {key: value for key, value in prices.items() if key[0] in allowed}
+
+        with transaction.atomic():
+            if new_symbols:
+                Stock.objects.bulk_create(
+                    [Stock(symbol=symbol, name=names[symbol]) for symbol in new_symbols],
+                    ignore_conflicts=True
+                )
+                stock_ids.update(Stock.objects.filter(symbol__in=new_symbols).values_list('symbol', 'id'))
+
+            existing_prices = set(
+                StockPrice.objects.filter(
+                    stock_id__in=[stock_ids[symbol] for symbol, _ in prices],
+                    date__in={price_date for _, price_date in prices}
+                ).values_list('stock_id', 'date')
+            ) if prices else set()
+
+            new_prices = [
+                StockPrice(stock_id=stock_ids[symbol], date=price_date, price=price, volume=volume)
+                for (symbol, price_date), (price, volume) in prices.items()
+                if (stock_ids[symbol], price_date) not in existing_prices
+            ]
+            if new_prices:
+                StockPrice.objects.bulk_create(new_prices, batch_size=5000, ignore_conflicts=True)
+
+        return len(new_symbols), existing, over_limit, invalid, len(new_prices)
 
     def handle(self, *args, **options):
         csv_path = options['csv_path']
-        
+        limit = options['limit'] or None
+        chunk_size = options['chunk_size']
+
         self.stdout.write(self.style.WARNING(f'Reading CSV from: {csv_path}'))
-        
-        # Para no crear demasiados stocks en una sola corrida
-        total_stocks_to_create = 100
+
         stocks_created = 0
         prices_created = 0
-        stocks_skipped = 0
-        
+        stocks_existing = 0
+        stocks_over_limit = 0
+        rows_invalid = 0
+
         try:
             with open(csv_path, 'r', encoding='utf-8') as file:
                 reader = csv.DictReader(file)
-                
-                for row in reader:
-                    symbol = row.get('Symbol', '').strip()
-                    name = row.get('Name', '').strip()
-                    last_sale = row.get('Last Sale', '').strip()
-                    volume_str = row.get('Volume', '').strip()
-                    
-                    if not symbol:
-                        continue
-                    
-                    stock, created = Stock.objects.get_or_create(
-                        symbol=symbol,
-                        defaults={'name': name}
-                    )
-                    
-                    if created:
-                        stocks_created += 1
-                        self.stdout.write(f'Created stock: {symbol} - {name}')
-                    else:
-                        stocks_skipped += 1
-                    
-                    try:
-                        if last_sale and last_sale.startswith('$'):
-                            price = Decimal(last_sale.replace('$', '').replace(',', ''))
-                        else:
-                            price = None
-                    except (InvalidOperation, ValueError):
-                        price = None
-                    
-                    try:
-                        volume = int(volume_str.replace(',', '')) if volume_str else None
-                    except ValueError:
-                        volume = None
-                    
-                    if price is not None:
-                        stock_price, price_created = StockPrice.objects.get_or_create(
-                            stock=stock,
-                            date=date.today(),
-                            defaults={
-                                'price': price,
-                                'volume': volume
-                            }
-                        )
-                        
-                        if price_created:
-                            prices_created += 1
-        
-                    if stocks_created >= total_stocks_to_create:
+
+                # Leemos el archivo por bloques para no cargarlo completo en memoria
+                while True:
+                    rows = [self.parse_row(row) for row in islice(reader, chunk_size)]
+                    if not rows:
+                        break
+
+                    remaining = limit - stocks_created if limit is not None else None
+                    created, existing, over_limit, invalid, chunk_prices = self.ingest_chunk(rows, remaining)
+                    stocks_created += created
+                    stocks_existing += existing
+                    stocks_over_limit += over_limit
+                    rows_invalid += invalid
+                    prices_created += chunk_prices
+                    self.stdout.write(f'Processed {len(rows)} rows: {created} stocks, {chunk_prices} prices created')
+
+                    # Alcanzado el límite no se sigue leyendo: el resto del archivo no se cuenta
+                    if limit is not None and stocks_created >= limit:
                         break
 
         except FileNotFoundError:
@@ -90,10 +153,16 @@ class Command(BaseCommand):
                 self.style.ERROR(f'Error processing CSV: {str(e)}')
             )
             return
-        
+
         # Summary
         self.stdout.write(self.style.SUCCESS('\n' + '='*50))
         self.stdout.write(self.style.SUCCESS(f'Stocks created: {stocks_created}'))
-        self.stdout.write(self.style.SUCCESS(f'Stocks skipped (already exist): {stocks_skipped}'))
+        self.stdout.write(self.style.SUCCESS(f'Stocks skipped (already exist): {stocks_existing}'))
+        if stocks_over_limit:
+            self.stdout.write(self.style.WARNING(
+                f'New stocks not created (over --limit, rest of file not read): {stocks_over_limit}'
+            ))
+        if rows_invalid:
+            self.stdout.write(self.style.WARNING(f'Rows skipped (missing symbol): {rows_invalid}'))
         self.stdout.write(self.style.SUCCESS(f'Stock prices created: {prices_created}'))
         self.stdout.write(self.style.SUCCESS('='*50))
@@ -0,0 +1,40 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from app.models import Portfolio
+from app.services import LedgerService
+
+
+class Command(BaseCommand):
+    help = 'Snapshot portfolio positions so state as of a date only replays a short ledger tail'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-trades',
+            type=int,
+            default=100,
+            help='Only snapshot portfolios with at least this many trades since their last snapshot'
+        )
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Snapshot every portfolio regardless of its trade count'
+        )
+
+    def handle(self, *args, **options):
+        if options['min_trades'] <= 0:
+            raise CommandError('min-trades must be greater than 0')
+
+        started = time.perf_counter()
+        if options['all']:
+            portfolio_ids = list(Portfolio.objects.order_by('id').values_list('id', flat=True))
+        else:
+            portfolio_ids = LedgerService.portfolios_needing_snapshot(options['min_trades'])
+
+        self.stdout.write(self.style.WARNING(f'Snapshotting {len(portfolio_ids)} portfolio(s)...'))
+        created = LedgerService.snapshot_portfolios(portfolio_ids)
+
+        # Summary
+        self.stdout.write(self.style.SUCCESS('\n' + '='*50))
+        self.stdout.write(self.style.SUCCESS(f'Snapshots created: {created}'))
+        self.stdout.write(self.style.SUCCESS(f'Elapsed: {time.perf_counter() - started:.2f}s'))
+        self.stdout.write(self.style.SUCCESS('='*50))
@@ -0,0 +1,145 @@
+import random
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextlib import ExitStack
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')
+LITERAL_RE = re.compile(r"'[^']*'|\b\d+(?:\.\d+)?\b")
+
+
+def query_fingerprint(sql: str) -> str:
+    # Dos queries con la misma forma (solo cambian los parámetros) comparten fingerprint
+    sql = IN_LIST_RE.sub('IN (...)', sql)
+    return LITERAL_RE.sub('?', sql)
+
+
+def percentile(values: list, percent: float) -> float:
+    if not values:
+        return 0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class RequestMetrics:
+    def __init__(self, max_samples: int):
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.samples = defaultdict(lambda: deque(maxlen=self.max_samples))
+        self.duplicates = defaultdict(Counter)
+
+    def record(self, url_name: str, sample: dict, duplicates: dict) -> None:
+        with self.lock:
+            self.samples[url_name].append(sample)
+            self.duplicates[url_name].update(duplicates)
+
+    def summary(self) -> dict:
+        with self.lock:
+            snapshot = {name: list(samples) for name, samples in self.samples.items()}
+            duplicates = {name: counter.most_common(5) for name, counter in self.duplicates.items()}
+
+        result = {}
+        for url_name, samples in snapshot.items():
+            result[url_name] = {'requests': len(samples)}
+            for field in ('view_ms', 'db_ms', 'queries'):
+                values = [sample[field] for sample in samples]
+                result[url_name][field] = {
+                    'p50': percentile(values, 50),
+                    'p90': percentile(values, 90),
+                    'p99': percentile(values, 99),
+                    'max': max(values),
+                }
+            result[url_name]['top_duplicate_queries'] = [
+                {'fingerprint': fingerprint, 'count': count}
+                for fingerprint, count in duplicates.get(url_name, [])
+            ]
+        return result
+
+    def reset(self) -> None:
+        with self.lock:
+            self.samples.clear()
+            self.duplicates.clear()
+
+
+request_metrics = RequestMetrics(getattr(settings, 'REQUEST_METRICS_MAX_SAMPLES', 1000))
+
+
+class QueryInstrumentationMiddleware:
+    # Soporta ambos modos para que las vistas async no se ejecuten en un hilo por request
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'REQUEST_METRICS_SAMPLE_RATE', 1.0)
+        self.response_headers = getattr(settings, 'REQUEST_METRICS_HEADERS', settings.DEBUG)
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def install_wrappers(stack, queries):
+        def record_query(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries.append((sql, time.perf_counter() - started))
+
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(record_query))
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        queries = []
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            self.install_wrappers(stack, queries)
+            response = self.get_response(request)
+        view_ms = (time.perf_counter() - started) * 1000
+        return self.record(request, response, queries, view_ms)
+
+    async def __acall__(self, request):
+        if random.random() >= self.sample_rate:
+            return await self.get_response(request)
+
+        # El ORM async corre en el hilo sync del request; los wrappers se instalan en sus conexiones
+        queries = []
+        stack = ExitStack()
+        started = time.perf_counter()
+        await sync_to_async(self.install_wrappers)(stack, queries)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        view_ms = (time.perf_counter() - started) * 1000
+        return self.record(request, response, queries, view_ms)
+
+    def record(self, request, response, queries, view_ms):
+        db_ms = sum(duration for _, duration in queries) * 1000
+        fingerprints = Counter(query_fingerprint(sql) for sql, _ in queries)
+        duplicates = {fingerprint: count for fingerprint, count in fingerprints.items() if count > 1}
+
+        match = getattr(request, 'resolver_match', None)
+        url_name = match.url_name if match and match.url_name else 'unresolved'
+        request_metrics.record(url_name, {
+            'view_ms': view_ms,
+            'db_ms': db_ms,
+            'queries': len(queries),
+        }, duplicates)
+
+        if self.response_headers:
+            response['X-DB-Queries'] = str(len(queries))
+            response['X-DB-Time-Ms'] = f'{db_ms:.2f}'
+            response['X-View-Time-Ms'] = f'{view_ms:.2f}'
+            response['X-Duplicate-Queries'] = str(sum(count - 1 for count in duplicates.values()))
+        return response
@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:22
+
+from django.db import migrations, models
+
+
+def backfill_latest_prices(apps, schema_editor):
+    Stock = apps.get_model('app', 'Stock')
+    StockPrice = apps.get_model('app', 'StockPrice')
+    latest = StockPrice.objects.filter(stock_id=models.OuterRef('pk')).order_by('-date')
+    Stock.objects.update(
+        latest_price=models.Subquery(latest.values('price')[:1]),
+        latest_price_date=models.Subquery(latest.values('date')[:1]),
+        latest_volume=models.Subquery(latest.values('volume')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_portfolio_cash_balance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stock',
+            name='latest_price',
+            field=models.DecimalField(blank=True, decimal_places=8, max_digits=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='stock',
+            name='latest_price_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='stock',
+            name='latest_volume',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_latest_prices, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_stock_latest_price'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=500, unique=True)),
+                ('file_size', models.BigIntegerField()),
+                ('file_mtime', models.FloatField()),
+                ('position', models.BigIntegerField(default=0)),
+                ('rows_imported', models.BigIntegerField(default=0)),
+                ('rows_rejected', models.BigIntegerField(default=0)),
+                ('completed', models.BooleanField(default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='stockprice',
+            name='high_price',
+            field=models.DecimalField(blank=True, decimal_places=8, max_digits=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='stockprice',
+            name='low_price',
+            field=models.DecimalField(blank=True, decimal_places=8, max_digits=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='stockprice',
+            name='open_price',
+            field=models.DecimalField(blank=True, decimal_places=8, max_digits=20, null=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_stockprice_ohlc_importcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockPriceRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('week', 'Weekly'), ('month', 'Monthly')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('open_price', models.DecimalField(blank=True, decimal_places=8, max_digits=20, null=True)),
+                ('high_price', models.DecimalField(blank=True, decimal_places=8, max_digits=20, null=True)),
+                ('low_price', models.DecimalField(blank=True, decimal_places=8, max_digits=20, null=True)),
+                ('close_price', models.DecimalField(blank=True, decimal_places=8, max_digits=20, null=True)),
+                ('avg_price', models.DecimalField(blank=True, decimal_places=8, max_digits=20, null=True)),
+                ('volume', models.BigIntegerField(blank=True, null=True)),
+                ('days', models.PositiveIntegerField(default=0)),
+                ('stock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='app.stock')),
+            ],
+            options={
+                'ordering': ['period_start'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='stockpricerollup',
+            constraint=models.UniqueConstraint(fields=('stock', 'resolution', 'period_start'), name='unique_stock_rollup_period'),
+        ),
+    ]
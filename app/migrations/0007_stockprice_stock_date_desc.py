@@ -0,0 +1,40 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:30
+
+from django.db import migrations, models
+
+
+def _stock_date_index(include):
+    return models.Index(fields=['stock', '-date'], include=include, name='stockprice_stock_date_desc')
+
+
+def add_stock_date_index(apps, schema_editor):
+    # Las columnas cubiertas solo donde la base las soporta; en SQLite queda el índice simple
+    covering = schema_editor.connection.features.supports_covering_indexes
+    StockPrice = apps.get_model('app', 'StockPrice')
+    schema_editor.add_index(StockPrice, _stock_date_index(('price', 'volume') if covering else None))
+
+
+def remove_stock_date_index(apps, schema_editor):
+    StockPrice = apps.get_model('app', 'StockPrice')
+    schema_editor.remove_index(StockPrice, _stock_date_index(None))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_stockpricerollup'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='stockprice',
+                    index=_stock_date_index(None),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(add_stock_date_index, remove_stock_date_index),
+            ],
+        ),
+    ]
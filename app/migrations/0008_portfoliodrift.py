@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_stockprice_stock_date_desc'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PortfolioDrift',
+            fields=[
+                ('portfolio', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='drift_state', serialize=False, to='app.portfolio')),
+                ('market_value', models.DecimalField(decimal_places=8, default=0, max_digits=20)),
+                ('holding_count', models.IntegerField(default=0)),
+                ('drift', models.DecimalField(decimal_places=8, default=0, max_digits=12)),
+                ('preview', models.JSONField(default=dict)),
+                ('stale', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['stale'], name='portfoliodrift_stale'), models.Index(fields=['-drift'], name='portfoliodrift_drift_desc')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0008_portfoliodrift'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='portfolio',
+            name='rebalance_band',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=6, null=True),
+        ),
+    ]
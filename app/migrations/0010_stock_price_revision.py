@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_portfolio_rebalance_band'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stock',
+            name='price_revision',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
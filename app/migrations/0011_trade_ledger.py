@@ -0,0 +1,62 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def create_baseline_snapshots(apps, schema_editor):
+    # Sin historial previo, el estado actual es el punto de partida del ledger
+    Portfolio = apps.get_model('app', 'Portfolio')
+    Holding = apps.get_model('app', 'Holding')
+    PositionSnapshot = apps.get_model('app', 'PositionSnapshot')
+    positions = {}
+    for portfolio_id, stock_id, shares, average_price in Holding.objects.values_list(
+        'portfolio_id', 'stock_id', 'shares', 'average_price'
+    ):
+        positions.setdefault(portfolio_id, {})[str(stock_id)] = [str(shares), str(average_price)]
+    PositionSnapshot.objects.bulk_create([
+        PositionSnapshot(portfolio_id=portfolio_id, cash_balance=cash_balance, positions=positions.get(portfolio_id, {}))
+        for portfolio_id, cash_balance in Portfolio.objects.values_list('id', 'cash_balance')
+    ], batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_stock_price_revision'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Trade',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('buy', 'Buy'), ('sell', 'Sell'), ('deposit', 'Deposit')], max_length=10)),
+                ('shares', models.DecimalField(decimal_places=8, default=0, max_digits=20)),
+                ('price', models.DecimalField(decimal_places=8, default=0, max_digits=20)),
+                ('cash_delta', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('executed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('portfolio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trades', to='app.portfolio')),
+                ('stock', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, to='app.stock')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['portfolio', 'id'], name='trade_portfolio_id'), models.Index(fields=['portfolio', 'executed_at'], name='trade_portfolio_executed')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PositionSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_trade_id', models.BigIntegerField(default=0)),
+                ('cash_balance', models.DecimalField(decimal_places=2, max_digits=20)),
+                ('positions', models.JSONField(default=dict)),
+                ('portfolio', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshots', to='app.portfolio')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['portfolio', '-taken_at'], name='snapshot_portfolio_taken')],
+            },
+        ),
+        migrations.RunPython(create_baseline_snapshots, migrations.RunPython.noop),
+    ]
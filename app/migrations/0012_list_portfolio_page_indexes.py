@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-17 04:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0011_trade_ledger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='portfolio',
+            index=models.Index(fields=['name', 'id'], name='portfolio_name_page'),
+        ),
+        migrations.AddIndex(
+            model_name='portfolio',
+            index=models.Index(fields=['cash_balance', 'id'], name='portfolio_cash_page'),
+        ),
+        migrations.AddIndex(
+            model_name='portfoliodrift',
+            index=models.Index(fields=['market_value', 'portfolio'], name='portfoliodrift_value_page'),
+        ),
+        migrations.AddIndex(
+            model_name='portfoliodrift',
+            index=models.Index(fields=['drift', 'portfolio'], name='portfoliodrift_drift_page'),
+        ),
+        migrations.AddIndex(
+            model_name='portfoliodrift',
+            index=models.Index(fields=['holding_count', 'portfolio'], name='portfoliodrift_count_page'),
+        ),
+    ]
@@ -1,5 +1,9 @@
-from django.db import models
+from collections import defaultdict
+from datetime import timedelta
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+from .cache import invalidate_stock_prices
 
 User = get_user_model()
 
@@ -7,18 +11,67 @@ class Portfolio(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="portfolios")
     name = models.CharField(max_length=200)
     cash_balance = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+    # Drift máximo (en %) antes de que el scheduler lo rebalancee; vacío usa REBALANCE_DRIFT_BAND
+    rebalance_band = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Orden y desempate del listado paginado
+        indexes = [
+            models.Index(fields=['name', 'id'], name='portfolio_name_page'),
+            models.Index(fields=['cash_balance', 'id'], name='portfolio_cash_page'),
+        ]
+
     def __str__(self):
         return f"{self.name} - {self.owner.username}"
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        # El estado inicial queda como snapshot base para poder reconstruir desde el ledger
+        if adding:
+            PositionSnapshot.objects.create(portfolio=self, cash_balance=self.cash_balance, positions={})
+            # Estado de drift desde el inicio (stale) para que el listado lo muestre sin esperar al scheduler
+            PortfolioDrift.objects.create(portfolio=self)
+
+LATEST_PRICE_BATCH_SIZE = 500
+
 class Stock(models.Model):
     symbol = models.CharField(max_length=10, unique=True)
     name = models.CharField(max_length=200, blank=True)
+    # Último precio desnormalizado, se mantiene en cada escritura de StockPrice
+    latest_price = models.DecimalField(max_digits=20, decimal_places=8, null=True, blank=True)
+    latest_price_date = models.DateField(null=True, blank=True)
+    latest_volume = models.BigIntegerField(null=True, blank=True)
+    # Sube cada vez que se reescribe historia ya existente (no al agregar días nuevos); los caches
+    # derivados de precios lo comparan para saber si siguen siendo válidos desde cualquier proceso
+    price_revision = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.symbol
 
+    @classmethod
+    def mark_price_rewrites(cls, stock_ids) -> None:
+        stock_ids = list(stock_ids)
+        if stock_ids:
+            cls.objects.filter(id__in=stock_ids).update(price_revision=models.F('price_revision') + 1)
+
+    @classmethod
+    def refresh_latest_prices(cls, stock_ids=None) -> None:
+        if stock_ids is None:
+            stock_ids = cls.objects.values_list('id', flat=True)
+        stock_ids = list(stock_ids)
+
+        # Un solo UPDATE por bloque, cada subquery usa el índice (stock, date)
+        for i in range(0, len(stock_ids), LATEST_PRICE_BATCH_SIZE):
+            chunk = stock_ids[i:i + LATEST_PRICE_BATCH_SIZE]
+            latest = StockPrice.latest_for_outer_stock()
+            cls.objects.filter(id__in=chunk).update(
+                latest_price=models.Subquery(latest.values('price')[:1]),
+                latest_price_date=models.Subquery(latest.values('date')[:1]),
+                latest_volume=models.Subquery(latest.values('volume')[:1]),
+            )
+
 class Holding(models.Model):
     portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE, related_name="holdings")
     stock = models.ForeignKey(Stock, on_delete=models.CASCADE)
@@ -36,6 +89,16 @@ class Holding(models.Model):
     def __str__(self):
         return f"{self.portfolio.name} — {self.stock.symbol}: {self.shares}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        PortfolioDrift.mark_stale(portfolio_ids=[self.portfolio_id])
+
+    def delete(self, *args, **kwargs):
+        portfolio_id = self.portfolio_id
+        result = super().delete(*args, **kwargs)
+        PortfolioDrift.mark_stale(portfolio_ids=[portfolio_id])
+        return result
+
 class TargetAllocation(models.Model):
     portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE, related_name="allocations")
     stock = models.ForeignKey(Stock, on_delete=models.CASCADE)
@@ -52,12 +115,51 @@ class TargetAllocation(models.Model):
     def __str__(self):
         return f"{self.stock.symbol} -> {self.target_percent * 100}% in {self.portfolio.name}"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        PortfolioDrift.mark_stale(portfolio_ids=[self.portfolio_id])
+
+    def delete(self, *args, **kwargs):
+        portfolio_id = self.portfolio_id
+        result = super().delete(*args, **kwargs)
+        PortfolioDrift.mark_stale(portfolio_ids=[portfolio_id])
+        return result
+
+class StockPriceQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        # Fechas hasta donde ya había historia: escribir antes de eso reescribe precios existentes
+        previous_latest = dict(
+            Stock.objects.filter(id__in={obj.stock_id for obj in objs}).values_list('id', 'latest_price_date')
+        ) if objs else {}
+        objs = super().bulk_create(objs, *args, **kwargs)
+        stock_dates = defaultdict(set)
+        for obj in objs:
+            stock_dates[obj.stock_id].add(obj.date)
+        Stock.mark_price_rewrites([
+            stock_id for stock_id, dates in stock_dates.items()
+            if previous_latest.get(stock_id) and min(dates) <= previous_latest[stock_id]
+        ])
+        Stock.refresh_latest_prices(stock_dates.keys())
+        StockPriceRollup.refresh_periods(stock_dates)
+        PortfolioDrift.mark_stale(stock_ids=stock_dates.keys())
+        # La versión nueva se publica al confirmar: antes, un lector concurrente vería la versión nueva
+        # con las filas viejas y dejaría historia vieja en cache bajo esa versión
+        stock_ids = list(stock_dates)
+        transaction.on_commit(lambda: invalidate_stock_prices(stock_ids))
+        return objs
+
 class StockPrice(models.Model):
     stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name="prices")
     date = models.DateField()
     price = models.DecimalField(max_digits=20, decimal_places=8, null=True, blank=True)
+    open_price = models.DecimalField(max_digits=20, decimal_places=8, null=True, blank=True)
+    high_price = models.DecimalField(max_digits=20, decimal_places=8, null=True, blank=True)
+    low_price = models.DecimalField(max_digits=20, decimal_places=8, null=True, blank=True)
     volume = models.BigIntegerField(null=True, blank=True)
 
+    objects = StockPriceQuerySet.as_manager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -65,7 +167,253 @@ class StockPrice(models.Model):
                 name='unique_stock_date'
             )
         ]
+        indexes = [
+            # Último precio y rangos por acción. En las bases que lo soportan (PostgreSQL) la migración
+            # 0007 lo crea cubriendo además price/volume; aquí va sin include para no exigirlo a todas
+            models.Index(
+                fields=['stock', '-date'],
+                name='stockprice_stock_date_desc'
+            )
+        ]
         ordering = ['-date']
 
     def __str__(self):
         return f"{self.stock.symbol} - {self.date}: ${self.price}"
+
+    @staticmethod
+    def latest_for_outer_stock():
+        return StockPrice.objects.filter(stock_id=models.OuterRef('pk')).order_by('-date')
+
+    def save(self, *args, **kwargs):
+        previous_latest = Stock.objects.filter(id=self.stock_id).values_list('latest_price_date', flat=True).first()
+        super().save(*args, **kwargs)
+        if previous_latest and self.date <= previous_latest:
+            Stock.mark_price_rewrites([self.stock_id])
+        Stock.refresh_latest_prices([self.stock_id])
+        StockPriceRollup.refresh_periods({self.stock_id: {self.date}})
+        PortfolioDrift.mark_stale(stock_ids=[self.stock_id])
+        stock_id = self.stock_id
+        transaction.on_commit(lambda: invalidate_stock_prices([stock_id]))
+
+    def delete(self, *args, **kwargs):
+        stock_id, price_date = self.stock_id, self.date
+        result = super().delete(*args, **kwargs)
+        Stock.mark_price_rewrites([stock_id])
+        Stock.refresh_latest_prices([stock_id])
+        StockPriceRollup.refresh_periods({stock_id: {price_date}})
+        PortfolioDrift.mark_stale(stock_ids=[stock_id])
+        transaction.on_commit(lambda: invalidate_stock_prices([stock_id]))
+        return result
+
+
+ROLLUP_BATCH_SIZE = 200
+
+def rollup_period_start(resolution: str, day):
+    if resolution == 'week':
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+def rollup_period_end(resolution: str, day):
+    if resolution == 'week':
+        return rollup_period_start(resolution, day) + timedelta(days=6)
+    next_month = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return next_month - timedelta(days=1)
+
+class StockPriceRollup(models.Model):
+    RESOLUTIONS = [
+        ('week', 'Weekly'),
+        ('month', 'Monthly'),
+    ]
+
+    stock = models.ForeignKey(Stock, on_delete=models.CASCADE, related_name="rollups")
+    resolution = models.CharField(max_length=5, choices=RESOLUTIONS)
+    period_start = models.DateField()
+    open_price = models.DecimalField(max_digits=20, decimal_places=8, null=True, blank=True)
+    high_price = models.DecimalField(max_digits=20, decimal_places=8, null=True, blank=True)
+    low_price = models.DecimalField(max_digits=20, decimal_places=8, null=True, blank=True)
+    close_price = models.DecimalField(max_digits=20, decimal_places=8, null=True, blank=True)
+    avg_price = models.DecimalField(max_digits=20, decimal_places=8, null=True, blank=True)
+    volume = models.BigIntegerField(null=True, blank=True)
+    days = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['stock', 'resolution', 'period_start'],
+                name='unique_stock_rollup_period'
+            )
+        ]
+        ordering = ['period_start']
+
+    def __str__(self):
+        return f"{self.stock.symbol} - {self.resolution} {self.period_start}: ${self.close_price}"
+
+    @staticmethod
+    def source_rows(stock_ids: list, first_day, last_day):
+        return StockPrice.objects.filter(
+            stock_id__in=stock_ids,
+            date__gte=first_day,
+            date__lte=last_day,
+            price__isnull=False
+        ).order_by('stock_id', 'date').values_list(
+            'stock_id', 'date', 'open_price', 'high_price', 'low_price', 'price', 'volume'
+        )
+
+    @classmethod
+    def refresh_periods(cls, stock_dates: dict) -> None:
+        # Recalculamos solo las semanas y meses que contienen fechas nuevas
+        stock_ids = list(stock_dates)
+        for i in range(0, len(stock_ids), ROLLUP_BATCH_SIZE):
+            chunk = stock_ids[i:i + ROLLUP_BATCH_SIZE]
+            periods = {
+                (stock_id, resolution, rollup_period_start(resolution, day))
+                for stock_id in chunk
+                for day in stock_dates[stock_id]
+                for resolution, _ in cls.RESOLUTIONS
+            }
+            if not periods:
+                continue
+
+            first_day = min(period_start for _, _, period_start in periods)
+            last_day = max(rollup_period_end(resolution, period_start) for _, resolution, period_start in periods)
+            rows = cls.source_rows(chunk, first_day, last_day)
+
+            rollups = {}
+            for stock_id, day, open_price, high, low, close, volume in rows.iterator(chunk_size=10000):
+                for resolution, _ in cls.RESOLUTIONS:
+                    key = (stock_id, resolution, rollup_period_start(resolution, day))
+                    if key not in periods:
+                        continue
+                    rollup = rollups.get(key)
+                    if rollup is None:
+                        rollup = rollups[key] = cls(
+                            stock_id=stock_id,
+                            resolution=resolution,
+                            period_start=key[2],
+                            open_price=open_price if open_price is not None else close,
+                            high_price=high if high is not None else close,
+                            low_price=low if low is not None else close,
+                            avg_price=0,
+                            volume=0,
+                        )
+                    rollup.high_price = max(rollup.high_price, high if high is not None else close)
+                    rollup.low_price = min(rollup.low_price, low if low is not None else close)
+                    rollup.close_price = close
+                    rollup.avg_price += close
+                    rollup.volume += volume or 0
+                    rollup.days += 1
+
+            for rollup in rollups.values():
+                rollup.avg_price = rollup.avg_price / rollup.days
+
+            # Periodos que quedaron sin precios (por ejemplo, tras borrar filas)
+            empty = periods - set(rollups)
+            if empty:
+                for stock_id, resolution, period_start in empty:
+                    cls.objects.filter(stock_id=stock_id, resolution=resolution, period_start=period_start).delete()
+
+            cls.objects.bulk_create(
+                rollups.values(),
+                batch_size=5000,
+                update_conflicts=True,
+                unique_fields=['stock', 'resolution', 'period_start'],
+                update_fields=['open_price', 'high_price', 'low_price', 'close_price', 'avg_price', 'volume', 'days']
+            )
+
+class ImportCheckpoint(models.Model):
+    path = models.CharField(max_length=500, unique=True)
+    file_size = models.BigIntegerField()
+    file_mtime = models.FloatField()
+    # Byte offset para CSV, cantidad de filas para Parquet
+    position = models.BigIntegerField(default=0)
+    rows_imported = models.BigIntegerField(default=0)
+    rows_rejected = models.BigIntegerField(default=0)
+    completed = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        status = "completed" if self.completed else f"at {self.position}"
+        return f"{self.path} ({status})"
+
+class PortfolioDrift(models.Model):
+    # Drift persistido por portafolio; los cambios solo lo marcan stale y se recalcula lo marcado
+    portfolio = models.OneToOneField(Portfolio, on_delete=models.CASCADE, primary_key=True, related_name="drift_state")
+    market_value = models.DecimalField(max_digits=20, decimal_places=8, default=0)
+    holding_count = models.IntegerField(default=0)
+    drift = models.DecimalField(max_digits=12, decimal_places=8, default=0)
+    # Respuesta del preview de rebalanceo ya calculada
+    preview = models.JSONField(default=dict)
+    stale = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['stale'], name='portfoliodrift_stale'),
+            models.Index(fields=['-drift'], name='portfoliodrift_drift_desc'),
+            # Orden y desempate del listado paginado (valor, portfolio) en un solo índice
+            models.Index(fields=['market_value', 'portfolio'], name='portfoliodrift_value_page'),
+            models.Index(fields=['drift', 'portfolio'], name='portfoliodrift_drift_page'),
+            models.Index(fields=['holding_count', 'portfolio'], name='portfoliodrift_count_page'),
+        ]
+
+    def __str__(self):
+        status = "stale" if self.stale else f"{self.drift}%"
+        return f"{self.portfolio_id} drift ({status})"
+
+    @classmethod
+    def mark_stale(cls, portfolio_ids=None, stock_ids=None) -> None:
+        # Un solo UPDATE sobre los portafolios afectados por el cambio. Se actualizan también los que
+        # ya están stale: así la fila queda bloqueada por quien escribe y un refresh_drift concurrente
+        # espera su commit en vez de leer los valores viejos y marcarla como fresca
+        states = cls.objects.all()
+        if portfolio_ids is not None:
+            states = states.filter(portfolio_id__in=list(portfolio_ids))
+        if stock_ids is not None:
+            states = states.filter(
+                portfolio_id__in=Holding.objects.filter(stock_id__in=list(stock_ids)).values('portfolio_id')
+            )
+        states.update(stale=True)
+
+class Trade(models.Model):
+    # Ledger append-only: cada cambio de posición o de cash queda registrado, nunca se edita
+    KIND_CHOICES = [
+        ('buy', 'Buy'),
+        ('sell', 'Sell'),
+        ('deposit', 'Deposit'),
+    ]
+
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE, related_name="trades")
+    stock = models.ForeignKey(Stock, on_delete=models.PROTECT, null=True, blank=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    shares = models.DecimalField(max_digits=20, decimal_places=8, default=0)
+    price = models.DecimalField(max_digits=20, decimal_places=8, default=0)
+    # Cambio en el cash del portafolio, en centavos como cash_balance: negativo en compras, positivo en ventas y depósitos
+    cash_delta = models.DecimalField(max_digits=20, decimal_places=2)
+    executed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['portfolio', 'id'], name='trade_portfolio_id'),
+            models.Index(fields=['portfolio', 'executed_at'], name='trade_portfolio_executed'),
+        ]
+
+    def __str__(self):
+        target = self.stock.symbol if self.stock_id else "cash"
+        return f"{self.kind} {self.shares} {target} ({self.cash_delta})"
+
+class PositionSnapshot(models.Model):
+    portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE, related_name="snapshots")
+    taken_at = models.DateTimeField(default=timezone.now)
+    # Último trade incluido en el snapshot; la reconstrucción reproduce solo los posteriores
+    last_trade_id = models.BigIntegerField(default=0)
+    cash_balance = models.DecimalField(max_digits=20, decimal_places=2)
+    # {stock_id: [shares, average_price]} como strings para no perder precisión
+    positions = models.JSONField(default=dict)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['portfolio', '-taken_at'], name='snapshot_portfolio_taken'),
+        ]
+
+    def __str__(self):
+        return f"{self.portfolio_id} @ {self.taken_at:%Y-%m-%d %H:%M} (trade {self.last_trade_id})"
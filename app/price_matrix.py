@@ -0,0 +1,315 @@
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from datetime import date
+from uuid import uuid4
+import numpy as np
+from django.conf import settings
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+from .models import Stock, StockPrice
+
+FILL_BLOCK_COLUMNS = 256
+READ_CHUNK_SIZE = 50000
+
+
+class PriceMatrix:
+    """Matriz días x acciones en float64, rellenada hacia adelante (NaN antes del primer precio).
+
+    Los arrays son memmaps de solo lectura: todos los procesos que la abren comparten las mismas
+    páginas del sistema operativo en vez de tener cada uno su copia.
+    """
+
+    def __init__(self, directory, meta: dict):
+        self.directory = directory
+        self.version = meta['version']
+        self.stock_ids = np.array(meta['stock_ids'], dtype=np.int64)
+        self.symbols = meta['symbols']
+        self.rows = meta['rows']
+        self.marks = meta['marks']
+        self.column = {stock_id: i for i, stock_id in enumerate(meta['stock_ids'])}
+        shape = (self.rows, len(self.stock_ids))
+        if self.rows and len(self.stock_ids):
+            self.prices = np.memmap(_prices_path(directory, self.version), dtype=np.float64, mode='r', shape=shape)
+            self.dates = np.memmap(_dates_path(directory, self.version), dtype=np.int64, mode='r', shape=(self.rows,))
+        else:
+            self.prices = np.empty(shape)
+            self.dates = np.empty(0, dtype=np.int64)
+
+    @property
+    def last_date(self):
+        return date.fromordinal(int(self.dates[-1])) if self.rows else None
+
+    def is_current(self, stocks) -> bool:
+        # stocks son tuplas (id, latest_price_date, latest_price, price_revision) leídas de Stock
+        return all(self.marks.get(stock_id) == mark for stock_id, mark in _stock_marks(stocks).items())
+
+    def row_range(self, start_date: date = None, end_date: date = None) -> tuple:
+        start = np.searchsorted(self.dates, start_date.toordinal(), 'left') if start_date else 0
+        end = np.searchsorted(self.dates, end_date.toordinal(), 'right') if end_date else self.rows
+        return start, end
+
+    def window(self, stock_ids: list, start_date: date = None, end_date: date = None) -> tuple:
+        # Copia solo las columnas pedidas; las acciones que no están en la matriz quedan en NaN
+        start, end = self.row_range(start_date, end_date)
+        columns = [self.column.get(stock_id) for stock_id in stock_ids]
+        matrix = np.full((end - start, len(stock_ids)), np.nan)
+        present = [i for i, column in enumerate(columns) if column is not None]
+        if present:
+            matrix[:, present] = self.prices[start:end, [columns[i] for i in present]]
+        dates = [date.fromordinal(int(ordinal)) for ordinal in self.dates[start:end]]
+        return dates, matrix
+
+
+def _matrix_dir(directory=None):
+    # Se resuelve en cada llamada (no al importar) para que override_settings aplique
+    if directory is not None:
+        return directory
+    return getattr(settings, 'PRICE_MATRIX_DIR', settings.BASE_DIR / 'price_matrix')
+
+
+def _prices_path(directory, version: str):
+    return os.path.join(directory, f'prices-{version}.f64')
+
+
+def _dates_path(directory, version: str):
+    return os.path.join(directory, f'dates-{version}.i64')
+
+
+def _meta_path(directory):
+    return os.path.join(directory, 'meta.json')
+
+
+@contextmanager
+def _writer_lock(directory, blocking: bool = True):
+    # Un solo escritor a la vez entre procesos; los lectores no lo toman (solo leen meta.json)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'writer.lock'), 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _remove_old_versions(directory, keep: set) -> None:
+    # La versión anterior se conserva: un lector puede haberla tomado de meta.json justo antes del cambio
+    for name in os.listdir(directory):
+        stem, extension = os.path.splitext(name)
+        if extension in ('.f64', '.i64') and stem.split('-', 1)[-1] not in keep:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+
+def _read_meta(directory):
+    try:
+        with open(_meta_path(directory), encoding='utf-8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def _write_meta(directory, meta: dict) -> None:
+    # Se escribe al final y con un rename atómico: un lector nunca ve una versión a medio escribir
+    tmp_path = _meta_path(directory) + f'.{uuid4().hex}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump(meta, file)
+    os.replace(tmp_path, _meta_path(directory))
+
+
+def _forward_fill(matrix, seed=None) -> None:
+    # Por bloques de columnas para no duplicar en memoria una matriz grande
+    columns = matrix.shape[1]
+    for first in range(0, columns, FILL_BLOCK_COLUMNS):
+        block = np.array(matrix[:, first:first + FILL_BLOCK_COLUMNS])
+        if seed is not None:
+            block = np.vstack([seed[first:first + FILL_BLOCK_COLUMNS], block])
+        filled_rows = np.where(np.isnan(block), 0, np.arange(len(block))[:, None])
+        np.maximum.accumulate(filled_rows, axis=0, out=filled_rows)
+        block = block[filled_rows, np.arange(block.shape[1])]
+        matrix[:, first:first + FILL_BLOCK_COLUMNS] = block[1:] if seed is not None else block
+
+
+def _price_rows(queryset):
+    # El precio sale de la base como float, sin pasar por Decimal
+    return queryset.filter(price__isnull=False).annotate(
+        price_float=Cast('price', FloatField())
+    ).order_by().values_list('date', 'stock_id', 'price_float').iterator(chunk_size=READ_CHUNK_SIZE)
+
+
+def _stock_marks(stocks) -> dict:
+    # Último día, último precio y revisión de cada acción tal como estaban al escribir la matriz
+    return {
+        str(stock_id): [latest_date.toordinal(), float(latest_price), revision]
+        for stock_id, latest_date, latest_price, revision in stocks
+        if latest_date is not None and latest_price is not None
+    }
+
+
+def build_price_matrix(directory=None) -> dict:
+    directory = _matrix_dir(directory)
+    with _writer_lock(directory):
+        return _build_price_matrix(directory)
+
+
+def _build_price_matrix(directory) -> dict:
+    previous = _read_meta(directory)
+
+    stocks = list(Stock.objects.filter(latest_price_date__isnull=False).order_by('id').values_list(
+        'id', 'symbol', 'latest_price_date', 'latest_price', 'price_revision'
+    ))
+    stock_ids = [stock_id for stock_id, _, _, _, _ in stocks]
+    column = {stock_id: i for i, stock_id in enumerate(stock_ids)}
+    ordinals = sorted({
+        day.toordinal()
+        for day in StockPrice.objects.filter(stock_id__in=stock_ids).order_by().values_list('date', flat=True).distinct()
+    }) if stock_ids else []
+    row = {ordinal: i for i, ordinal in enumerate(ordinals)}
+
+    version = uuid4().hex
+    if ordinals:
+        prices = np.memmap(_prices_path(directory, version), dtype=np.float64, mode='w+', shape=(len(ordinals), len(stock_ids)))
+        prices[:] = np.nan
+        for day, stock_id, price in _price_rows(StockPrice.objects.filter(stock_id__in=stock_ids)):
+            prices[row[day.toordinal()], column[stock_id]] = price
+        _forward_fill(prices)
+        prices.flush()
+        del prices
+        np.array(ordinals, dtype=np.int64).tofile(_dates_path(directory, version))
+
+    _write_meta(directory, {
+        'version': version,
+        'rows': len(ordinals),
+        'stock_ids': stock_ids,
+        'symbols': [symbol for _, symbol, _, _, _ in stocks],
+        'marks': _stock_marks(
+            (stock_id, latest_date, latest_price, revision) for stock_id, _, latest_date, latest_price, revision in stocks
+        ),
+    })
+
+    # Los procesos que todavía tienen mapeada una versión vieja la siguen leyendo hasta recargar
+    _remove_old_versions(directory, {version, previous['version']} if previous else {version})
+    return {'rebuilt': True, 'rows': len(ordinals), 'rows_added': len(ordinals), 'stocks': len(stock_ids)}
+
+
+def refresh_price_matrix(directory=None) -> dict:
+    directory = _matrix_dir(directory)
+    with _writer_lock(directory):
+        return _refresh_price_matrix(directory, allow_rebuild=True)
+
+
+def refresh_price_matrix_if_built(directory=None):
+    """Después de escribir precios: agrega las fechas nuevas a una matriz existente.
+
+    Nunca crea ni reconstruye la matriz (eso queda para el comando refresh_price_matrix) y no espera
+    a otro escritor: si la matriz queda atrasada, los lectores lo detectan con is_current y usan la base.
+    """
+    directory = _matrix_dir(directory)
+    if _read_meta(directory) is None:
+        return None
+    with _writer_lock(directory, blocking=False) as acquired:
+        if not acquired:
+            return None
+        return _refresh_price_matrix(directory, allow_rebuild=False)
+
+
+def _refresh_price_matrix(directory, allow_rebuild: bool) -> dict:
+    meta = _read_meta(directory)
+    if meta is None:
+        return _build_price_matrix(directory) if allow_rebuild else None
+
+    def rebuild():
+        if allow_rebuild:
+            return _build_price_matrix(directory)
+        return {'rebuilt': False, 'stale': True, 'rows': meta['rows'], 'rows_added': 0, 'stocks': len(meta['stock_ids'])}
+
+    # Las columnas desnormalizadas de Stock dicen qué cambió sin recorrer el historial
+    stocks = list(Stock.objects.filter(latest_price_date__isnull=False).values_list(
+        'id', 'latest_price_date', 'latest_price', 'price_revision'
+    ))
+    marks = _stock_marks(stocks)
+    last_ordinal = max((mark[0] for mark in meta['marks'].values()), default=None)
+    known = set(meta['stock_ids'])
+    for stock_id, mark in marks.items():
+        previous = meta['marks'].get(stock_id)
+        if int(stock_id) not in known:
+            # Una acción nueva agrega una columna: se reconstruye todo
+            return rebuild()
+        if previous[2:] != mark[2:] or (mark[0] <= last_ordinal and previous != mark):
+            # Se reescribió un precio que ya estaba en la matriz
+            return rebuild()
+
+    changed = [int(stock_id) for stock_id, mark in marks.items() if mark[0] > last_ordinal]
+    if not changed:
+        return {'rebuilt': False, 'rows': meta['rows'], 'rows_added': 0, 'stocks': len(meta['stock_ids'])}
+
+    # Cada acción trae solo lo posterior a su último precio conocido; si algo cae dentro de las
+    # fechas que ya tiene la matriz, no basta con agregar filas al final
+    previous_ordinals = {stock_id: meta['marks'][str(stock_id)][0] for stock_id in changed}
+    rows = []
+    for day, stock_id, price in _price_rows(StockPrice.objects.filter(
+        stock_id__in=changed, date__gt=date.fromordinal(min(previous_ordinals.values()))
+    )):
+        if day.toordinal() <= previous_ordinals[stock_id]:
+            continue
+        if day.toordinal() <= last_ordinal:
+            return rebuild()
+        rows.append((day, stock_id, price))
+    ordinals = sorted({day.toordinal() for day, _, _ in rows})
+    row = {ordinal: i for i, ordinal in enumerate(ordinals)}
+    column = {stock_id: i for i, stock_id in enumerate(meta['stock_ids'])}
+    tail = np.full((len(ordinals), len(column)), np.nan)
+    for day, stock_id, price in rows:
+        tail[row[day.toordinal()], column[stock_id]] = price
+
+    # La cola se rellena desde la última fila ya guardada y se escribe justo después de las filas que
+    # declara meta.json; lo que haya quedado más allá (un intento interrumpido) se descarta
+    matrix = PriceMatrix(directory, meta)
+    seed = np.array(matrix.prices[-1]) if matrix.rows else None
+    del matrix
+    _forward_fill(tail, seed)
+    for path, data, row_size in (
+        (_prices_path(directory, meta['version']), tail.astype(np.float64), len(column) * 8),
+        (_dates_path(directory, meta['version']), np.array(ordinals, dtype=np.int64), 8),
+    ):
+        with open(path, 'r+b' if os.path.exists(path) else 'w+b') as file:
+            file.seek(meta['rows'] * row_size)
+            data.tofile(file)
+            file.truncate()
+
+    meta['rows'] += len(ordinals)
+    meta['marks'].update({str(stock_id): marks[str(stock_id)] for stock_id in changed})
+    _write_meta(directory, meta)
+    return {'rebuilt': False, 'rows': meta['rows'], 'rows_added': len(ordinals), 'stocks': len(column)}
+
+
+_loaded = {}
+
+
+def get_price_matrix(directory=None):
+    """Matriz de precios del proceso; se vuelve a mapear solo cuando cambia meta.json."""
+    directory = _matrix_dir(directory)
+    try:
+        stat = os.stat(_meta_path(directory))
+    except FileNotFoundError:
+        return None
+    key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    cached = _loaded.get(directory)
+    if cached is None or cached[0] != key:
+        meta = _read_meta(directory)
+        if meta is None:
+            return None
+        try:
+            cached = (key, PriceMatrix(directory, meta))
+        except FileNotFoundError:
+            # Otro escritor reemplazó la versión entre leer meta.json y abrir los archivos
+            return None
+        _loaded[directory] = cached
+    return cached[1]
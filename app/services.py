@@ -1,39 +1,183 @@
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import csv
+import json
+import os
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import django
+from asgiref.sync import sync_to_async
+from django.http import Http404
 from django.shortcuts import get_object_or_404
-from django.db import transaction
-from .models import Portfolio, Stock, Holding, TargetAllocation, StockPrice
-from datetime import timedelta
+from django.utils import timezone
+from django.db import DatabaseError, IntegrityError, OperationalError, connection, transaction
+from django.db.models import Case, Count, Max, DecimalField, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum, Value, When, Window
+from django.db.models.functions import Cast, Coalesce, NullIf
+from . import cache as price_history_cache
+from .price_matrix import get_price_matrix, refresh_price_matrix_if_built
+from .models import Portfolio, PortfolioDrift, Stock, Holding, TargetAllocation, StockPrice, StockPriceRollup, ImportCheckpoint, Trade, PositionSnapshot, rollup_period_start
+from datetime import date, timedelta
 import random
+import time
+import numpy as np
 from decimal import InvalidOperation
 from datetime import datetime, timedelta
 
+MIN_SHARES_LEFT = Decimal('0.0001')
+SIMULATION_CHUNK_SIZE = 50000
+DAILY_HISTORY_MAX_DAYS = 180
+WEEKLY_HISTORY_MAX_DAYS = 3 * 365
+DRIFT_REFRESH_BATCH_SIZE = 200
+# Estados stale que recalcula como máximo un request de lectura; el resto lo pone al día el scheduler
+DRIFT_REQUEST_REFRESH_LIMIT = 200
+TRANSACTION_MAX_RETRIES = 8
+TRANSACTION_RETRY_DELAY = 0.01
+QUOTES_MAX_SYMBOLS = 200
+BATCH_ORDER_MAX_LEGS = 200
+NAV_DEFAULT_DAYS = 365
+RISK_DEFAULT_DAYS = 365
+RISK_MAX_DAYS = 10 * 365
+MONTE_CARLO_MAX_PATHS = 100000
+MONTE_CARLO_MAX_HORIZON = 5 * 252
+MONTE_CARLO_CHUNK_PATHS = 2500
+MONTE_CARLO_BAND_STEP = 21
+MONTE_CARLO_PERCENTILES = (5, 25, 50, 75, 95)
+SNAPSHOT_BATCH_SIZE = 500
+
+CENT = Decimal('0.01')
+
+def _to_cents(amount: Decimal) -> Decimal:
+    # El cash se guarda en centavos: cobramos, abonamos y registramos en el ledger el monto ya redondeado
+    return amount.quantize(CENT, rounding=ROUND_HALF_UP)
+
+class OrderValidationError(ValueError):
+    def __init__(self, message: str, errors: list):
+        super().__init__(message)
+        self.errors = errors
+
+def _encode_cursor(values: list) -> str:
+    return urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+def _decode_cursor(cursor: str) -> list:
+    try:
+        return json.loads(urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError('Cursor inválido')
+
+def _keyset_page(queryset, sort_field: str, descending: bool, cursor: str, page_size: int, cast=None, tiebreak: str = 'id') -> tuple:
+    # Paginación por llave (valor de orden, id): cada página es un rango sobre el orden, sin OFFSET ni COUNT(*).
+    # tiebreak es la columna por la que se desempata; debe valer lo mismo que el id del item
+    backward = False
+    if cursor:
+        try:
+            cursor_field, cursor_descending, value, last_id, backward = _decode_cursor(cursor)
+        except (TypeError, ValueError):
+            raise ValueError('Cursor inválido')
+        if cursor_field != sort_field or cursor_descending != descending:
+            raise ValueError('El cursor no corresponde al orden solicitado')
+        if cast is not None:
+            value = cast(value)
+        # Hacia atrás se recorre el mismo orden invertido y luego se da vuelta la página
+        lookup = 'lt' if descending != backward else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'{sort_field}__{lookup}': value}) |
+            Q(**{sort_field: value, f'{tiebreak}__{lookup}': last_id})
+        )
+    
+    prefix = '-' if descending != backward else ''
+    items = list(queryset.order_by(f'{prefix}{sort_field}', f'{prefix}{tiebreak}')[:page_size + 1])
+    has_more = len(items) > page_size
+    items = items[:page_size]
+    if backward:
+        items.reverse()
+    
+    def edge_cursor(item, towards_start):
+        return _encode_cursor([sort_field, descending, getattr(item, sort_field), item.id, towards_start])
+    
+    # Si llegamos con un cursor, hay filas del otro lado de donde venimos
+    has_next = bool(cursor) if backward else has_more
+    has_previous = has_more if backward else bool(cursor)
+    next_cursor = edge_cursor(items[-1], False) if items and has_next else None
+    previous_cursor = edge_cursor(items[0], True) if items and has_previous else None
+    return items, next_cursor, previous_cursor
+
+def _estimated_count(model) -> int:
+    # Estimación del planner en vez de COUNT(*); None si la base no tiene estadísticas
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [table])
+        elif connection.vendor == 'sqlite':
+            try:
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            except DatabaseError:
+                # sqlite_stat1 solo existe después del primer ANALYZE
+                return None
+        else:
+            return None
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    estimate = int(float(str(row[0]).split()[0]))
+    return estimate if estimate >= 0 else None
+
 class PortfolioService:
+    LIST_SORT_FIELDS = {
+        'id': int,
+        'name': str,
+        'cash_balance': Decimal,
+        'market_value': Decimal,
+        'drift': Decimal,
+        'holding_count': int,
+    }
+    DRIFT_SORT_FIELDS = {'market_value', 'drift', 'holding_count'}
+    
+    @staticmethod
+    def _valued_holdings(portfolio_id: int):
+        return PortfolioService._value_holdings(Holding.objects.filter(portfolio_id=portfolio_id))
+    
+    @staticmethod
+    def _value_holdings(holdings):
+        # Precio, valor, peso, total del portafolio y delta contra el objetivo en una sola query
+        amount = DecimalField(max_digits=30, decimal_places=10)
+        zero = Value(Decimal('0'), output_field=amount)
+        target_percent = TargetAllocation.objects.filter(
+            portfolio_id=OuterRef('portfolio_id'),
+            stock_id=OuterRef('stock_id')
+        ).values('target_percent')[:1]
+        
+        return holdings.select_related('stock').annotate(
+            current_price=Coalesce(F('stock__latest_price'), zero, output_field=amount),
+            current_value=ExpressionWrapper(F('shares') * F('current_price'), output_field=amount),
+            total_invested=Window(Sum('current_value'), partition_by=[F('portfolio_id')], output_field=amount),
+            allocation_expected_percent=Coalesce(Cast(Subquery(target_percent), amount), zero, output_field=amount),
+        ).annotate(
+            allocation_current_percent=Coalesce(
+                F('current_value') * 100 / NullIf(F('total_invested'), zero), zero, output_field=amount
+            ),
+            objective_value=ExpressionWrapper(
+                F('allocation_expected_percent') / 100 * F('total_invested'), output_field=amount
+            ),
+        ).annotate(
+            delta_value=ExpressionWrapper(F('objective_value') - F('current_value'), output_field=amount),
+        ).annotate(
+            stocks_to_buy_sell=Coalesce(
+                F('delta_value') / NullIf(F('current_price'), zero), zero, output_field=amount
+            ),
+        ).order_by('id')
+    
     @staticmethod
     def get_portfolio_with_holdings(portfolio_id: int) -> dict:
         portfolio = get_object_or_404(Portfolio, id=portfolio_id)
-        holdings = portfolio.holdings.select_related('stock').prefetch_related('stock__prices').all()
-        
-        total_portfolio_value = Decimal('0')
-        holdings_data = []
-        
-        for holding in holdings:
-            latest_price = holding.stock.prices.order_by('-date').first()
-            current_price = latest_price.price if latest_price and latest_price.price else Decimal('0')
-            
-            holding_value = holding.shares * current_price
-            total_portfolio_value += holding_value
-            
-            holdings_data.append({
-                'holding': holding,
-                'value': holding_value,
-                'current_price': current_price
-            })
+        holdings = list(PortfolioService._valued_holdings(portfolio.id))
         
-        for data in holdings_data:
-            if total_portfolio_value > 0:
-                data['percentage'] = (data['value'] / total_portfolio_value) * 100
-            else:
-                data['percentage'] = 0
+        holdings_data = [{
+            'holding': holding,
+            'value': holding.current_value,
+            'current_price': holding.current_price,
+            'percentage': holding.allocation_current_percent
+        } for holding in holdings]
+        total_portfolio_value = holdings[0].total_invested if holdings else Decimal('0')
         
         return {
             'portfolio': portfolio,
@@ -41,6 +185,353 @@ class PortfolioService:
             'total_portfolio_value': total_portfolio_value
         }
     
+    @staticmethod
+    def _nav_values(stock_ids: list, shares: np.ndarray, first_day: date, last_day: date, seed_prices: np.ndarray) -> tuple:
+        # Todo el rango en una sola query: una matriz días x acciones, rellenada hacia adelante con NumPy
+        rows = list(StockPrice.objects.filter(
+            stock_id__in=stock_ids,
+            date__gte=first_day,
+            date__lte=last_day,
+            price__isnull=False
+        ).values_list('date', 'stock_id', 'price'))
+        dates = sorted({row[0] for row in rows})
+        day_index = {day: i for i, day in enumerate(dates)}
+        stock_index = {stock_id: i for i, stock_id in enumerate(stock_ids)}
+        
+        # La primera fila es el último precio conocido antes del rango
+        matrix = np.full((len(dates) + 1, len(stock_ids)), np.nan)
+        matrix[0] = seed_prices
+        for day, stock_id, price in rows:
+            matrix[day_index[day] + 1, stock_index[stock_id]] = float(price)
+        
+        filled_rows = np.where(np.isnan(matrix), 0, np.arange(len(matrix))[:, None])
+        np.maximum.accumulate(filled_rows, axis=0, out=filled_rows)
+        matrix = matrix[filled_rows, np.arange(len(stock_ids))]
+        
+        # Antes de su primer precio una acción se valora a ese primer precio, para que la serie no dé un
+        # salto el día que aparece; una acción sin ningún precio en el rango no suma al valor.
+        # La matriz se devuelve sin ese relleno hacia atrás
+        first_rows = (~np.isnan(matrix)).argmax(axis=0)
+        valued = np.where(np.isnan(matrix), matrix[first_rows, np.arange(len(stock_ids))], matrix)
+        values = np.nan_to_num(valued[1:]) @ shares
+        return dates, values, matrix
+    
+    @staticmethod
+    def _seed_prices(stock_ids: list, first_day: date) -> np.ndarray:
+        # Último precio conocido de cada acción antes del rango, en el orden de stock_ids
+        seeds = dict(Stock.objects.filter(id__in=stock_ids).annotate(
+            seed=Subquery(
+                StockPrice.objects.filter(stock_id=OuterRef('pk'), date__lt=first_day, price__isnull=False)
+                .order_by('-date').values('price')[:1]
+            )
+        ).values_list('id', 'seed'))
+        return np.array([float(seeds[stock_id]) if seeds.get(stock_id) is not None else np.nan for stock_id in stock_ids])
+    
+    @staticmethod
+    def get_nav_series(portfolio_id: int, start_date: date = None, end_date: date = None) -> dict:
+        start_date = StockDataService._parse_history_date(start_date)
+        end_date = StockDataService._parse_history_date(end_date)
+        
+        portfolio = get_object_or_404(Portfolio, id=portfolio_id)
+        holdings = list(portfolio.holdings.order_by('stock_id').values_list(
+            'stock_id', 'shares', 'stock__latest_price_date', 'stock__price_revision'
+        ))
+        stock_ids = [stock_id for stock_id, _, _, _ in holdings]
+        shares = np.array([float(amount) for _, amount, _, _ in holdings])
+        latest_dates = [latest for _, _, latest, _ in holdings if latest]
+        
+        last_day = end_date or (max(latest_dates) if latest_dates else datetime.now().date())
+        first_day = start_date or last_day - timedelta(days=NAV_DEFAULT_DAYS)
+        if first_day > last_day:
+            raise ValueError('La fecha de inicio debe ser anterior a la fecha de término')
+        
+        # Solo se guarda en cache hasta el último día que ya tienen todas las acciones;
+        # escribir en o antes de ese día es reescribir historia y sube la revisión de la acción
+        if stock_ids and len(latest_dates) == len(stock_ids):
+            settled_day = min(last_day, min(latest_dates))
+        else:
+            settled_day = None
+        revisions = [revision for _, _, _, revision in holdings]
+        holdings_key = [[stock_id, str(amount)] for stock_id, amount, _, _ in holdings]
+        
+        entry = price_history_cache.get_nav_series(portfolio.id)
+        reusable = (
+            entry is not None
+            and entry['holdings'] == holdings_key
+            and entry.get('revisions') == revisions
+            and entry['start'] <= first_day
+        )
+        
+        if reusable:
+            # Lo ya calculado se reutiliza; solo se valoran los días posteriores a lo guardado
+            dates = [day for day in entry['dates'] if first_day <= day <= last_day]
+            values = [value for day, value in zip(entry['dates'], entry['values']) if first_day <= day <= last_day]
+            tail_start = entry['end'] + timedelta(days=1)
+            seed = np.array(entry['last_prices'])
+        else:
+            entry = None
+            dates, values = [], []
+            tail_start = first_day
+            seed = PortfolioService._seed_prices(stock_ids, first_day)
+        
+        if tail_start <= last_day and stock_ids:
+            tail_dates, tail_values, matrix = PortfolioService._nav_values(stock_ids, shares, tail_start, last_day, seed)
+            dates += [day for day in tail_dates if day >= first_day]
+            values += [value for day, value in zip(tail_dates, tail_values.tolist()) if day >= first_day]
+            
+            # Si una acción todavía no tiene ningún precio, su valor inicial se conocerá recién con su primer
+            # precio: lo calculado no se guarda
+            if settled_day is not None and settled_day >= tail_start and not np.isnan(matrix[-1]).any():
+                settled = [day for day in tail_dates if day <= settled_day]
+                new_entry = entry or {'holdings': holdings_key, 'revisions': revisions, 'start': first_day, 'dates': [], 'values': []}
+                new_entry['dates'] = new_entry['dates'] + tail_dates[:len(settled)]
+                new_entry['values'] = new_entry['values'] + tail_values[:len(settled)].tolist()
+                new_entry['end'] = settled_day
+                new_entry['last_prices'] = matrix[len(settled)].tolist()
+                price_history_cache.set_nav_series(portfolio.id, new_entry)
+        
+        cash = float(portfolio.cash_balance)
+        return {
+            'portfolio_id': portfolio.id,
+            'start_date': first_day,
+            'end_date': last_day,
+            'cash_balance': cash,
+            'dates': dates,
+            'holdings_value': values,
+            'nav': [value + cash for value in values],
+        }
+    
+    @staticmethod
+    def _market_index(prices: np.ndarray) -> np.ndarray:
+        # Índice de mercado de igual peso: promedio de los retornos diarios de las acciones que tienen precio
+        with np.errstate(divide='ignore', invalid='ignore'):
+            daily = prices[1:] / prices[:-1] - 1
+        daily[~np.isfinite(daily)] = np.nan
+        returns = np.zeros(len(daily))
+        counted = (~np.isnan(daily)).any(axis=1)
+        returns[counted] = np.nanmean(daily[counted], axis=1)
+        return returns
+    
+    @staticmethod
+    def _risk_prices(stock_ids: list, first_day: date, last_day: date, days: int = None) -> tuple:
+        """Precios (días x acciones) del rango, rellenados hacia adelante y NaN antes del primer precio.
+        
+        Con days devuelve además los retornos del índice de mercado sobre las mismas fechas, calculados
+        igual desde la matriz o desde la base. Devuelve (fechas, precios, retornos de mercado, origen).
+        """
+        # La matriz en memoria compartida si ya cubre el rango y sigue al día con Stock (último precio y
+        # revisión de cada acción); si no, la misma matriz armada desde la base
+        matrix = get_price_matrix()
+        if matrix is not None and matrix.rows and matrix.last_date >= last_day and all(
+            stock_id in matrix.column for stock_id in stock_ids
+        ) and matrix.is_current(Stock.objects.filter(id__in=stock_ids).values_list(
+            'id', 'latest_price_date', 'latest_price', 'price_revision'
+        )):
+            dates, prices = matrix.window(stock_ids, first_day, last_day)
+            market = None
+            if days is not None:
+                market = price_history_cache.get_market_returns(matrix.version, last_day, days)
+                if market is None:
+                    start, end = matrix.row_range(first_day, last_day)
+                    market = PortfolioService._market_index(matrix.prices[start:end])
+                    price_history_cache.set_market_returns(matrix.version, last_day, days, market)
+            return dates, prices, market, 'matrix'
+        
+        seed = PortfolioService._seed_prices(stock_ids, first_day)
+        held_dates, _, held = PortfolioService._nav_values(stock_ids, np.zeros(len(stock_ids)), first_day, last_day, seed)
+        if days is None:
+            return held_dates, held[1:], None, 'database'
+        
+        # El índice de mercado necesita todas las acciones, como la matriz. Es el mismo para todos los
+        # portafolios, así que se guarda un rato junto con sus fechas
+        cached = price_history_cache.get_market_returns('database', last_day, days)
+        if cached is None:
+            universe = list(Stock.objects.filter(latest_price_date__isnull=False).order_by('id').values_list('id', flat=True))
+            universe_dates, _, universe_prices = PortfolioService._nav_values(
+                universe, np.zeros(len(universe)), first_day, last_day, PortfolioService._seed_prices(universe, first_day)
+            )
+            cached = {'dates': universe_dates, 'returns': PortfolioService._market_index(universe_prices[1:])}
+            price_history_cache.set_market_returns(
+                'database', last_day, days, cached, price_history_cache.RISK_FALLBACK_TIMEOUT
+            )
+        
+        # Las acciones del portafolio se llevan a las mismas fechas que el índice (la fila 0 es la semilla)
+        positions = np.searchsorted(
+            [day.toordinal() for day in held_dates], [day.toordinal() for day in cached['dates']], 'right'
+        )
+        return cached['dates'], held[positions], cached['returns'], 'database'
+    
+    @staticmethod
+    def _first_priced_row(prices: np.ndarray) -> int:
+        # Primera fila en que todas las acciones que llegan a tener precio ya lo tienen (los precios
+        # vienen rellenados hacia adelante, así que solo faltan al comienzo)
+        priced = ~np.isnan(prices)
+        has_price = priced.any(axis=0)
+        if not has_price.any():
+            return 0
+        return int(priced.argmax(axis=0)[has_price].max())
+    
+    @staticmethod
+    def _risk_metrics(values: np.ndarray, prices: np.ndarray, periods_per_year: float, market: np.ndarray = None) -> dict:
+        valid = values[:-1] > 0
+        returns = values[1:][valid] / values[:-1][valid] - 1
+        
+        def tail(percent):
+            cutoff = np.percentile(returns, 100 - percent)
+            return {'var': float(-cutoff), 'cvar': float(-returns[returns <= cutoff].mean())}
+        
+        peaks = np.maximum.accumulate(values)
+        drawdowns = np.where(peaks > 0, 1 - values / np.where(peaks > 0, peaks, 1), 0)
+        
+        # Correlación solo sobre los días en que todas las acciones ya tienen precio
+        complete = ~np.isnan(prices).any(axis=1)
+        complete_prices = prices[complete]
+        correlation = None
+        if prices.shape[1] > 1 and len(complete_prices) > 2:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                correlation = np.corrcoef(complete_prices[1:] / complete_prices[:-1] - 1, rowvar=False)
+        
+        beta = None
+        if market is not None and len(returns) > 1:
+            market = market[valid]
+            variance = market.var(ddof=1)
+            if variance > 0:
+                beta = float(np.cov(returns, market, ddof=1)[0, 1] / variance)
+        
+        enough = len(returns) > 1
+        return {
+            'observations': int(len(returns)),
+            'annualized_volatility': float(returns.std(ddof=1) * np.sqrt(periods_per_year)) if enough else None,
+            'var_95': tail(95) if enough else None,
+            'var_99': tail(99) if enough else None,
+            'max_drawdown': float(drawdowns.max()) if len(values) else None,
+            'beta': beta,
+            'correlation': [
+                [None if np.isnan(value) else float(value) for value in row] for row in correlation
+            ] if correlation is not None else None,
+        }
+    
+    @staticmethod
+    def get_risk(portfolio_id: int, as_of: date = None, days: int = RISK_DEFAULT_DAYS) -> dict:
+        as_of = StockDataService._parse_history_date(as_of)
+        if days <= 1 or days > RISK_MAX_DAYS:
+            raise ValueError(f'days debe estar entre 2 y {RISK_MAX_DAYS}')
+        
+        portfolio = get_object_or_404(Portfolio, id=portfolio_id)
+        holdings = list(portfolio.holdings.order_by('stock_id').values_list(
+            'stock_id', 'stock__symbol', 'shares', 'stock__latest_price_date', 'stock__price_revision'
+        ))
+        stock_ids = [stock_id for stock_id, _, _, _, _ in holdings]
+        latest_dates = [latest for _, _, _, latest, _ in holdings if latest]
+        
+        # Igual que la serie NAV: por defecto el último día que ya tienen todas las acciones,
+        # y solo ese rango es estable para guardarlo en cache
+        settled_day = min(latest_dates) if stock_ids and len(latest_dates) == len(stock_ids) else None
+        last_day = as_of or settled_day or datetime.now().date()
+        first_day = last_day - timedelta(days=days)
+        cacheable = settled_day is not None and last_day <= settled_day
+        
+        holdings_key = [[stock_id, str(shares)] for stock_id, _, shares, _, _ in holdings]
+        revisions = [revision for _, _, _, _, revision in holdings]
+        entry = price_history_cache.get_portfolio_risk(portfolio.id, last_day, days) if cacheable else None
+        if entry is not None and entry['holdings'] == holdings_key and entry.get('revisions') == revisions:
+            return entry['data']
+        
+        metrics = PortfolioService._risk_metrics(np.zeros(0), np.zeros((0, 0)), 1)
+        source = None
+        if stock_ids:
+            dates, prices, market, source = PortfolioService._risk_prices(stock_ids, first_day, last_day, days)
+            # Antes de su primer precio una acción no vale cero: se empieza cuando ya todas tienen precio,
+            # si no aparecería un retorno enorme el día que entra
+            start = PortfolioService._first_priced_row(prices)
+            dates, prices, market = dates[start:], prices[start:], market[start:]
+            if dates:
+                shares = np.array([float(amount) for _, _, amount, _, _ in holdings])
+                values = np.nan_to_num(prices) @ shares
+                # Anualizamos según la frecuencia real de los datos (días hábiles o corridos)
+                span_years = max((dates[-1] - dates[0]).days, 1) / 365.25
+                periods_per_year = (len(dates) - 1) / span_years
+                metrics = PortfolioService._risk_metrics(values, prices, periods_per_year, market)
+                metrics['market_value'] = float(values[-1])
+        
+        data = {
+            'portfolio_id': portfolio.id,
+            'as_of': last_day.isoformat(),
+            'start_date': first_day.isoformat(),
+            'symbols': [symbol for _, symbol, _, _, _ in holdings],
+            'source': source,
+            'market_value': 0.0,
+            **metrics,
+        }
+        if cacheable:
+            price_history_cache.set_portfolio_risk(portfolio.id, last_day, days, {
+                'holdings': holdings_key, 'revisions': revisions, 'data': data
+            }, price_history_cache.RISK_TIMEOUT if source == 'matrix' else price_history_cache.RISK_FALLBACK_TIMEOUT)
+        return data
+    
+    @staticmethod
+    def list_portfolios(sort: str = 'id', descending: bool = False, cursor: str = None, page_size: int = 50, filters: dict = None) -> dict:
+        if sort not in PortfolioService.LIST_SORT_FIELDS:
+            raise ValueError(f'Orden inválido: {sort}')
+        if page_size <= 0 or page_size > 200:
+            raise ValueError('page_size debe estar entre 1 y 200')
+        
+        # Se ordena y filtra sobre las columnas persistidas (e indexadas) de PortfolioDrift, no sobre
+        # subqueries por fila. Se sirven como están: el request recalcula a lo más un bloque acotado de
+        # estados stale y el resto lo pone al día el scheduler
+        PortfolioService.refresh_drift(limit=DRIFT_REQUEST_REFRESH_LIMIT)
+        portfolios = Portfolio.objects.filter(drift_state__isnull=False).annotate(
+            market_value=F('drift_state__market_value'),
+            drift=F('drift_state__drift'),
+            holding_count=F('drift_state__holding_count'),
+            drift_stale=F('drift_state__stale'),
+        )
+        lookups = {
+            'min_value': 'market_value__gte',
+            'max_value': 'market_value__lte',
+            'min_drift': 'drift__gte',
+            'max_drift': 'drift__lte',
+        }
+        for key, value in (filters or {}).items():
+            if key not in lookups:
+                raise ValueError(f'Filtro inválido: {key}')
+            try:
+                portfolios = portfolios.filter(**{lookups[key]: Decimal(str(value))})
+            except InvalidOperation:
+                raise ValueError(f'Valor inválido para {key}')
+        
+        # El desempate va por la misma tabla que el orden para que el índice (valor, portfolio) cubra ambos
+        tiebreak = 'drift_state__portfolio_id' if sort in PortfolioService.DRIFT_SORT_FIELDS else 'id'
+        items, next_cursor, previous_cursor = _keyset_page(
+            portfolios, sort, descending, cursor, page_size, PortfolioService.LIST_SORT_FIELDS[sort], tiebreak
+        )
+        return {
+            'results': [{
+                'id': portfolio.id,
+                'name': portfolio.name,
+                'cash_balance': float(portfolio.cash_balance),
+                'market_value': float(portfolio.market_value),
+                'total_value': float(portfolio.cash_balance + portfolio.market_value),
+                'drift': float(portfolio.drift),
+                'holding_count': portfolio.holding_count,
+                'stale': portfolio.drift_stale,
+            } for portfolio in items],
+            'next_cursor': next_cursor,
+            'previous_cursor': previous_cursor,
+        }
+    
+    @staticmethod
+    def page_portfolios(cursor: str = None, page_size: int = 10, estimate_count: bool = False) -> dict:
+        items, next_cursor, previous_cursor = _keyset_page(
+            Portfolio.objects.select_related('owner'), 'id', False, cursor, page_size, int
+        )
+        return {
+            'items': items,
+            'next_cursor': next_cursor,
+            'previous_cursor': previous_cursor,
+            'estimated_total': _estimated_count(Portfolio) if estimate_count else None,
+        }
+    
     @staticmethod
     def get_balance(portfolio_id: int) -> dict:
         portfolio = get_object_or_404(Portfolio, id=portfolio_id)
@@ -49,14 +540,27 @@ class PortfolioService:
             'portfolio_name': portfolio.name
         }
     
+    @staticmethod
+    async def aget_balance(portfolio_id: int) -> dict:
+        portfolio = await Portfolio.objects.filter(id=portfolio_id).values('name', 'cash_balance').afirst()
+        if portfolio is None:
+            raise Http404('No Portfolio matches the given query.')
+        return {
+            'balance': float(portfolio['cash_balance']),
+            'portfolio_name': portfolio['name']
+        }
+    
     @staticmethod
     def add_funds(portfolio_id: int, amount: Decimal) -> Portfolio:
+        amount = _to_cents(amount)
         if amount <= 0:
             raise ValueError('El monto debe ser mayor a 0')
         
-        portfolio = get_object_or_404(Portfolio, id=portfolio_id)
-        portfolio.cash_balance += amount
-        portfolio.save()
+        with transaction.atomic():
+            portfolio = get_object_or_404(Portfolio.objects.select_for_update(), id=portfolio_id)
+            portfolio.cash_balance += amount
+            portfolio.save(update_fields=['cash_balance'])
+            Trade.objects.create(portfolio=portfolio, kind='deposit', cash_delta=amount)
         
         return portfolio
     
@@ -93,53 +597,24 @@ class PortfolioService:
         return True
     
     @staticmethod
-    def _latest_price(stock: Stock) -> Decimal:
-        prices = getattr(stock, "prices_cache", None)
+    def _latest_price(stock: Stock, prices: dict = None) -> Decimal:
         if prices is not None:
-            return prices[0].price if prices else None
-        lp = stock.prices.order_by("-date").first()
-        return lp.price if lp and lp.price is not None else None
-    
-    @staticmethod
-    def _cache_prices_for_stock(stock: Stock) -> None:
-        prices = list(stock.prices.all())
-        prices.sort(key=lambda p: p.date, reverse=True)
-        stock.prices_cache = prices
+            return prices.get(stock.id)
+        return stock.latest_price
     
     @staticmethod
-    def get_info_to_rebalance_portafolio(portfolio_id: int) -> dict:
-        portfolio = get_object_or_404(Portfolio, id=portfolio_id)
-        # Obtener holdings y allocations
-        holdings = list(
-            portfolio.holdings
-            .select_related("stock")
-            .prefetch_related("stock__prices")
-            .all()
-        )
-        allocations = list(
-            portfolio.allocations
-            .select_related("stock")
-            .prefetch_related("stock__prices")
-            .all()
-        )
-        
-        # Cachear precios
-        for h in holdings:
-            PortfolioService._cache_prices_for_stock(h.stock)
-        for a in allocations:
-            PortfolioService._cache_prices_for_stock(a.stock)
-        
+    def _compute_rebalance_state(holdings: list, allocations: list, prices: dict = None) -> Decimal:
         # Dejamos las allocations en un dict para acceso rápido
         allocations_dict = {}
         for a in allocations:
-            allocations_dict[a.stock.symbol] = a
+            allocations_dict[a.stock_id] = a
         
         total_invested = Decimal("0")
         
         # Hacemos un loop para obtener los valores de cada stock en el portafolio, calcular su valor y obtener el valor total del portafolio
         for holding in holdings:
-            allocation = allocations_dict.get(holding.stock.symbol)
-            latest_price = PortfolioService._latest_price(holding.stock)
+            allocation = allocations_dict.get(holding.stock_id)
+            latest_price = PortfolioService._latest_price(holding.stock, prices)
             value = holding.shares * latest_price if latest_price else Decimal("0")
             holding.current_value = value
             holding.allocation_expected_percent = Decimal(str(allocation.target_percent)) if allocation else Decimal("0")
@@ -147,21 +622,34 @@ class PortfolioService:
         
         # Una vez obtenido el valor total, hacemos otro loop para calcular el porcentaje actual, valor objetivo, delta y acciones a comprar/vender
         for holding in holdings:
+            latest_price = PortfolioService._latest_price(holding.stock, prices)
             holding.allocation_current_percent = (
                 (holding.current_value / total_invested * Decimal("100")) 
                 if total_invested > 0 else Decimal("0")
             )
             objetive_value = (holding.allocation_expected_percent / Decimal("100")) * total_invested
             delta_value = objetive_value - holding.current_value
-            stocks_to_buy_sell = (
-                delta_value / PortfolioService._latest_price(holding.stock) 
-                if PortfolioService._latest_price(holding.stock) else Decimal("0")
-            )
+            stocks_to_buy_sell = delta_value / latest_price if latest_price else Decimal("0")
             
             holding.objective_value = objetive_value
             holding.delta_value = delta_value
             holding.stocks_to_buy_sell = stocks_to_buy_sell
         
+        return total_invested
+    
+    @staticmethod
+    def _load_rebalance_state(portfolio_id: int) -> tuple:
+        # Tres queries fijas: portafolio, holdings (con su precio) y allocations
+        portfolio = get_object_or_404(Portfolio, id=portfolio_id)
+        holdings = list(portfolio.holdings.select_related("stock").all())
+        allocations = list(portfolio.allocations.select_related("stock").all())
+        total_invested = PortfolioService._compute_rebalance_state(holdings, allocations)
+        return portfolio, holdings, allocations, total_invested
+    
+    @staticmethod
+    def _rebalance_preview(holdings: list, allocations: list) -> dict:
+        total_invested = holdings[0].total_invested if holdings else Decimal("0")
+        
         # Finalmente, creamos las estructuras de datos para retornarlos
         holdings_data = [{
             "stock_symbol": holding.stock.symbol,
@@ -183,49 +671,152 @@ class PortfolioService:
         
         return {
             "total_invested": float(total_invested),
-            "cash_balance": float(portfolio.cash_balance),
             "holdings": holdings_data,
             "allocations": allocations_data,
         }
+    
+    @staticmethod
+    def refresh_drift(portfolio_ids: list = None, limit: int = None) -> int:
+        # Sin ids se recalculan solo los estados stale y los portafolios que aún no tienen estado,
+        # como máximo limit de ellos
+        if portfolio_ids is None:
+            portfolio_ids = Portfolio.objects.filter(
+                Q(drift_state__isnull=True) | Q(drift_state__stale=True)
+            ).order_by('id').values_list('id', flat=True)
+            if limit is not None:
+                portfolio_ids = portfolio_ids[:limit]
+        portfolio_ids = list(portfolio_ids)
+        
+        for i in range(0, len(portfolio_ids), DRIFT_REFRESH_BATCH_SIZE):
+            chunk = portfolio_ids[i:i + DRIFT_REFRESH_BATCH_SIZE]
+            with transaction.atomic():
+                # Bloqueamos los estados antes de leer para que una marca concurrente no se pierda
+                PortfolioDrift.objects.bulk_create([PortfolioDrift(portfolio_id=pid) for pid in chunk], ignore_conflicts=True)
+                states = {state.portfolio_id: state for state in PortfolioDrift.objects.select_for_update().filter(portfolio_id__in=chunk).order_by('portfolio_id')}
+                
+                holdings_by_portfolio = defaultdict(list)
+                for holding in PortfolioService._value_holdings(Holding.objects.filter(portfolio_id__in=chunk)).order_by('portfolio_id', 'id'):
+                    holdings_by_portfolio[holding.portfolio_id].append(holding)
+                allocations_by_portfolio = defaultdict(list)
+                for allocation in TargetAllocation.objects.filter(portfolio_id__in=chunk).select_related('stock').order_by('portfolio_id', 'id'):
+                    allocations_by_portfolio[allocation.portfolio_id].append(allocation)
+                
+                now = timezone.now()
+                for portfolio_id, state in states.items():
+                    holdings = holdings_by_portfolio[portfolio_id]
+                    market_value = holdings[0].total_invested if holdings else Decimal('0')
+                    # Drift = la mitad de la suma de |valor actual - valor objetivo|, como % del valor de mercado
+                    deviation = sum((abs(holding.delta_value) for holding in holdings), Decimal('0'))
+                    drift = deviation * 50 / market_value if market_value else Decimal('0')
+                    
+                    state.market_value = Decimal(market_value).quantize(Decimal('0.00000001'))
+                    state.holding_count = len(holdings)
+                    state.drift = Decimal(drift).quantize(Decimal('0.00000001'))
+                    state.preview = PortfolioService._rebalance_preview(holdings, allocations_by_portfolio[portfolio_id])
+                    state.stale = False
+                    state.updated_at = now
+                PortfolioDrift.objects.bulk_update(
+                    states.values(), ['market_value', 'holding_count', 'drift', 'preview', 'stale', 'updated_at']
+                )
+        return len(portfolio_ids)
+    
+    @staticmethod
+    def get_drift_state(portfolio_id: int) -> PortfolioDrift:
+        portfolio = get_object_or_404(Portfolio.objects.select_related('drift_state'), id=portfolio_id)
+        state = getattr(portfolio, 'drift_state', None)
+        if state is None or state.stale:
+            PortfolioService.refresh_drift([portfolio.id])
+            state = PortfolioDrift.objects.select_related('portfolio').get(portfolio_id=portfolio.id)
+        return state
+    
+    @staticmethod
+    def drifted_portfolios(threshold: Decimal, limit: int = None) -> list:
+        # Igual que el listado: a lo más un bloque acotado de stale; el filtro por umbral usa el índice sobre drift
+        PortfolioService.refresh_drift(limit=DRIFT_REQUEST_REFRESH_LIMIT)
+        states = PortfolioDrift.objects.filter(drift__gte=threshold).order_by('-drift', 'portfolio_id')
+        if limit is not None:
+            states = states[:limit]
+        return [{
+            'portfolio_id': state.portfolio_id,
+            'drift': float(state.drift),
+            'market_value': float(state.market_value),
+            'holding_count': state.holding_count,
+            'stale': state.stale,
+            'updated_at': state.updated_at.isoformat(),
+        } for state in states]
+    
+    @staticmethod
+    def portfolios_over_band(default_band: Decimal, limit: int = None) -> list:
+        # Portafolios cuyo drift superó su banda, del más desviado al menos. Lo llama el scheduler, que
+        # es quien pone al día todos los estados stale
+        PortfolioService.refresh_drift()
+        band = Coalesce(F('portfolio__rebalance_band'), Value(default_band), output_field=DecimalField(max_digits=6, decimal_places=2))
+        states = PortfolioDrift.objects.filter(holding_count__gt=0, drift__gt=band).order_by('-drift', 'portfolio_id')
+        if limit is not None:
+            states = states[:limit]
+        return list(states.values_list('portfolio_id', 'drift'))
+    
+    @staticmethod
+    async def aget_info_to_rebalance_portafolio(portfolio_id: int) -> dict:
+        try:
+            portfolio = await Portfolio.objects.select_related('drift_state').aget(id=portfolio_id)
+        except Portfolio.DoesNotExist:
+            raise Http404('No Portfolio matches the given query.')
+        
+        state = getattr(portfolio, 'drift_state', None)
+        if state is None or state.stale:
+            # El recálculo es una transacción con bloqueo de filas; se hace en un hilo
+            await sync_to_async(PortfolioService.refresh_drift)([portfolio.id])
+            state = await PortfolioDrift.objects.aget(portfolio_id=portfolio.id)
+        return {
+            **state.preview,
+            "cash_balance": float(portfolio.cash_balance),
+            "drift": float(state.drift),
+        }
+    
+    @staticmethod
+    def get_info_to_rebalance_portafolio(portfolio_id: int) -> dict:
+        # El preview se lee del estado persistido; solo se recalcula si algo cambió desde la última vez
+        state = PortfolioService.get_drift_state(portfolio_id)
+        return {
+            **state.preview,
+            "cash_balance": float(state.portfolio.cash_balance),
+            "drift": float(state.drift),
+        }
 
     @staticmethod
-    def rebalance_portfolio(portfolio_id: int) -> dict:
-        # Utilizamos la info obtenida para el rebalanceo
-        info = PortfolioService.get_info_to_rebalance_portafolio(portfolio_id)
-        portfolio = get_object_or_404(Portfolio, id=portfolio_id)
-        
+    def _plan_rebalance(portfolio: Portfolio, holdings: list, prices: dict = None) -> dict:
         operations_to_sell = []
         operations_to_buy = []
         
         # Recorremos los stocks del portafolio para separar las operaciones de compra y venta
-        for holding in info['holdings']:
-            stocks_to_trade = Decimal(str(holding['stocks_to_buy_sell']))
-            
-            stock = Stock.objects.get(symbol=holding['stock_symbol'])
-            PortfolioService._cache_prices_for_stock(stock)
-            current_price = PortfolioService._latest_price(stock)
+        for holding in holdings:
+            stocks_to_trade = holding.stocks_to_buy_sell
+            current_price = PortfolioService._latest_price(holding.stock, prices)
             
             if current_price is None or current_price <= 0:
-                raise ValueError(f'No hay precio válido para {holding["stock_symbol"]}')
+                raise ValueError(f'No hay precio válido para {holding.stock.symbol}')
 
             if stocks_to_trade < 0:
-                shares_to_sell = abs(stocks_to_trade)
+                shares_to_sell = min(abs(stocks_to_trade), holding.shares)
                 operations_to_sell.append({
-                    'stock': stock,
+                    'holding': holding,
+                    'stock': holding.stock,
                     'shares': shares_to_sell,
                     'price': current_price,
-                    'total': shares_to_sell * current_price
+                    'total': _to_cents(shares_to_sell * current_price)
                 })
             elif stocks_to_trade > 0:
                 operations_to_buy.append({
-                    'stock': stock,
+                    'holding': holding,
+                    'stock': holding.stock,
                     'shares': stocks_to_trade,
                     'price': current_price,
-                    'total': stocks_to_trade * current_price
+                    'total': _to_cents(stocks_to_trade * current_price)
                 })
         
-        total_from_sales = sum(op['total'] for op in operations_to_sell)
-        total_for_purchases = sum(op['total'] for op in operations_to_buy)
+        total_from_sales = sum((op['total'] for op in operations_to_sell), Decimal('0'))
+        total_for_purchases = sum((op['total'] for op in operations_to_buy), Decimal('0'))
         
         available_funds = portfolio.cash_balance + total_from_sales
         
@@ -237,47 +828,288 @@ class PortfolioService:
                 f'Necesario: ${total_for_purchases:.2f}'
             )
         
+        return {
+            'sells': operations_to_sell,
+            'buys': operations_to_buy,
+            'total_from_sales': total_from_sales,
+            'total_for_purchases': total_for_purchases,
+        }
+    
+    @staticmethod
+    def _apply_rebalance_plan(plan: dict) -> dict:
+        # Aplicamos las operaciones en memoria, sin tocar la base de datos
+        holdings_to_update = []
+        holdings_to_delete = []
         operations_log = []
+        legs = []
         
-        # Guardamos las operaciones en la base de datos
-        with transaction.atomic():
-            for op in operations_to_sell:
-                try:
-                    result = StockTransactionService.sell_stock(
-                        portfolio_id=portfolio_id,
-                        stock_id=op['stock'].id,
-                        shares=op['shares']
-                    )
-                    operations_log.append(
-                        f"Vendidas {op['shares']:.4f} acciones de {op['stock'].symbol} "
-                        f"a ${op['price']:.2f} = ${result['total_income']:.2f}"
-                    )
-                except Exception as e:
-                    raise ValueError(f"Error vendiendo {op['stock'].symbol}: {str(e)}")
-            
-            for op in operations_to_buy:
-                try:
-                    result = StockTransactionService.buy_stock(
-                        portfolio_id=portfolio_id,
-                        stock_id=op['stock'].id,
-                        shares=op['shares']
-                    )
-                    operations_log.append(
-                        f"Compradas {op['shares']:.4f} acciones de {op['stock'].symbol} "
-                        f"a ${op['price']:.2f} = ${result['total_cost']:.2f}"
-                    )
-                except Exception as e:
-                    raise ValueError(f"Error comprando {op['stock'].symbol}: {str(e)}")
+        for op in plan['sells']:
+            holding = op['holding']
+            holding.shares -= op['shares']
+            if holding.shares <= MIN_SHARES_LEFT:
+                holdings_to_delete.append(holding)
+            else:
+                holdings_to_update.append(holding)
+            operations_log.append(
+                f"Vendidas {op['shares']:.4f} acciones de {op['stock'].symbol} "
+                f"a ${op['price']:.2f} = ${op['total']:.2f}"
+            )
+            legs.append({'stock_id': op['stock'].id, 'symbol': op['stock'].symbol, 'shares': -op['shares'], 'price': op['price'], 'total': op['total']})
         
-        portfolio.refresh_from_db()
+        for op in plan['buys']:
+            holding = op['holding']
+            total_shares = holding.shares + op['shares']
+            total_value = (holding.shares * holding.average_price) + op['total']
+            holding.average_price = total_value / total_shares
+            holding.shares = total_shares
+            holdings_to_update.append(holding)
+            operations_log.append(
+                f"Compradas {op['shares']:.4f} acciones de {op['stock'].symbol} "
+                f"a ${op['price']:.2f} = ${op['total']:.2f}"
+            )
+            legs.append({'stock_id': op['stock'].id, 'symbol': op['stock'].symbol, 'shares': op['shares'], 'price': op['price'], 'total': op['total']})
         
         return {
+            'holdings_to_update': holdings_to_update,
+            'holdings_to_delete': holdings_to_delete,
+            'total_from_sales': plan['total_from_sales'],
+            'total_for_purchases': plan['total_for_purchases'],
+            'cash_delta': plan['total_from_sales'] - plan['total_for_purchases'],
             'operations': operations_log,
-            'total_sold': float(total_from_sales),
-            'total_bought': float(total_for_purchases),
-            'new_balance': float(portfolio.cash_balance),
-            'operations_count': len(operations_log)
+            'legs': legs,
         }
+    
+    @staticmethod
+    def _commit_rebalance_changes(changes_by_portfolio: dict) -> None:
+        holdings_to_update = []
+        holdings_to_delete = []
+        cash_deltas = []
+        trades = []
+        executed_at = timezone.now()
+        for portfolio_id, changes in changes_by_portfolio.items():
+            holdings_to_update.extend(changes['holdings_to_update'])
+            holdings_to_delete.extend(h.id for h in changes['holdings_to_delete'])
+            cash_deltas.append(When(id=portfolio_id, then=Value(changes['cash_delta'])))
+            trades.extend(LedgerService.trades_for_legs(portfolio_id, changes['legs'], executed_at))
+        
+        # Guardamos todas las operaciones con un número fijo de queries
+        with transaction.atomic():
+            if holdings_to_update:
+                Holding.objects.bulk_update(holdings_to_update, ['shares', 'average_price'], batch_size=1000)
+            if holdings_to_delete:
+                Holding.objects.filter(id__in=holdings_to_delete).delete()
+            if cash_deltas:
+                Portfolio.objects.filter(id__in=changes_by_portfolio.keys()).update(
+                    cash_balance=F('cash_balance') + Case(*cash_deltas, output_field=DecimalField())
+                )
+            # El ledger se escribe después del UPDATE, con los portafolios ya bloqueados
+            if trades:
+                Trade.objects.bulk_create(trades, batch_size=1000)
+            if holdings_to_update or holdings_to_delete:
+                PortfolioDrift.mark_stale(portfolio_ids=changes_by_portfolio.keys())
+
+    @staticmethod
+    def _rebalance_snapshot(portfolio: Portfolio, holdings: list) -> dict:
+        # Lo que se leyó para planificar; al guardar se compara contra las filas bloqueadas
+        return {
+            'cash_balance': portfolio.cash_balance,
+            'holdings': {holding.id: (holding.shares, holding.average_price) for holding in holdings},
+        }
+
+    @staticmethod
+    def _lock_rebalance_results(results: list) -> list:
+        # Bloquea holdings y después portafolios, en el mismo orden que buy/sell y execute_orders.
+        # Si algo cambió desde que se planificó, ese portafolio se vuelve a planificar con las filas bloqueadas.
+        planned = {result['portfolio_id']: result for result in results if 'changes' in result}
+        if not planned:
+            return results
+        
+        holdings_by_portfolio = defaultdict(list)
+        for holding in Holding.objects.select_for_update(of=('self',)).filter(
+            portfolio_id__in=planned.keys()
+        ).select_related('stock').order_by('id'):
+            holdings_by_portfolio[holding.portfolio_id].append(holding)
+        portfolios = {
+            portfolio.id: portfolio
+            for portfolio in Portfolio.objects.select_for_update().filter(id__in=planned.keys()).order_by('id')
+        }
+        
+        changed = [
+            portfolio_id for portfolio_id, result in planned.items()
+            if portfolio_id in portfolios
+            and PortfolioService._rebalance_snapshot(portfolios[portfolio_id], holdings_by_portfolio[portfolio_id]) != result['snapshot']
+        ]
+        replanned = {}
+        if changed:
+            allocations_by_portfolio = defaultdict(list)
+            for allocation in TargetAllocation.objects.filter(portfolio_id__in=changed):
+                allocations_by_portfolio[allocation.portfolio_id].append(allocation)
+            # Con los precios vigentes de cada acción, no con la foto del ciclo
+            for result in PortfolioService._plan_rebalance_chunk([
+                (portfolios[portfolio_id], holdings_by_portfolio[portfolio_id], allocations_by_portfolio[portfolio_id])
+                for portfolio_id in changed
+            ], None):
+                replanned[result['portfolio_id']] = result
+        
+        locked_results = []
+        for result in results:
+            portfolio_id = result['portfolio_id']
+            if portfolio_id in planned and portfolio_id not in portfolios:
+                result = {'portfolio_id': portfolio_id, 'error': 'Portafolio no encontrado'}
+            result = replanned.get(portfolio_id, result)
+            if 'changes' in result:
+                result['changes']['new_balance'] = portfolios[portfolio_id].cash_balance + result['changes']['cash_delta']
+            locked_results.append(result)
+        return locked_results
+
+    @staticmethod
+    def _commit_rebalance_results(results: list) -> list:
+        # Verificar, bloquear y guardar en la misma transacción; un conflicto reintenta todo
+        def commit():
+            locked_results = PortfolioService._lock_rebalance_results(results)
+            PortfolioService._commit_rebalance_changes({
+                result['portfolio_id']: result['changes'] for result in locked_results if 'changes' in result
+            })
+            return locked_results
+        
+        return StockTransactionService._run_with_retries(commit)
+
+    @staticmethod
+    def rebalance_portfolio(portfolio_id: int) -> dict:
+        # Utilizamos la info obtenida para el rebalanceo
+        def plan_rebalance():
+            portfolio, holdings, _, _ = PortfolioService._load_rebalance_state(portfolio_id)
+            snapshot = PortfolioService._rebalance_snapshot(portfolio, holdings)
+            plan = PortfolioService._plan_rebalance(portfolio, holdings)
+            return portfolio, snapshot, PortfolioService._apply_rebalance_plan(plan)
+        
+        portfolio, snapshot, changes = StockTransactionService._run_with_retries(plan_rebalance)
+        result = PortfolioService._commit_rebalance_results([
+            {'portfolio_id': portfolio.id, 'snapshot': snapshot, 'changes': changes}
+        ])[0]
+        if 'error' in result:
+            raise ValueError(result['error'])
+        changes = result['changes']
+        
+        return {
+            'operations': changes['operations'],
+            'total_sold': float(changes['total_from_sales']),
+            'total_bought': float(changes['total_for_purchases']),
+            'new_balance': float(changes['new_balance']),
+            'operations_count': len(changes['operations'])
+        }
+
+    @staticmethod
+    def _load_rebalance_chunk(portfolio_ids: list) -> list:
+        # Tres queries por bloque, sin importar cuántos portafolios o posiciones tenga
+        holdings_by_portfolio = defaultdict(list)
+        for holding in Holding.objects.filter(portfolio_id__in=portfolio_ids).select_related('stock'):
+            holdings_by_portfolio[holding.portfolio_id].append(holding)
+        
+        allocations_by_portfolio = defaultdict(list)
+        for allocation in TargetAllocation.objects.filter(portfolio_id__in=portfolio_ids):
+            allocations_by_portfolio[allocation.portfolio_id].append(allocation)
+        
+        return [
+            (portfolio, holdings_by_portfolio[portfolio.id], allocations_by_portfolio[portfolio.id])
+            for portfolio in Portfolio.objects.filter(id__in=portfolio_ids).order_by('id')
+        ]
+
+    @staticmethod
+    def _plan_rebalance_chunk(entries: list, prices: dict) -> list:
+        # Se ejecuta en el pool: solo cálculos en memoria, sin tocar la base de datos
+        results = []
+        for portfolio, holdings, allocations in entries:
+            try:
+                snapshot = PortfolioService._rebalance_snapshot(portfolio, holdings)
+                PortfolioService._compute_rebalance_state(holdings, allocations, prices)
+                plan = PortfolioService._plan_rebalance(portfolio, holdings, prices)
+                results.append({
+                    'portfolio_id': portfolio.id,
+                    'snapshot': snapshot,
+                    'changes': PortfolioService._apply_rebalance_plan(plan),
+                })
+            except Exception as e:
+                results.append({'portfolio_id': portfolio.id, 'error': str(e)})
+        return results
+
+    @staticmethod
+    def _commit_rebalance_chunk(results: list, report: dict) -> None:
+        try:
+            results = PortfolioService._commit_rebalance_results(results)
+        except Exception as e:
+            for r in results:
+                error = r['error'] if 'error' in r else f'Error guardando bloque: {str(e)}'
+                report['failures'].append({'portfolio_id': r['portfolio_id'], 'error': error})
+            return
+        
+        changes_by_portfolio = {r['portfolio_id']: r['changes'] for r in results if 'changes' in r}
+        for r in results:
+            if 'error' in r:
+                report['failures'].append({'portfolio_id': r['portfolio_id'], 'error': r['error']})
+        
+        report['rebalanced'] += len(changes_by_portfolio)
+        report['operations_count'] += sum(len(c['operations']) for c in changes_by_portfolio.values())
+    
+    @staticmethod
+    def rebalance_batch(portfolio_ids: list) -> dict:
+        # Varios portafolios en un ciclo: un plan por portafolio y se guarda todo en bloque
+        portfolio_ids = list(portfolio_ids)
+        prices = dict(Stock.objects.filter(
+            id__in=Holding.objects.filter(portfolio_id__in=portfolio_ids).values('stock_id')
+        ).values_list('id', 'latest_price'))
+        
+        report = {
+            'portfolios_total': len(portfolio_ids),
+            'rebalanced': 0,
+            'operations_count': 0,
+            'failures': [],
+        }
+        entries = PortfolioService._load_rebalance_chunk(portfolio_ids)
+        results = PortfolioService._plan_rebalance_chunk(entries, prices)
+        PortfolioService._commit_rebalance_chunk(results, report)
+        return report
+
+    @staticmethod
+    def rebalance_all(chunk_size: int = 500, workers: int = 4, use_processes: bool = False) -> dict:
+        if chunk_size <= 0 or workers <= 0:
+            raise ValueError('chunk_size y workers deben ser mayores a 0')
+        
+        started_at = time.perf_counter()
+        
+        # Una sola foto de precios compartida por todos los portafolios
+        prices = dict(Stock.objects.values_list('id', 'latest_price'))
+        portfolio_ids = list(Portfolio.objects.order_by('id').values_list('id', flat=True))
+        
+        report = {
+            'portfolios_total': len(portfolio_ids),
+            'rebalanced': 0,
+            'operations_count': 0,
+            'failures': [],
+        }
+        
+        if use_processes:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=django.setup)
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers)
+        
+        # Cargamos y guardamos en el hilo principal; el pool solo calcula los planes.
+        # Mantenemos a lo más 2 * workers bloques en vuelo para acotar la memoria.
+        pending = deque()
+        with executor:
+            for i in range(0, len(portfolio_ids), chunk_size):
+                entries = PortfolioService._load_rebalance_chunk(portfolio_ids[i:i + chunk_size])
+                pending.append(executor.submit(PortfolioService._plan_rebalance_chunk, entries, prices))
+                while len(pending) >= workers * 2:
+                    PortfolioService._commit_rebalance_chunk(pending.popleft().result(), report)
+            while pending:
+                PortfolioService._commit_rebalance_chunk(pending.popleft().result(), report)
+        
+        elapsed = time.perf_counter() - started_at
+        report['failed'] = len(report['failures'])
+        report['elapsed_seconds'] = elapsed
+        report['portfolios_per_second'] = len(portfolio_ids) / elapsed if elapsed > 0 else 0
+        return report
 
 class StockTransactionService:
     @staticmethod
@@ -296,47 +1128,70 @@ class StockTransactionService:
         
         return shares_decimal
     
+    @staticmethod
+    def _run_with_retries(operation):
+        # Un conflicto (lock ocupado, deadlock o una fila creada en paralelo) reintenta toda la transacción
+        for attempt in range(TRANSACTION_MAX_RETRIES):
+            try:
+                with transaction.atomic():
+                    return operation()
+            except (OperationalError, IntegrityError):
+                if attempt == TRANSACTION_MAX_RETRIES - 1:
+                    raise
+                time.sleep(TRANSACTION_RETRY_DELAY * (2 ** attempt) * (1 + random.random()))
+    
     @staticmethod
     def buy_stock(portfolio_id: int, stock_id: int, shares: Decimal) -> dict:
         shares = StockTransactionService._validate_and_convert_shares(shares)
         
-        portfolio = get_object_or_404(Portfolio, id=portfolio_id)
-        stock = get_object_or_404(Stock, id=stock_id)
-        
-        latest_price = stock.prices.order_by('-date').first()
-        if not latest_price or not latest_price.price:
-            raise ValueError('No hay precio disponible para esta acción')
-        
-        total_cost = shares * latest_price.price
-        
-        if total_cost > portfolio.cash_balance:
-            raise ValueError(
-                f'Balance insuficiente. Necesitas ${total_cost:.2f} pero solo tienes ${portfolio.cash_balance:.2f}'
-            )
-        
-        with transaction.atomic():
-            holding, created = Holding.objects.get_or_create(
-                portfolio=portfolio,
-                stock=stock,
-                defaults={'shares': 0, 'average_price': 0}
-            )
+        # Todas las escrituras son UPDATE con F(): la base aplica cada cambio sobre el valor vigente,
+        # así dos compras simultáneas no se pisan. Siempre se toca primero el holding y luego el
+        # portafolio, igual que en sell_stock y el rebalanceo, para no generar deadlocks.
+        def buy():
+            portfolio = get_object_or_404(Portfolio, id=portfolio_id)
+            stock = get_object_or_404(Stock, id=stock_id)
             
-            total_shares = holding.shares + shares
-            total_value = (holding.shares * holding.average_price) + (shares * latest_price.price)
-            new_average_price = total_value / total_shares if total_shares > 0 else latest_price.price
+            latest_price = stock.latest_price
+            if not latest_price:
+                raise ValueError('No hay precio disponible para esta acción')
             
-            holding.shares = total_shares
-            holding.average_price = new_average_price
-            holding.save()
+            total_cost = _to_cents(shares * latest_price)
+            
+            holding, _ = Holding.objects.get_or_create(
+                portfolio_id=portfolio.id,
+                stock_id=stock.id,
+                defaults={'shares': 0, 'average_price': 0}
+            )
+            Holding.objects.filter(id=holding.id).update(
+                average_price=(F('shares') * F('average_price') + total_cost) / (F('shares') + shares),
+                shares=F('shares') + shares
+            )
             
             TargetAllocation.objects.get_or_create(
-                portfolio=portfolio,
-                stock=stock,
+                portfolio_id=portfolio.id,
+                stock_id=stock.id,
                 defaults={'target_percent': 0.0}
             )
             
-            portfolio.cash_balance -= total_cost
-            portfolio.save()
+            # El descuento solo se aplica si el cash alcanza en ese momento
+            if not Portfolio.objects.filter(id=portfolio.id, cash_balance__gte=total_cost).update(
+                cash_balance=F('cash_balance') - total_cost
+            ):
+                balance = Portfolio.objects.values_list('cash_balance', flat=True).get(id=portfolio.id)
+                raise ValueError(
+                    f'Balance insuficiente. Necesitas ${total_cost:.2f} pero solo tienes ${balance:.2f}'
+                )
+            Trade.objects.create(
+                portfolio_id=portfolio.id, stock_id=stock.id, kind='buy',
+                shares=shares, price=latest_price, cash_delta=-total_cost
+            )
+            PortfolioDrift.mark_stale(portfolio_ids=[portfolio.id])
+            
+            holding.refresh_from_db(fields=['shares', 'average_price'])
+            portfolio.refresh_from_db(fields=['cash_balance'])
+            return portfolio, stock, holding, total_cost
+        
+        portfolio, stock, holding, total_cost = StockTransactionService._run_with_retries(buy)
         
         return {
             'total_cost': total_cost,
@@ -350,75 +1205,385 @@ class StockTransactionService:
     def sell_stock(portfolio_id: int, stock_id: int, shares: Decimal) -> dict:
         shares = StockTransactionService._validate_and_convert_shares(shares)
         
-        portfolio = get_object_or_404(Portfolio, id=portfolio_id)
-        stock = get_object_or_404(Stock, id=stock_id)
-        
-        try:
-            holding = Holding.objects.get(portfolio=portfolio, stock=stock)
-        except Holding.DoesNotExist:
-            raise ValueError('No tienes acciones de esta compañía en tu portafolio')
-        
-        if shares > holding.shares:
-            raise ValueError(f'No tienes suficientes acciones. Disponibles: {holding.shares}')
-        
-        latest_price = stock.prices.order_by('-date').first()
-        if not latest_price or not latest_price.price:
-            raise ValueError('No hay precio disponible para esta acción')
-        
-        total_income = shares * latest_price.price
-        
-        with transaction.atomic():
-            holding.shares -= shares
+        def sell():
+            portfolio = get_object_or_404(Portfolio, id=portfolio_id)
+            stock = get_object_or_404(Stock, id=stock_id)
             
-            holding_deleted = False
-            if holding.shares <= Decimal('0.0001'):
-                holding.delete()
-                holding_deleted = True
-            else:
-                holding.save()
+            latest_price = stock.latest_price
+            if not latest_price:
+                raise ValueError('No hay precio disponible para esta acción')
+            
+            total_income = _to_cents(shares * latest_price)
+            
+            holdings = Holding.objects.filter(portfolio_id=portfolio.id, stock_id=stock.id)
+            # La venta solo se aplica si quedan suficientes acciones en ese momento
+            if not holdings.filter(shares__gte=shares).update(shares=F('shares') - shares):
+                available = holdings.values_list('shares', flat=True).first()
+                if available is None:
+                    raise ValueError('No tienes acciones de esta compañía en tu portafolio')
+                raise ValueError(f'No tienes suficientes acciones. Disponibles: {available}')
             
-            portfolio.cash_balance += total_income
-            portfolio.save()
+            remaining = holdings.values_list('shares', flat=True).get()
+            holding_deleted = remaining <= MIN_SHARES_LEFT
+            if holding_deleted:
+                holdings.delete()
+            
+            Portfolio.objects.filter(id=portfolio.id).update(cash_balance=F('cash_balance') + total_income)
+            Trade.objects.create(
+                portfolio_id=portfolio.id, stock_id=stock.id, kind='sell',
+                shares=shares, price=latest_price, cash_delta=total_income
+            )
+            PortfolioDrift.mark_stale(portfolio_ids=[portfolio.id])
+            
+            portfolio.refresh_from_db(fields=['cash_balance'])
+            return portfolio, stock, total_income, remaining, holding_deleted
+        
+        portfolio, stock, total_income, remaining, holding_deleted = StockTransactionService._run_with_retries(sell)
         
         return {
             'total_income': total_income,
             'new_balance': portfolio.cash_balance,
-            'remaining_shares': Decimal('0') if holding_deleted else holding.shares,
+            'remaining_shares': Decimal('0') if holding_deleted else remaining,
             'stock_symbol': stock.symbol,
             'holding_deleted': holding_deleted
         }
-
-class StockDataService:    
+    
     @staticmethod
-    def get_stock_price_history(stock_id: int, start_date: datetime.date = None, end_date: datetime.date = None) -> dict:        
-        stock = get_object_or_404(Stock, id=stock_id)
-        
-        if end_date:
-            if isinstance(end_date, str):
-                try:
-                    end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-                except ValueError:
-                    end_date = None
+    def _validate_order_legs(legs: list, stocks: dict) -> tuple:
+        # Validamos todas las patas antes de tocar la base y devolvemos todos los errores juntos
+        parsed = []
+        errors = []
+        for index, leg in enumerate(legs):
+            try:
+                if not isinstance(leg, dict):
+                    raise ValueError('Cada orden debe ser un objeto')
+                side = leg.get('side')
+                if side not in ('buy', 'sell'):
+                    raise ValueError('side debe ser "buy" o "sell"')
+                shares = StockTransactionService._validate_and_convert_shares(leg.get('shares'))
+                stock = stocks.get(str(leg.get('stock_id')))
+                if stock is None:
+                    raise ValueError('Acción no encontrada')
+                if not stock.latest_price:
+                    raise ValueError('No hay precio disponible para esta acción')
+                parsed.append({'index': index, 'stock': stock, 'side': side, 'shares': shares, 'price': stock.latest_price})
+            except ValueError as e:
+                errors.append({'index': index, 'error': str(e)})
+        return parsed, errors
+    
+    @staticmethod
+    def execute_orders(portfolio_id: int, legs: list) -> dict:
+        if not isinstance(legs, list) or not legs:
+            raise ValueError('Debes enviar al menos una orden')
+        if len(legs) > BATCH_ORDER_MAX_LEGS:
+            raise ValueError(f'Se permiten a lo más {BATCH_ORDER_MAX_LEGS} órdenes por request')
+        
+        # Una sola foto de precios para todas las patas; la lectura también se reintenta ante un lock
+        stock_ids = {str(leg.get('stock_id')) for leg in legs if isinstance(leg, dict)}
+        
+        def load():
+            return get_object_or_404(Portfolio, id=portfolio_id), {
+                str(stock.id): stock
+                for stock in Stock.objects.filter(id__in=[i for i in stock_ids if i.isdigit()])
+            }
         
-        if start_date:
-            if isinstance(start_date, str):
-                try:
-                    start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-                except ValueError:
-                    start_date = None
+        portfolio, stocks = StockTransactionService._run_with_retries(load)
+        parsed, errors = StockTransactionService._validate_order_legs(legs, stocks)
+        if errors:
+            raise OrderValidationError('Hay órdenes inválidas, no se ejecutó ninguna', errors)
+        
+        # Agrupamos por acción: cada holding se escribe una sola vez aunque tenga varias patas
+        by_stock = defaultdict(lambda: {'bought': Decimal('0'), 'bought_cost': Decimal('0'), 'sold': Decimal('0')})
+        for leg in parsed:
+            leg['total'] = _to_cents(leg['shares'] * leg['price'])
+            entry = by_stock[leg['stock'].id]
+            if leg['side'] == 'buy':
+                entry['bought'] += leg['shares']
+                entry['bought_cost'] += leg['total']
+            else:
+                entry['sold'] += leg['shares']
+        total_bought = sum((leg['total'] for leg in parsed if leg['side'] == 'buy'), Decimal('0'))
+        total_sold = sum((leg['total'] for leg in parsed if leg['side'] == 'sell'), Decimal('0'))
+        net_cost = total_bought - total_sold
+        # En el ledger las ventas van antes que las compras, igual que se aplican sobre cada holding
+        ledger_legs = [
+            {
+                'stock_id': leg['stock'].id,
+                'shares': leg['shares'] if leg['side'] == 'buy' else -leg['shares'],
+                'price': leg['price'],
+                'total': leg['total'],
+            }
+            for leg in sorted(parsed, key=lambda leg: leg['side'] == 'buy')
+        ]
+        
+        def apply():
+            # Igual que en buy/sell: primero los holdings (bloqueados) y después el portafolio
+            holdings = {
+                holding.stock_id: holding
+                for holding in Holding.objects.select_for_update().filter(portfolio_id=portfolio.id, stock_id__in=by_stock.keys()).order_by('id')
+            }
+            
+            to_create, to_update, to_delete = [], [], []
+            for stock_id, entry in by_stock.items():
+                holding = holdings.get(stock_id)
+                shares = holding.shares if holding else Decimal('0')
+                if entry['sold'] > shares:
+                    raise OrderValidationError('Hay órdenes inválidas, no se ejecutó ninguna', [
+                        {'index': leg['index'], 'error': f'No tienes suficientes acciones. Disponibles: {shares}'}
+                        for leg in parsed if leg['stock'].id == stock_id and leg['side'] == 'sell'
+                    ])
+                
+                # Las ventas no cambian el precio promedio; las compras lo recalculan sobre lo que queda
+                remaining = shares - entry['sold']
+                total_shares = remaining + entry['bought']
+                if holding is None:
+                    holding = Holding(portfolio_id=portfolio.id, stock_id=stock_id, shares=0, average_price=0)
+                    to_create.append(holding)
+                elif total_shares <= MIN_SHARES_LEFT:
+                    to_delete.append(holding.id)
+                else:
+                    to_update.append(holding)
+                if entry['bought'] > 0:
+                    holding.average_price = (remaining * holding.average_price + entry['bought_cost']) / total_shares
+                holding.shares = total_shares
+            
+            if to_create:
+                Holding.objects.bulk_create(to_create)
+                TargetAllocation.objects.bulk_create([
+                    TargetAllocation(portfolio_id=portfolio.id, stock_id=holding.stock_id, target_percent=0.0)
+                    for holding in to_create
+                ], ignore_conflicts=True)
+            if to_update:
+                Holding.objects.bulk_update(to_update, ['shares', 'average_price'])
+            if to_delete:
+                Holding.objects.filter(id__in=to_delete).delete()
+            
+            if not Portfolio.objects.filter(id=portfolio.id, cash_balance__gte=net_cost).update(
+                cash_balance=F('cash_balance') - net_cost
+            ):
+                balance = Portfolio.objects.values_list('cash_balance', flat=True).get(id=portfolio.id)
+                raise ValueError(
+                    f'Balance insuficiente. Necesitas ${net_cost:.2f} pero solo tienes ${balance:.2f}'
+                )
+            Trade.objects.bulk_create(LedgerService.trades_for_legs(portfolio.id, ledger_legs, timezone.now()))
+            PortfolioDrift.mark_stale(portfolio_ids=[portfolio.id])
+            return Portfolio.objects.values_list('cash_balance', flat=True).get(id=portfolio.id)
         
-        if not end_date:
-            latest_price = stock.prices.order_by('-date').first()
-            end_date = latest_price.date if latest_price else datetime.now().date()
+        new_balance = StockTransactionService._run_with_retries(apply)
         
-        if not start_date:
-            start_date = end_date - timedelta(days=30)
+        return {
+            'legs': [{
+                'index': leg['index'],
+                'stock_id': leg['stock'].id,
+                'stock_symbol': leg['stock'].symbol,
+                'side': leg['side'],
+                'shares': float(leg['shares']),
+                'price': float(leg['price']),
+                'total': float(leg['total']),
+            } for leg in parsed],
+            'total_bought': float(total_bought),
+            'total_sold': float(total_sold),
+            'new_balance': float(new_balance),
+        }
+
+class LedgerService:
+    @staticmethod
+    def trades_for_legs(portfolio_id: int, legs: list, executed_at) -> list:
+        # Cada pata con shares con signo (negativas = venta) y su total en centavos pasa a ser un Trade del ledger
+        return [
+            Trade(
+                portfolio_id=portfolio_id,
+                stock_id=leg['stock_id'],
+                kind='buy' if leg['shares'] > 0 else 'sell',
+                shares=abs(leg['shares']),
+                price=leg['price'],
+                cash_delta=-leg['total'] if leg['shares'] > 0 else leg['total'],
+                executed_at=executed_at
+            )
+            for leg in legs
+        ]
+    
+    @staticmethod
+    def snapshot_portfolios(portfolio_ids: list) -> int:
+        created = 0
+        for i in range(0, len(portfolio_ids), SNAPSHOT_BATCH_SIZE):
+            chunk = portfolio_ids[i:i + SNAPSHOT_BATCH_SIZE]
+            # Con los portafolios bloqueados ningún trade puede quedar a medio camino del snapshot
+            with transaction.atomic():
+                cash = dict(Portfolio.objects.select_for_update().filter(id__in=chunk).order_by('id').values_list('id', 'cash_balance'))
+                last_trades = dict(
+                    Trade.objects.filter(portfolio_id__in=cash.keys())
+                    .values('portfolio_id').annotate(last_id=Max('id')).values_list('portfolio_id', 'last_id')
+                )
+                positions = defaultdict(dict)
+                for portfolio_id, stock_id, shares, average_price in Holding.objects.filter(
+                    portfolio_id__in=cash.keys()
+                ).values_list('portfolio_id', 'stock_id', 'shares', 'average_price'):
+                    positions[portfolio_id][str(stock_id)] = [str(shares), str(average_price)]
+                
+                PositionSnapshot.objects.bulk_create([
+                    PositionSnapshot(
+                        portfolio_id=portfolio_id,
+                        last_trade_id=last_trades.get(portfolio_id, 0),
+                        cash_balance=cash_balance,
+                        positions=positions[portfolio_id]
+                    )
+                    for portfolio_id, cash_balance in cash.items()
+                ])
+            created += len(cash)
+        return created
+    
+    @staticmethod
+    def portfolios_needing_snapshot(min_trades: int) -> list:
+        # Trades acumulados desde el último snapshot de cada portafolio
+        last_snapshot = PositionSnapshot.objects.filter(
+            portfolio_id=OuterRef('pk')
+        ).order_by('-taken_at', '-id').values('last_trade_id')[:1]
+        return list(
+            Portfolio.objects.annotate(
+                snapshot_trade_id=Coalesce(Subquery(last_snapshot), 0)
+            ).annotate(
+                pending_trades=Count('trades', filter=Q(trades__id__gt=F('snapshot_trade_id')))
+            ).filter(pending_trades__gte=max(min_trades, 1)).order_by('id').values_list('id', flat=True)
+        )
+    
+    @staticmethod
+    def _replay(positions: dict, cash: Decimal, trades) -> tuple:
+        # Misma aritmética que buy_stock/sell_stock; el costo de una compra es lo que se debitó del cash
+        replayed = 0
+        for stock_id, kind, shares, price, cash_delta in trades:
+            cash += cash_delta
+            replayed += 1
+            if kind == 'buy':
+                held, average_price = positions.get(stock_id, (Decimal('0'), Decimal('0')))
+                total_shares = held + shares
+                positions[stock_id] = (total_shares, (held * average_price - cash_delta) / total_shares)
+            elif kind == 'sell':
+                held, average_price = positions.get(stock_id, (Decimal('0'), Decimal('0')))
+                if held - shares <= MIN_SHARES_LEFT:
+                    positions.pop(stock_id, None)
+                else:
+                    positions[stock_id] = (held - shares, average_price)
+        return cash, replayed
+    
+    @staticmethod
+    def reconstruct(portfolio_id: int, as_of: datetime = None) -> dict:
+        portfolio = get_object_or_404(Portfolio, id=portfolio_id)
+        if as_of is None:
+            as_of = timezone.now()
+        elif isinstance(as_of, str):
+            try:
+                as_of = datetime.fromisoformat(as_of)
+            except ValueError:
+                raise ValueError('Fecha inválida, usa el formato ISO 8601')
+        if timezone.is_naive(as_of):
+            as_of = timezone.make_aware(as_of)
+        
+        # El snapshot más cercano hacia atrás y solo la cola del ledger que viene después
+        snapshot = PositionSnapshot.objects.filter(
+            portfolio_id=portfolio.id, taken_at__lte=as_of
+        ).order_by('-taken_at', '-id').first()
+        if snapshot is None:
+            raise ValueError('No hay historial del portafolio para esa fecha')
+        
+        positions = {
+            int(stock_id): (Decimal(shares), Decimal(average_price))
+            for stock_id, (shares, average_price) in snapshot.positions.items()
+        }
+        trades = Trade.objects.filter(
+            portfolio_id=portfolio.id, id__gt=snapshot.last_trade_id, executed_at__lte=as_of
+        ).order_by('id').values_list('stock_id', 'kind', 'shares', 'price', 'cash_delta')
+        cash, replayed = LedgerService._replay(positions, snapshot.cash_balance, trades.iterator())
         
-        prices = stock.prices.filter(
+        symbols = dict(Stock.objects.filter(id__in=positions.keys()).values_list('id', 'symbol'))
+        return {
+            'portfolio_id': portfolio.id,
+            'as_of': as_of.isoformat(),
+            'cash_balance': float(cash),
+            'holdings': [{
+                'stock_id': stock_id,
+                'stock_symbol': symbols.get(stock_id),
+                'shares': float(shares),
+                'average_price': float(average_price),
+            } for stock_id, (shares, average_price) in sorted(positions.items())],
+            'snapshot_taken_at': snapshot.taken_at.isoformat(),
+            'trades_replayed': replayed,
+        }
+
+class StockDataService:    
+    @staticmethod
+    def page_stocks(cursor: str = None, page_size: int = 10, estimate_count: bool = False) -> dict:
+        items, next_cursor, previous_cursor = _keyset_page(Stock.objects.all(), 'id', False, cursor, page_size, int)
+        return {
+            'items': items,
+            'next_cursor': next_cursor,
+            'previous_cursor': previous_cursor,
+            'estimated_total': _estimated_count(Stock) if estimate_count else None,
+        }
+    
+    @staticmethod
+    def _history_resolution(start_date: datetime.date, end_date: datetime.date) -> str:
+        # Elegimos la resolución para que el número de puntos se mantenga acotado
+        days = (end_date - start_date).days
+        if days <= DAILY_HISTORY_MAX_DAYS:
+            return 'day'
+        if days <= WEEKLY_HISTORY_MAX_DAYS:
+            return 'week'
+        return 'month'
+    
+    @staticmethod
+    def _daily_history_queryset(stock_id: int, start_date: datetime.date, end_date: datetime.date):
+        return StockPrice.objects.filter(
+            stock_id=stock_id,
             date__gte=start_date,
             date__lte=end_date
         ).order_by('date').values('date', 'price', 'volume')
+    
+    @staticmethod
+    def _rollup_history_queryset(stock_id: int, resolution: str, start_date: datetime.date, end_date: datetime.date):
+        return StockPriceRollup.objects.filter(
+            stock_id=stock_id,
+            resolution=resolution,
+            period_start__gte=rollup_period_start(resolution, start_date),
+            period_start__lte=end_date
+        ).order_by('period_start').values(
+            'period_start', 'open_price', 'high_price', 'low_price', 'close_price', 'avg_price', 'volume', 'days'
+        )
+    
+    @staticmethod
+    def _build_rollup_history(stock: Stock, rollups: list, resolution: str, start_date: datetime.date, end_date: datetime.date) -> dict:
+        chart_data = {
+            'labels': [r['period_start'].strftime('%Y-%m-%d') for r in rollups],
+            'prices': [float(r['close_price']) if r['close_price'] else 0 for r in rollups],
+            'volumes': [r['volume'] if r['volume'] else 0 for r in rollups]
+        }
+        
+        stats = {}
+        if rollups:
+            first_price = float(rollups[0]['open_price'])
+            current_price = float(rollups[-1]['close_price'])
+            total_days = sum(r['days'] for r in rollups)
+            stats = {
+                'current_price': current_price,
+                'max_price': max(float(r['high_price']) for r in rollups),
+                'min_price': min(float(r['low_price']) for r in rollups),
+                'avg_price': sum(float(r['avg_price']) * r['days'] for r in rollups) / total_days,
+                'change': current_price - first_price,
+                'change_percent': ((current_price - first_price) / first_price * 100) if first_price != 0 else 0
+            }
         
+        return {
+            'stock': stock,
+            'chart_data': chart_data,
+            'stats': stats,
+            'start_date': start_date,
+            'end_date': end_date,
+            'data_points': len(rollups),
+            'resolution': resolution
+        }
+    
+    @staticmethod
+    def _build_daily_history(stock: Stock, prices: list, start_date: datetime.date, end_date: datetime.date) -> dict:
         chart_data = {
             'labels': [p['date'].strftime('%Y-%m-%d') for p in prices],
             'prices': [float(p['price']) if p['price'] else 0 for p in prices],
@@ -444,11 +1609,101 @@ class StockDataService:
             'stats': stats,
             'start_date': start_date,
             'end_date': end_date,
-            'data_points': len(prices)
+            'data_points': len(prices),
+            'resolution': 'day'
         }
     
     @staticmethod
-    def simulate_time_forward(amount: int, unit: str) -> dict:        
+    def _parse_history_date(value):
+        if isinstance(value, str):
+            try:
+                return datetime.strptime(value, '%Y-%m-%d').date()
+            except ValueError:
+                return None
+        return value
+    
+    @staticmethod
+    def _history_range(stock: Stock, start_date: datetime.date, end_date: datetime.date) -> tuple:
+        if not end_date:
+            end_date = stock.latest_price_date or datetime.now().date()
+        if not start_date:
+            start_date = end_date - timedelta(days=30)
+        return start_date, end_date
+    
+    @staticmethod
+    def get_stock_price_history(stock_id: int, start_date: datetime.date = None, end_date: datetime.date = None) -> dict:        
+        start_date = StockDataService._parse_history_date(start_date)
+        end_date = StockDataService._parse_history_date(end_date)
+        
+        # Las páginas más vistas se sirven desde el cache sin tocar la base de datos
+        cached = price_history_cache.get_price_history(stock_id, start_date, end_date)
+        if cached is not None:
+            return cached
+        
+        stock = get_object_or_404(Stock, id=stock_id)
+        first_day, last_day = StockDataService._history_range(stock, start_date, end_date)
+        
+        resolution = StockDataService._history_resolution(first_day, last_day)
+        if resolution != 'day':
+            rollups = list(StockDataService._rollup_history_queryset(stock.id, resolution, first_day, last_day))
+            result = StockDataService._build_rollup_history(stock, rollups, resolution, first_day, last_day)
+        else:
+            prices = list(StockDataService._daily_history_queryset(stock.id, first_day, last_day))
+            result = StockDataService._build_daily_history(stock, prices, first_day, last_day)
+        
+        price_history_cache.set_price_history(stock_id, start_date, end_date, result)
+        return result
+    
+    @staticmethod
+    async def aget_stock_price_history(stock_id: int, start_date: datetime.date = None, end_date: datetime.date = None) -> dict:
+        # Misma lógica que get_stock_price_history pero con el ORM y el cache asíncronos
+        start_date = StockDataService._parse_history_date(start_date)
+        end_date = StockDataService._parse_history_date(end_date)
+        
+        cached = await price_history_cache.aget_price_history(stock_id, start_date, end_date)
+        if cached is not None:
+            return cached
+        
+        try:
+            stock = await Stock.objects.aget(id=stock_id)
+        except Stock.DoesNotExist:
+            raise Http404('No Stock matches the given query.')
+        first_day, last_day = StockDataService._history_range(stock, start_date, end_date)
+        
+        resolution = StockDataService._history_resolution(first_day, last_day)
+        if resolution != 'day':
+            queryset = StockDataService._rollup_history_queryset(stock.id, resolution, first_day, last_day)
+            rollups = [row async for row in queryset]
+            result = StockDataService._build_rollup_history(stock, rollups, resolution, first_day, last_day)
+        else:
+            prices = [row async for row in StockDataService._daily_history_queryset(stock.id, first_day, last_day)]
+            result = StockDataService._build_daily_history(stock, prices, first_day, last_day)
+        
+        await price_history_cache.aset_price_history(stock_id, start_date, end_date, result)
+        return result
+    
+    @staticmethod
+    async def aget_latest_quotes(symbols: list) -> list:
+        if not symbols:
+            raise ValueError('Debes indicar al menos un símbolo')
+        if len(symbols) > QUOTES_MAX_SYMBOLS:
+            raise ValueError(f'Se permiten a lo más {QUOTES_MAX_SYMBOLS} símbolos por consulta')
+        
+        # Una sola query sobre las columnas desnormalizadas, sin tocar el historial
+        quotes = Stock.objects.filter(symbol__in=symbols).order_by('symbol').values(
+            'id', 'symbol', 'name', 'latest_price', 'latest_price_date', 'latest_volume'
+        )
+        return [{
+            'stock_id': quote['id'],
+            'symbol': quote['symbol'],
+            'name': quote['name'],
+            'price': float(quote['latest_price']) if quote['latest_price'] is not None else None,
+            'date': quote['latest_price_date'].isoformat() if quote['latest_price_date'] else None,
+            'volume': quote['latest_volume'],
+        } async for quote in quotes]
+    
+    @staticmethod
+    def simulate_time_forward(amount: int, unit: str, seed: int = None, chunk_size: int = SIMULATION_CHUNK_SIZE) -> dict:
         try:
             amount = int(amount)
         except (ValueError, TypeError):
@@ -471,62 +1726,419 @@ class StockDataService:
         if total_days > 365:
             raise ValueError('No se puede simular más de 365 días')
         
-        stocks_data = Stock.objects.values('id', 'symbol').all()
-        stock_ids = [s['id'] for s in stocks_data]
+        stocks_data = list(Stock.objects.order_by('id').values('id', 'latest_price', 'latest_price_date'))
         
-        if not stock_ids:
+        if not stocks_data:
             raise ValueError('No hay acciones para simular')
         
-        latest_prices = {}
-        last_dates = {}
+        stocks_data = [stock_data for stock_data in stocks_data if stock_data['latest_price']]
         
-        for stock_id in stock_ids:
-            last_price_obj = StockPrice.objects.filter(
-                stock_id=stock_id
-            ).order_by('-date').values('date', 'price', 'volume').first()
-            
-            if last_price_obj and last_price_obj['price']:
-                latest_prices[stock_id] = float(last_price_obj['price'])
-                last_dates[stock_id] = last_price_obj['date']
-        
-        if not latest_prices:
+        if not stocks_data:
             raise ValueError('No hay precios históricos para simular')
         
-        new_prices = []
+        stock_ids = [s['id'] for s in stocks_data]
+        last_dates = [s['latest_price_date'] for s in stocks_data]
+        start_prices = np.array([float(s['latest_price']) for s in stocks_data], dtype=np.float64)
+        
+        # Generamos la matriz completa días x acciones de una sola vez; con la misma seed se obtiene el mismo camino
+        rng = np.random.default_rng(seed)
+        changes = rng.uniform(-0.03, 0.03, size=(total_days, len(stock_ids)))
+        paths = np.round(start_prices * np.cumprod(1 + changes, axis=0), 8)
+        volumes = rng.integers(100000, 10000000, size=(total_days, len(stock_ids)), endpoint=True)
+        day_offsets = [timedelta(days=day) for day in range(1, total_days + 1)]
         
-        for stock_id in latest_prices.keys():
-            current_price = latest_prices[stock_id]
-            start_date = last_dates[stock_id]
-            
-            for day in range(1, total_days + 1):
-                change_percent = random.uniform(-0.03, 0.03)
-                current_price = current_price * (1 + change_percent)
-                
-                new_date = start_date + timedelta(days=day)
-                volume = random.randint(100000, 10000000)
-                price_decimal = Decimal(str(round(current_price, 8)))
+        # Escribimos por bloques de acciones para no materializar todas las filas en memoria
+        stocks_per_chunk = max(1, chunk_size // total_days)
+        prices_created = 0
+        
+        with transaction.atomic():
+            for first in range(0, len(stock_ids), stocks_per_chunk):
+                last = min(first + stocks_per_chunk, len(stock_ids))
+                chunk_prices = paths[:, first:last].T.tolist()
+                chunk_volumes = volumes[:, first:last].T.tolist()
                 
-                new_prices.append(
+                new_prices = [
                     StockPrice(
-                        stock_id=stock_id,
-                        date=new_date,
-                        price=price_decimal,
+                        stock_id=stock_ids[j],
+                        date=last_dates[j] + offset,
+                        price=Decimal(repr(price)),
                         volume=volume
                     )
-                )
-        
-        if new_prices:
-            with transaction.atomic():
+                    for j, stock_prices, stock_volumes in zip(range(first, last), chunk_prices, chunk_volumes)
+                    for offset, price, volume in zip(day_offsets, stock_prices, stock_volumes)
+                ]
                 StockPrice.objects.bulk_create(
                     new_prices,
                     batch_size=5000,
                     ignore_conflicts=True
                 )
-        else:
-            raise ValueError('No se generaron nuevos precios')
+                prices_created += len(new_prices)
         
+        refresh_price_matrix_if_built()
         return {
             'total_days': total_days,
-            'stocks_count': len(latest_prices),
-            'prices_created': len(new_prices)
+            'stocks_count': len(stock_ids),
+            'prices_created': prices_created
+        }
+
+class MonteCarloService:
+    @staticmethod
+    def _cholesky(covariance: np.ndarray) -> np.ndarray:
+        try:
+            return np.linalg.cholesky(covariance)
+        except np.linalg.LinAlgError:
+            # Con acciones perfectamente correlacionadas la covarianza no es definida positiva
+            eigenvalues, eigenvectors = np.linalg.eigh(covariance)
+            return eigenvectors * np.sqrt(np.clip(eigenvalues, 0, None))
+    
+    @staticmethod
+    def _estimate(stock_ids: list, as_of: date, lookback_days: int) -> tuple:
+        # Drift y covarianza de los retornos logarítmicos diarios sobre la historia guardada
+        _, prices, _, _ = PortfolioService._risk_prices(stock_ids, as_of - timedelta(days=lookback_days), as_of)
+        prices = prices[~np.isnan(prices).any(axis=1)]
+        if len(prices) < 3:
+            raise ValueError('No hay historia de precios suficiente para estimar la simulación')
+        log_returns = np.diff(np.log(prices), axis=0)
+        covariance = np.atleast_2d(np.cov(log_returns, rowvar=False))
+        return log_returns.mean(axis=0), covariance
+    
+    @staticmethod
+    def _simulate_chunk(params: dict) -> dict:
+        # Corre en un proceso del pool: todo en memoria y sin tocar la base
+        rng = np.random.default_rng(params['seed'])
+        paths = params['paths']
+        # mu ya es la media de los retornos logarítmicos: es el drift del log-precio, sin restar ½σ² otra vez
+        drift = params['mu']
+        # Los shocks en float32 reutilizando el mismo buffer; el precio se acumula en float64
+        chol_t = params['chol'].T.astype(np.float32)
+        shocks = np.empty((paths, len(drift)), dtype=np.float32)
+        checkpoints = set(params['checkpoints'])
+        
+        log_prices = np.tile(np.log(params['start_prices']), (paths, 1))
+        bands = []
+        for step in range(1, params['steps'] + 1):
+            rng.standard_normal(out=shocks, dtype=np.float32)
+            log_prices += shocks @ chol_t
+            log_prices += drift
+            if step in checkpoints:
+                bands.append(np.exp(log_prices) @ params['shares'])
+        
+        # Rebalanceo al final del horizonte: lo que habría que comprar y vender para volver a los objetivos
+        values = np.exp(log_prices) * params['shares']
+        invested = values.sum(axis=1)
+        traded = np.abs(invested[:, None] * params['targets'] - values).sum(axis=1)
+        return {
+            'checkpoint_values': np.stack(bands, axis=1) + params['cash'],
+            'terminal_value': invested + params['cash'],
+            'rebalance_traded': traded,
+        }
+    
+    @staticmethod
+    def _bands(samples: np.ndarray) -> dict:
+        return {f'p{percent}': float(value) for percent, value in zip(
+            MONTE_CARLO_PERCENTILES, np.percentile(samples, MONTE_CARLO_PERCENTILES, axis=0)
+        )}
+    
+    @staticmethod
+    def simulate_portfolio(portfolio_id: int, paths: int = 10000, horizon: int = 252, seed: int = None,
+                           workers: int = 1, lookback_days: int = RISK_DEFAULT_DAYS, cost_bps: Decimal = Decimal('10')) -> dict:
+        if paths <= 0 or paths > MONTE_CARLO_MAX_PATHS:
+            raise ValueError(f'paths debe estar entre 1 y {MONTE_CARLO_MAX_PATHS}')
+        if horizon <= 0 or horizon > MONTE_CARLO_MAX_HORIZON:
+            raise ValueError(f'horizon debe estar entre 1 y {MONTE_CARLO_MAX_HORIZON}')
+        if workers <= 0 or lookback_days <= 2 or cost_bps < 0:
+            raise ValueError('workers, lookback_days y cost_bps deben ser positivos')
+        
+        started_at = time.perf_counter()
+        portfolio = get_object_or_404(Portfolio, id=portfolio_id)
+        holdings = list(portfolio.holdings.filter(stock__latest_price__isnull=False).order_by('stock_id').values_list(
+            'stock_id', 'stock__symbol', 'shares', 'stock__latest_price', 'stock__latest_price_date'
+        ))
+        if not holdings:
+            raise ValueError('El portafolio no tiene posiciones con precio para simular')
+        stock_ids = [stock_id for stock_id, _, _, _, _ in holdings]
+        shares = np.array([float(amount) for _, _, amount, _, _ in holdings])
+        start_prices = np.array([float(price) for _, _, _, price, _ in holdings])
+        
+        mu, covariance = MonteCarloService._estimate(stock_ids, min(latest for *_, latest in holdings), lookback_days)
+        
+        # Sin objetivos definidos, el rebalanceo vuelve a los pesos actuales
+        targets = dict(TargetAllocation.objects.filter(portfolio_id=portfolio.id, stock_id__in=stock_ids).values_list('stock_id', 'target_percent'))
+        targets = np.array([float(targets.get(stock_id) or 0) / 100 for stock_id in stock_ids])
+        if targets.sum() <= 0:
+            values = shares * start_prices
+            targets = values / values.sum()
+        
+        checkpoints = sorted(set(range(MONTE_CARLO_BAND_STEP, horizon, MONTE_CARLO_BAND_STEP)) | {horizon})
+        base = {
+            'mu': mu,
+            'covariance': covariance,
+            'chol': MonteCarloService._cholesky(covariance),
+            'start_prices': start_prices,
+            'shares': shares,
+            'targets': targets,
+            'cash': float(portfolio.cash_balance),
+            'steps': horizon,
+            'checkpoints': checkpoints,
+        }
+        # Cada bloque tiene su propia semilla derivada: el resultado no depende de cuántos workers haya
+        sizes = [min(MONTE_CARLO_CHUNK_PATHS, paths - i) for i in range(0, paths, MONTE_CARLO_CHUNK_PATHS)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+        chunks = [{**base, 'paths': size, 'seed': chunk_seed} for size, chunk_seed in zip(sizes, seeds)]
+        
+        if workers > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), initializer=django.setup) as executor:
+                results = list(executor.map(MonteCarloService._simulate_chunk, chunks))
+        else:
+            results = [MonteCarloService._simulate_chunk(chunk) for chunk in chunks]
+        
+        checkpoint_values = np.concatenate([result['checkpoint_values'] for result in results])
+        terminal_value = np.concatenate([result['terminal_value'] for result in results])
+        traded = np.concatenate([result['rebalance_traded'] for result in results])
+        initial_value = float(shares @ start_prices) + base['cash']
+        
+        return {
+            'portfolio_id': portfolio.id,
+            'paths': paths,
+            'horizon': horizon,
+            'symbols': [symbol for _, symbol, _, _, _ in holdings],
+            'initial_value': initial_value,
+            'terminal_value': MonteCarloService._bands(terminal_value),
+            'probability_of_loss': float((terminal_value < initial_value).mean()),
+            'bands': [
+                {'step': step, **MonteCarloService._bands(checkpoint_values[:, i])}
+                for i, step in enumerate(checkpoints)
+            ],
+            'rebalance_traded_value': MonteCarloService._bands(traded),
+            'rebalance_cost': MonteCarloService._bands(traded * float(cost_bps) / 10000),
+            'elapsed_seconds': time.perf_counter() - started_at,
+        }
+
+class PriceImportService:
+    COLUMN_ALIASES = {
+        'symbol': ('symbol', 'ticker'),
+        'date': ('date',),
+        'open': ('open',),
+        'high': ('high',),
+        'low': ('low',),
+        'close': ('close', 'price', 'adj close'),
+        'volume': ('volume',),
+    }
+    
+    @staticmethod
+    def _map_columns(header: list) -> list:
+        normalized = [name.strip().lower() for name in header]
+        columns = []
+        for field, aliases in PriceImportService.COLUMN_ALIASES.items():
+            index = next((normalized.index(alias) for alias in aliases if alias in normalized), None)
+            if index is None and field in ('symbol', 'date', 'close'):
+                raise ValueError(f'Falta la columna requerida "{field}"')
+            columns.append(index)
+        return columns
+    
+    @staticmethod
+    def _iter_csv_chunks(path: str, start: int, batch_size: int):
+        # Leemos en binario para poder guardar el byte offset de cada bloque y retomar con seek()
+        with open(path, 'rb') as file:
+            header = next(csv.reader([file.readline().decode('utf-8-sig')]))
+            columns = PriceImportService._map_columns(header)
+            if start:
+                file.seek(start)
+            
+            while True:
+                lines = []
+                for _ in range(batch_size):
+                    line = file.readline()
+                    if not line:
+                        break
+                    lines.append(line.decode('utf-8'))
+                if not lines:
+                    return
+                
+                rows = [
+                    tuple(values[i] if i is not None and i < len(values) else None for i in columns)
+                    for values in csv.reader(lines) if values
+                ]
+                yield rows, file.tell()
+    
+    @staticmethod
+    def _iter_parquet_chunks(path: str, start: int, batch_size: int):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError('Se necesita pyarrow para importar archivos Parquet')
+        
+        parquet_file = pq.ParquetFile(path)
+        names = parquet_file.schema_arrow.names
+        columns = PriceImportService._map_columns(names)
+        selected = [names[i] for i in columns if i is not None]
+        
+        # Saltamos los row groups que ya fueron importados por completo
+        position = 0
+        first_group = 0
+        while first_group < parquet_file.num_row_groups:
+            group_rows = parquet_file.metadata.row_group(first_group).num_rows
+            if position + group_rows > start:
+                break
+            position += group_rows
+            first_group += 1
+        
+        batches = parquet_file.iter_batches(
+            batch_size=batch_size,
+            row_groups=range(first_group, parquet_file.num_row_groups),
+            columns=selected
+        )
+        for batch in batches:
+            data = batch.to_pydict()
+            rows = list(zip(*(
+                data[names[i]] if i is not None else [None] * batch.num_rows
+                for i in columns
+            )))
+            if position < start:
+                skipped = min(start - position, len(rows))
+                rows = rows[skipped:]
+                position += skipped
+            position += len(rows)
+            if rows:
+                yield rows, position
+    
+    @staticmethod
+    def _to_decimal(value) -> Decimal:
+        if value is None or value == '':
+            return None
+        if isinstance(value, float):
+            value = repr(value)
+        return Decimal(str(value).replace('$', '').replace(',', ''))
+    
+    @staticmethod
+    def _validate_row(row: tuple):
+        symbol, raw_date, raw_open, raw_high, raw_low, raw_close, raw_volume = row
+        symbol = str(symbol or '').strip().upper()
+        if not symbol or len(symbol) > 10:
+            return None
+        
+        if isinstance(raw_date, datetime):
+            price_date = raw_date.date()
+        elif isinstance(raw_date, date):
+            price_date = raw_date
+        else:
+            try:
+                price_date = datetime.strptime(str(raw_date).strip()[:10], '%Y-%m-%d').date()
+            except ValueError:
+                return None
+        
+        try:
+            close = PriceImportService._to_decimal(raw_close)
+            open_price = PriceImportService._to_decimal(raw_open)
+            high = PriceImportService._to_decimal(raw_high)
+            low = PriceImportService._to_decimal(raw_low)
+            volume = int(float(raw_volume)) if raw_volume not in (None, '') else None
+        except (InvalidOperation, ValueError, TypeError):
+            return None
+        
+        if close is None or close <= 0 or (volume is not None and volume < 0):
+            return None
+        if high is not None and low is not None and high < low:
+            return None
+        
+        return symbol, price_date, open_price, high, low, close, volume
+    
+    @staticmethod
+    def _resolve_stock_ids(symbols: set, stock_ids: dict) -> None:
+        missing = [symbol for symbol in symbols if symbol not in stock_ids]
+        if not missing:
+            return
+        stock_ids.update(Stock.objects.filter(symbol__in=missing).values_list('symbol', 'id'))
+        
+        # Creamos las acciones que aún no existen
+        to_create = [symbol for symbol in missing if symbol not in stock_ids]
+        if to_create:
+            Stock.objects.bulk_create([Stock(symbol=symbol) for symbol in to_create], ignore_conflicts=True)
+            stock_ids.update(Stock.objects.filter(symbol__in=to_create).values_list('symbol', 'id'))
+    
+    @staticmethod
+    def _import_rows(rows: list, stock_ids: dict) -> tuple:
+        valid = {}
+        rejected = 0
+        for row in rows:
+            parsed = PriceImportService._validate_row(row)
+            if parsed is None:
+                rejected += 1
+                continue
+            valid[(parsed[0], parsed[1])] = parsed
+        
+        PriceImportService._resolve_stock_ids({symbol for symbol, _ in valid}, stock_ids)
+        
+        prices = [
+            StockPrice(
+                stock_id=stock_ids[symbol],
+                date=price_date,
+                open_price=open_price,
+                high_price=high,
+                low_price=low,
+                price=close,
+                volume=volume
+            )
+            for symbol, price_date, open_price, high, low, close, volume in valid.values()
+        ]
+        if prices:
+            StockPrice.objects.bulk_create(
+                prices,
+                batch_size=5000,
+                update_conflicts=True,
+                unique_fields=['stock', 'date'],
+                update_fields=['price', 'open_price', 'high_price', 'low_price', 'volume']
+            )
+        return len(prices), rejected
+    
+    @staticmethod
+    def import_file(path: str, batch_size: int = 50000, restart: bool = False) -> dict:
+        if path.endswith('.parquet'):
+            iter_chunks = PriceImportService._iter_parquet_chunks
+        elif path.endswith('.csv'):
+            iter_chunks = PriceImportService._iter_csv_chunks
+        else:
+            raise ValueError(f'Formato no soportado: {path}')
+        
+        file_stat = os.stat(path)
+        checkpoint, _ = ImportCheckpoint.objects.get_or_create(
+            path=os.path.abspath(path),
+            defaults={'file_size': file_stat.st_size, 'file_mtime': file_stat.st_mtime}
+        )
+        
+        # Si el archivo cambió desde el último intento, partimos desde cero
+        changed = checkpoint.file_size != file_stat.st_size or checkpoint.file_mtime != file_stat.st_mtime
+        if restart or changed:
+            checkpoint.file_size = file_stat.st_size
+            checkpoint.file_mtime = file_stat.st_mtime
+            checkpoint.position = 0
+            checkpoint.rows_imported = 0
+            checkpoint.rows_rejected = 0
+            checkpoint.completed = False
+            checkpoint.save()
+        
+        resumed_from = checkpoint.position
+        already_completed = checkpoint.completed
+        if not already_completed:
+            stock_ids = {}
+            for rows, position in iter_chunks(path, checkpoint.position, batch_size):
+                # El bloque y su checkpoint se guardan juntos: si se interrumpe, se retoma desde aquí
+                with transaction.atomic():
+                    imported, rejected = PriceImportService._import_rows(rows, stock_ids)
+                    checkpoint.position = position
+                    checkpoint.rows_imported += imported
+                    checkpoint.rows_rejected += rejected
+                    checkpoint.save()
+            
+            checkpoint.completed = True
+            checkpoint.save()
+            refresh_price_matrix_if_built()
+        
+        return {
+            'path': checkpoint.path,
+            'resumed_from': resumed_from,
+            'already_completed': already_completed,
+            'rows_imported': checkpoint.rows_imported,
+            'rows_rejected': checkpoint.rows_rejected,
+            'completed': checkpoint.completed,
         }
@@ -1,3 +1,581 @@
-from django.test import TestCase
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import Subquery
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import Holding, ImportCheckpoint, Portfolio, PortfolioDrift, Stock, StockPrice, StockPriceRollup, TargetAllocation, Trade
+from .price_matrix import build_price_matrix, get_price_matrix, refresh_price_matrix, refresh_price_matrix_if_built
+from .services import LedgerService, OrderValidationError, PortfolioService, PriceImportService, StockDataService, StockTransactionService
+
+
+# Cache propio de los tests: el de settings es compartido y persiste en disco, y los ids de la base
+# de tests chocarían con los de la base real
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests'}}
+# Igual con la matriz de precios: un directorio que no existe, así ningún test usa la matriz de desarrollo
+TEST_MATRIX_DIR = os.path.join(tempfile.gettempdir(), f'tests-price-matrix-{os.getpid()}')
+
+
+@override_settings(CACHES=TEST_CACHES, PRICE_MATRIX_DIR=TEST_MATRIX_DIR)
+class QueryPlanTests(TestCase):
+    STOCKS = 300
+    DAYS = 200
+
+    @classmethod
+    def setUpTestData(cls):
+        Stock.objects.bulk_create([Stock(symbol=f'S{i}') for i in range(cls.STOCKS)])
+        cls.stock_ids = list(Stock.objects.order_by('id').values_list('id', flat=True))
+        cls.first_day = date(2025, 1, 1)
+        StockPrice.objects.bulk_create([
+            StockPrice(
+                stock_id=stock_id,
+                date=cls.first_day + timedelta(days=day),
+                price=Decimal(10 + day % 7),
+                volume=1000
+            )
+            for stock_id in cls.stock_ids
+            for day in range(cls.DAYS)
+        ], batch_size=5000)
+
+        # Sin estadísticas el planner puede preferir un scan aunque exista el índice
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertNoFullScan(self, queryset, table):
+        plan = queryset.explain()
+        if connection.vendor == 'postgresql':
+            full_scan = re.search(rf'Seq Scan on {table}\b', plan)
+        else:
+            # SQLite muestra las subqueries con su alias (U0, U1, ...) en vez del nombre de la tabla
+            full_scan = re.search(rf'\bSCAN (TABLE )?({table}|U\d+)\b', plan)
+        self.assertIsNone(full_scan, f'Full scan on {table}:\n{plan}')
+
+    def test_latest_price_lookup_uses_index(self):
+        latest = StockPrice.latest_for_outer_stock()
+        queryset = Stock.objects.filter(id__in=self.stock_ids[:50]).annotate(
+            current_price=Subquery(latest.values('price')[:1])
+        )
+        self.assertNoFullScan(queryset, 'app_stockprice')
+
+    def test_history_range_uses_index(self):
+        queryset = StockDataService._daily_history_queryset(
+            self.stock_ids[10],
+            self.first_day + timedelta(days=30),
+            self.first_day + timedelta(days=60)
+        )
+        self.assertNoFullScan(queryset, 'app_stockprice')
+
+    def test_rollup_source_rows_use_index(self):
+        queryset = StockPriceRollup.source_rows(
+            self.stock_ids[:20],
+            self.first_day + timedelta(days=150),
+            self.first_day + timedelta(days=180)
+        )
+        self.assertNoFullScan(queryset, 'app_stockprice')
+
+    def test_rollup_history_uses_index(self):
+        queryset = StockPriceRollup.objects.filter(
+            stock_id=self.stock_ids[10],
+            resolution='week',
+            period_start__gte=self.first_day
+        ).order_by('period_start')
+        self.assertNoFullScan(queryset, 'app_stockpricerollup')
+
+    def test_simulation_seed_lookup_skips_price_history(self):
+        # La semilla de la simulación sale de las columnas desnormalizadas, no del historial
+        queryset = Stock.objects.order_by('id').values('id', 'latest_price', 'latest_price_date')
+        self.assertNotIn('app_stockprice', queryset.explain())
+        self.assertEqual(
+            Stock.objects.get(id=self.stock_ids[0]).latest_price_date,
+            self.first_day + timedelta(days=self.DAYS - 1)
+        )
+
+
+@override_settings(CACHES=TEST_CACHES, PRICE_MATRIX_DIR=TEST_MATRIX_DIR)
+class RebalanceEngineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Stock.objects.bulk_create([Stock(symbol=f'R{i}') for i in range(20)])
+        cls.stock_ids = list(Stock.objects.order_by('id').values_list('id', flat=True))
+        StockPrice.objects.bulk_create([
+            StockPrice(stock_id=stock_id, date=date(2025, 1, 1), price=Decimal('10')) for stock_id in cls.stock_ids
+        ])
+        cls.owner = User.objects.create(username='rebalance')
+
+    def make_portfolio(self, positions):
+        # La mitad de las posiciones está sobreponderada (3 acciones) y la otra mitad bajo el objetivo (1)
+        portfolio = Portfolio.objects.create(owner=self.owner, name=f'R{positions}', cash_balance=Decimal('100'))
+        for i, stock_id in enumerate(self.stock_ids[:positions]):
+            Holding.objects.create(portfolio=portfolio, stock_id=stock_id, shares=Decimal(3 if i % 2 else 1), average_price=Decimal('8'))
+            TargetAllocation.objects.create(portfolio=portfolio, stock_id=stock_id, target_percent=100 / positions)
+        return portfolio
+
+    def test_query_count_does_not_depend_on_positions(self):
+        queries = []
+        for positions in (4, 20):
+            portfolio = self.make_portfolio(positions)
+            with CaptureQueriesContext(connection) as context:
+                result = PortfolioService.rebalance_portfolio(portfolio.id)
+            queries.append(len(context.captured_queries))
+
+            self.assertEqual(result['operations_count'], positions)
+            self.assertEqual(result['new_balance'], 100)
+            for holding in Holding.objects.filter(portfolio=portfolio):
+                self.assertEqual(holding.shares, 2)
+                # Las ventas mantienen el promedio; las compras lo recalculan: (1 * 8 + 1 * 10) / 2
+                self.assertEqual(holding.average_price, Decimal('8') if self.stock_ids.index(holding.stock_id) % 2 else Decimal('9'))
+        self.assertEqual(queries[0], queries[1])
+
+
+@override_settings(CACHES=TEST_CACHES, PRICE_MATRIX_DIR=TEST_MATRIX_DIR)
+class BatchOrderTests(TestCase):
+    def setUp(self):
+        self.stock = Stock.objects.create(symbol='BAT1')
+        self.other = Stock.objects.create(symbol='BAT2')
+        for stock in (self.stock, self.other):
+            StockPrice.objects.create(stock=stock, date=date(2025, 1, 1), price=Decimal('10'))
+        owner = User.objects.create(username='batch')
+        self.portfolio = Portfolio.objects.create(owner=owner, name='Batch', cash_balance=Decimal('1000'))
+        Holding.objects.create(portfolio=self.portfolio, stock=self.stock, shares=Decimal('10'), average_price=Decimal('8'))
+
+    def test_failing_leg_applies_nothing(self):
+        # La venta excedida marca todas las ventas de esa acción, no solo la última
+        for bad_leg, failing in (
+            ({'stock_id': self.other.id, 'side': 'sell', 'shares': '1'}, [2]),
+            ({'stock_id': self.stock.id, 'side': 'sell', 'shares': '50'}, [1, 2]),
+            ({'stock_id': 999999, 'side': 'buy', 'shares': '1'}, [2]),
+        ):
+            with self.assertRaises(OrderValidationError) as raised:
+                StockTransactionService.execute_orders(self.portfolio.id, [
+                    {'stock_id': self.other.id, 'side': 'buy', 'shares': '2'},
+                    {'stock_id': self.stock.id, 'side': 'sell', 'shares': '1'},
+                    bad_leg,
+                ])
+            self.assertEqual([error['index'] for error in raised.exception.errors], failing)
+
+        self.portfolio.refresh_from_db()
+        self.assertEqual(self.portfolio.cash_balance, Decimal('1000'))
+        self.assertEqual(
+            list(Holding.objects.filter(portfolio=self.portfolio).values_list('stock_id', 'shares')),
+            [(self.stock.id, Decimal('10'))]
+        )
+        self.assertFalse(Trade.objects.filter(portfolio=self.portfolio).exists())
+
+    def test_mixed_legs_on_the_same_stock(self):
+        result = StockTransactionService.execute_orders(self.portfolio.id, [
+            {'stock_id': self.stock.id, 'side': 'buy', 'shares': '2'},
+            {'stock_id': self.stock.id, 'side': 'sell', 'shares': '3'},
+            {'stock_id': self.stock.id, 'side': 'buy', 'shares': '1'},
+        ])
+
+        # Las ventas no cambian el promedio: quedan 7 a $8 y se compran 3 a $10
+        holding = Holding.objects.get(portfolio=self.portfolio, stock=self.stock)
+        self.assertEqual(holding.shares, Decimal('10'))
+        self.assertEqual(holding.average_price, Decimal('8.6'))
+        self.assertEqual(result['new_balance'], 1000)
+        self.assertEqual(
+            list(Trade.objects.filter(portfolio=self.portfolio).order_by('id').values_list('kind', 'shares', 'cash_delta')),
+            [('sell', Decimal('3'), Decimal('30')), ('buy', Decimal('2'), Decimal('-20')), ('buy', Decimal('1'), Decimal('-10'))]
+        )
+
+
+@override_settings(CACHES=TEST_CACHES, PRICE_MATRIX_DIR=TEST_MATRIX_DIR)
+class ConcurrentTransactionTests(TransactionTestCase):
+    THREADS = 8
+    ORDERS_PER_THREAD = 10
+
+    def setUp(self):
+        self.stock = Stock.objects.create(symbol='CONC')
+        StockPrice.objects.create(stock=self.stock, date=date(2025, 1, 1), price=Decimal('10'))
+        owner = User.objects.create(username='concurrent')
+        self.portfolio = Portfolio.objects.create(owner=owner, name='Concurrent', cash_balance=Decimal('1000'))
+
+    def run_concurrently(self, order, count):
+        def worker(_):
+            try:
+                return order()
+            except ValueError:
+                return None
+            finally:
+                # Cada hilo abre su propia conexión
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=self.THREADS) as executor:
+            return list(executor.map(worker, range(count)))
+
+    def test_concurrent_buys_do_not_lose_updates(self):
+        orders = self.THREADS * self.ORDERS_PER_THREAD
+        results = self.run_concurrently(
+            lambda: StockTransactionService.buy_stock(self.portfolio.id, self.stock.id, '1'), orders
+        )
+
+        self.assertTrue(all(results))
+        self.portfolio.refresh_from_db()
+        holding = Holding.objects.get(portfolio=self.portfolio, stock=self.stock)
+        self.assertEqual(holding.shares, orders)
+        self.assertEqual(holding.average_price, Decimal('10'))
+        self.assertEqual(self.portfolio.cash_balance, Decimal('1000') - orders * 10)
+
+    def test_concurrent_buys_never_overdraw_cash(self):
+        # Con $1000 solo alcanzan 100 compras de $10; el resto debe fallar sin dejar el balance negativo
+        orders = 120
+        results = self.run_concurrently(
+            lambda: StockTransactionService.buy_stock(self.portfolio.id, self.stock.id, '1'), orders
+        )
+
+        self.assertEqual(sum(result is not None for result in results), 100)
+        self.portfolio.refresh_from_db()
+        self.assertEqual(self.portfolio.cash_balance, Decimal('0'))
+        self.assertEqual(Holding.objects.get(portfolio=self.portfolio, stock=self.stock).shares, 100)
+
+    def test_concurrent_sells_never_oversell(self):
+        Holding.objects.create(portfolio=self.portfolio, stock=self.stock, shares=Decimal('20'), average_price=Decimal('10'))
+        results = self.run_concurrently(
+            lambda: StockTransactionService.sell_stock(self.portfolio.id, self.stock.id, '1'), 30
+        )
+
+        self.assertEqual(sum(result is not None for result in results), 20)
+        self.assertFalse(Holding.objects.filter(portfolio=self.portfolio, stock=self.stock).exists())
+        self.portfolio.refresh_from_db()
+        self.assertEqual(self.portfolio.cash_balance, Decimal('1200'))
+
+    def test_rebalances_and_batch_orders_do_not_lose_concurrent_buys(self):
+        other = Stock.objects.create(symbol='CONC2')
+        StockPrice.objects.create(stock=other, date=date(2025, 1, 1), price=Decimal('10'))
+        StockTransactionService.buy_stock(self.portfolio.id, self.stock.id, '20')
+        StockTransactionService.buy_stock(self.portfolio.id, other.id, '1')
+        TargetAllocation.objects.filter(portfolio=self.portfolio).update(target_percent=50)
+
+        # Compras sueltas mezcladas con rebalanceos y órdenes en lote sobre las mismas filas
+        tasks = [
+            lambda: StockTransactionService.buy_stock(self.portfolio.id, self.stock.id, '1'),
+            lambda: PortfolioService.rebalance_portfolio(self.portfolio.id),
+            lambda: StockTransactionService.execute_orders(self.portfolio.id, [
+                {'stock_id': self.stock.id, 'side': 'buy', 'shares': '0.5'},
+                {'stock_id': other.id, 'side': 'sell', 'shares': '0.25'},
+            ]),
+        ] * (self.THREADS * 2)
+        self.run_concurrently(lambda: tasks.pop()(), len(tasks))
+
+        # Si alguna escritura se hubiera perdido, el ledger ya no coincidiría con el estado real
+        self.portfolio.refresh_from_db()
+        self.assertGreaterEqual(self.portfolio.cash_balance, 0)
+        state = LedgerService.reconstruct(self.portfolio.id)
+        self.assertEqual(Decimal(str(state['cash_balance'])), self.portfolio.cash_balance)
+        live = dict(Holding.objects.filter(portfolio=self.portfolio).values_list('stock_id', 'shares'))
+        self.assertEqual({h['stock_id']: Decimal(str(h['shares'])) for h in state['holdings']}, live)
+
+
+@override_settings(CACHES=TEST_CACHES, PRICE_MATRIX_DIR=TEST_MATRIX_DIR)
+class LedgerReconstructionTests(TestCase):
+    def test_replay_from_snapshot_matches_live_state(self):
+        stock = Stock.objects.create(symbol='LEDG')
+        StockPrice.objects.create(stock=stock, date=date(2025, 1, 1), price=Decimal('10.37'))
+        owner = User.objects.create(username='ledger')
+        portfolio = Portfolio.objects.create(owner=owner, name='Ledger', cash_balance=Decimal('1000'))
+
+        StockTransactionService.buy_stock(portfolio.id, stock.id, '4.125')
+        before_snapshot = timezone.now()
+        LedgerService.snapshot_portfolios([portfolio.id])
+        StockPrice.objects.create(stock=stock, date=date(2025, 1, 2), price=Decimal('20.4567'))
+        # Montos que no caen justo en centavos: el ledger debe registrar lo que realmente se cobró
+        for _ in range(7):
+            StockTransactionService.buy_stock(portfolio.id, stock.id, '0.333')
+        StockTransactionService.sell_stock(portfolio.id, stock.id, '1.777')
+        PortfolioService.add_funds(portfolio.id, Decimal('12.345'))
+
+        state = LedgerService.reconstruct(portfolio.id)
+        holding = Holding.objects.get(portfolio=portfolio, stock=stock)
+        portfolio.refresh_from_db()
+        self.assertEqual(state['trades_replayed'], 9)
+        self.assertEqual(Decimal(str(state['cash_balance'])), portfolio.cash_balance)
+        self.assertEqual(Decimal(str(state['holdings'][0]['shares'])), holding.shares)
+        self.assertAlmostEqual(state['holdings'][0]['average_price'], float(holding.average_price), places=6)
+
+        past = LedgerService.reconstruct(portfolio.id, before_snapshot)
+        self.assertEqual(Decimal(str(past['cash_balance'])), Decimal('957.22'))
+        self.assertEqual(Decimal(str(past['holdings'][0]['shares'])), Decimal('4.125'))
+
+
+@override_settings(CACHES=TEST_CACHES, PRICE_MATRIX_DIR=TEST_MATRIX_DIR)
+class NavSeriesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.first_day = date(2025, 1, 1)
+        self.early = Stock.objects.create(symbol='NAV1')
+        self.late = Stock.objects.create(symbol='NAV2')
+        StockPrice.objects.bulk_create(
+            [StockPrice(stock=self.early, date=self.first_day + timedelta(days=day), price=Decimal(10 + day % 3)) for day in range(30)] +
+            [StockPrice(stock=self.late, date=self.first_day + timedelta(days=day), price=Decimal('20')) for day in range(10, 30, 2)]
+        )
+        owner = User.objects.create(username='nav')
+        self.portfolio = Portfolio.objects.create(owner=owner, name='Nav', cash_balance=Decimal('0'))
+        Holding.objects.create(portfolio=self.portfolio, stock=self.early, shares=Decimal('2'), average_price=Decimal('10'))
+        Holding.objects.create(portfolio=self.portfolio, stock=self.late, shares=Decimal('3'), average_price=Decimal('20'))
+
+    def series(self):
+        return PortfolioService.get_nav_series(self.portfolio.id, start_date=self.first_day)
+
+    def cold_series(self):
+        cache.clear()
+        return self.series()
+
+    def test_holding_without_history_is_valued_at_its_first_price(self):
+        data = self.series()
+        # La segunda acción recién tiene precio el día 10: antes no vale cero, vale ese primer precio
+        expected = [2 * (10 + day % 3) + 3 * 20 for day in range(30)]
+        self.assertEqual(data['holdings_value'], expected)
+
+    def test_cached_series_matches_cold_recomputation(self):
+        self.series()
+        # Días nuevos: se extiende lo guardado
+        StockPrice.objects.bulk_create([
+            StockPrice(stock=stock, date=self.first_day + timedelta(days=day), price=Decimal('15'))
+            for stock in (self.early, self.late) for day in range(30, 35)
+        ])
+        extended = self.series()
+        self.assertEqual(extended['dates'][-1], self.first_day + timedelta(days=34))
+        self.assertEqual(extended, self.cold_series())
+
+        # Reescribir un día ya guardado sube la revisión de la acción e invalida lo guardado
+        price = StockPrice.objects.get(stock=self.early, date=self.first_day + timedelta(days=5))
+        price.price = Decimal('50')
+        price.save()
+        self.assertEqual(Stock.objects.get(id=self.early.id).price_revision, 1)
+        rewritten = self.series()
+        self.assertEqual(rewritten['holdings_value'][5], 2 * 50 + 3 * 20)
+        self.assertEqual(rewritten, self.cold_series())
+
+
+@override_settings(CACHES=TEST_CACHES, PRICE_MATRIX_DIR=TEST_MATRIX_DIR)
+class PriceImportResumeTests(TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'w') as file:
+            file.write('symbol,date,close,volume\n')
+            for day in range(10):
+                for symbol in ('IMPA', 'IMPB', 'IMPC'):
+                    file.write(f'{symbol},2025-01-{day + 1:02d},{10 + day}.25,1000\n')
+            file.write('IMPA,not-a-date,10,1000\n')
+        self.addCleanup(os.remove, self.path)
+
+    def test_interrupted_import_resumes_without_duplicates(self):
+        import_rows = PriceImportService._import_rows
+        calls = []
+
+        def crash_on_third_chunk(rows, stock_ids):
+            calls.append(len(rows))
+            if len(calls) == 3:
+                raise RuntimeError('interrumpido')
+            return import_rows(rows, stock_ids)
+
+        with mock.patch.object(PriceImportService, '_import_rows', side_effect=crash_on_third_chunk):
+            with self.assertRaises(RuntimeError):
+                PriceImportService.import_file(self.path, batch_size=7)
+
+        # Quedan guardados los dos bloques completos y el checkpoint apunta justo después de ellos
+        checkpoint = ImportCheckpoint.objects.get()
+        self.assertFalse(checkpoint.completed)
+        self.assertEqual(checkpoint.rows_imported, 14)
+        self.assertEqual(StockPrice.objects.count(), 14)
+
+        result = PriceImportService.import_file(self.path, batch_size=7)
+        self.assertEqual(result['resumed_from'], checkpoint.position)
+        self.assertTrue(result['completed'])
+        self.assertEqual(result['rows_imported'], 30)
+        self.assertEqual(result['rows_rejected'], 1)
+        self.assertEqual(StockPrice.objects.count(), 30)
+        self.assertEqual(
+            Stock.objects.get(symbol='IMPC').latest_price_date, date(2025, 1, 10)
+        )
+
+        # Una vez completo no se vuelve a leer
+        again = PriceImportService.import_file(self.path, batch_size=7)
+        self.assertTrue(again['already_completed'])
+        self.assertEqual(StockPrice.objects.count(), 30)
+
+
+@override_settings(CACHES=TEST_CACHES, PRICE_MATRIX_DIR=TEST_MATRIX_DIR)
+class RollupRefreshTests(TestCase):
+    def rollups(self):
+        return list(StockPriceRollup.objects.order_by('stock_id', 'resolution', 'period_start').values_list(
+            'stock_id', 'resolution', 'period_start', 'open_price', 'high_price', 'low_price',
+            'close_price', 'avg_price', 'volume', 'days'
+        ))
+
+    def test_rewrites_leave_the_same_rollups_as_a_rebuild(self):
+        stock = Stock.objects.create(symbol='ROLL')
+        first_day = date(2025, 1, 1)
+        StockPrice.objects.bulk_create([
+            StockPrice(stock=stock, date=first_day + timedelta(days=day), price=Decimal(10 + day % 5), volume=100)
+            for day in range(60)
+        ])
+
+        # Reescrituras por las tres vías: save, borrado y la importación (bulk_create con update_conflicts)
+        price = StockPrice.objects.get(stock=stock, date=first_day + timedelta(days=3))
+        price.price = Decimal('99')
+        price.save()
+        for row in StockPrice.objects.filter(stock=stock, date__range=(date(2025, 1, 13), date(2025, 1, 19))):
+            row.delete()
+        StockPrice.objects.bulk_create(
+            [StockPrice(stock=stock, date=first_day + timedelta(days=day), price=Decimal('1'), volume=7) for day in (30, 31)],
+            update_conflicts=True,
+            unique_fields=['stock', 'date'],
+            update_fields=['price', 'volume'],
+        )
+
+        refreshed = self.rollups()
+        self.assertNotIn((stock.id, 'week', date(2025, 1, 13)), [row[:3] for row in refreshed])
+        StockPriceRollup.objects.all().delete()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(refreshed, self.rollups())
+
+
+@override_settings(CACHES=TEST_CACHES, PRICE_MATRIX_DIR=TEST_MATRIX_DIR)
+class DriftStaleTests(TestCase):
+    def setUp(self):
+        owner = User.objects.create(username='drift')
+        self.held = Stock.objects.create(symbol='HELD')
+        self.other = Stock.objects.create(symbol='OTHR')
+        StockPrice.objects.bulk_create([
+            StockPrice(stock=self.held, date=date(2025, 1, 2), price=Decimal('10')),
+            StockPrice(stock=self.other, date=date(2025, 1, 2), price=Decimal('20')),
+        ])
+        self.portfolio = Portfolio.objects.create(owner=owner, name='Drift', cash_balance=Decimal('1000'))
+        self.unrelated = Portfolio.objects.create(owner=owner, name='Unrelated', cash_balance=Decimal('1000'))
+        self.holding = Holding.objects.create(portfolio=self.portfolio, stock=self.held, shares=Decimal('5'), average_price=Decimal('10'))
+        Holding.objects.create(portfolio=self.unrelated, stock=self.other, shares=Decimal('1'), average_price=Decimal('20'))
+        PortfolioService.refresh_drift()
+
+    def stale(self, portfolio):
+        return PortfolioDrift.objects.get(portfolio=portfolio).stale
+
+    def assert_marks_only_portfolio(self, write):
+        self.assertFalse(self.stale(self.portfolio))
+        write()
+        self.assertTrue(self.stale(self.portfolio))
+        self.assertFalse(self.stale(self.unrelated))
+        PortfolioService.refresh_drift()
+
+    def test_holding_writes_mark_stale(self):
+        def save():
+            self.holding.shares = Decimal('6')
+            self.holding.save()
+        self.assert_marks_only_portfolio(save)
+        self.assert_marks_only_portfolio(lambda: StockTransactionService.buy_stock(self.portfolio.id, self.held.id, '1'))
+        self.assert_marks_only_portfolio(lambda: StockTransactionService.sell_stock(self.portfolio.id, self.held.id, '1'))
+        self.assert_marks_only_portfolio(lambda: StockTransactionService.execute_orders(self.portfolio.id, [
+            {'stock_id': self.held.id, 'side': 'sell', 'shares': '1'},
+        ]))
+        self.assert_marks_only_portfolio(lambda: Holding.objects.get(id=self.holding.id).delete())
+
+    def test_target_allocation_writes_mark_stale(self):
+        allocation = TargetAllocation(portfolio=self.portfolio, stock=self.held, target_percent=1.0)
+        self.assert_marks_only_portfolio(allocation.save)
+        self.assert_marks_only_portfolio(allocation.delete)
+
+    def test_price_writes_mark_holders_stale(self):
+        self.assert_marks_only_portfolio(lambda: StockPrice.objects.bulk_create([
+            StockPrice(stock=self.held, date=date(2025, 1, 3), price=Decimal('12')),
+        ]))
+        self.assertEqual(PortfolioDrift.objects.get(portfolio=self.portfolio).market_value, Decimal('60'))
+
+        price = StockPrice.objects.get(stock=self.held, date=date(2025, 1, 3))
+        price.price = Decimal('11')
+        self.assert_marks_only_portfolio(price.save)
+        self.assert_marks_only_portfolio(price.delete)
+        self.assertEqual(PortfolioDrift.objects.get(portfolio=self.portfolio).market_value, Decimal('50'))
+
+
+@override_settings(CACHES=TEST_CACHES, PRICE_MATRIX_DIR=TEST_MATRIX_DIR)
+class PriceMatrixRefreshTests(TestCase):
+    def setUp(self):
+        self.first = Stock.objects.create(symbol='MXA')
+        self.second = Stock.objects.create(symbol='MXB')
+        self.first_day = date(2025, 1, 1)
+        # La segunda acción empieza más tarde: sus primeras filas quedan en NaN
+        self.add_prices(self.first, range(10))
+        self.add_prices(self.second, range(3, 10))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def add_prices(self, stock, days, offset=0):
+        StockPrice.objects.bulk_create([
+            StockPrice(stock=stock, date=self.first_day + timedelta(days=day), price=Decimal(10 + day + offset))
+            for day in days
+        ])
+
+    def stocks(self):
+        return Stock.objects.values_list('id', 'latest_price_date', 'latest_price', 'price_revision')
+
+    def assert_matches_rebuild(self):
+        with tempfile.TemporaryDirectory() as fresh:
+            build_price_matrix(fresh)
+            refreshed, rebuilt = get_price_matrix(self.directory), get_price_matrix(fresh)
+            np.testing.assert_array_equal(refreshed.dates, rebuilt.dates)
+            np.testing.assert_array_equal(refreshed.prices, rebuilt.prices)
+            self.assertEqual(refreshed.marks, rebuilt.marks)
+        self.assertTrue(refreshed.is_current(self.stocks()))
+
+    def test_new_dates_are_appended_as_a_rebuild_would_write_them(self):
+        build_price_matrix(self.directory)
+        # Día 10 solo para la primera: la segunda se rellena hacia adelante en esa fila
+        self.add_prices(self.first, range(10, 13))
+        self.add_prices(self.second, range(11, 13))
+        self.assertFalse(get_price_matrix(self.directory).is_current(self.stocks()))
+
+        with override_settings(PRICE_MATRIX_DIR=self.directory):
+            result = refresh_price_matrix_if_built()
+        self.assertEqual((result['rebuilt'], result['rows_added'], result['rows']), (False, 3, 13))
+        self.assert_matches_rebuild()
+
+    def test_rewritten_price_marks_the_matrix_stale(self):
+        build_price_matrix(self.directory)
+        price = StockPrice.objects.get(stock=self.first, date=self.first_day + timedelta(days=4))
+        price.price = Decimal('99')
+        price.save()
+
+        self.assertFalse(get_price_matrix(self.directory).is_current(self.stocks()))
+        self.assertTrue(refresh_price_matrix_if_built(self.directory)['stale'])
+        self.assertFalse(get_price_matrix(self.directory).is_current(self.stocks()))
+
+        self.assertTrue(refresh_price_matrix(self.directory)['rebuilt'])
+        self.assert_matches_rebuild()
+
+    def test_refresh_without_a_matrix_does_not_create_one(self):
+        self.assertIsNone(refresh_price_matrix_if_built(self.directory))
+        self.assertIsNone(get_price_matrix(self.directory))
+
+
+@override_settings(CACHES=TEST_CACHES, PRICE_MATRIX_DIR=TEST_MATRIX_DIR)
+class SeedStocksTests(TestCase):
+    def test_limit_reports_new_symbols_apart_from_skipped_rows(self):
+        Stock.objects.create(symbol='OLD')
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write('Symbol,Name,Last Sale,Volume\n')
+            file.write('OLD,Old,$5.00,10\n,Blank,$1.00,1\n')
+            file.writelines(f'N{i},New {i},$1{i}.00,100\n' for i in range(5))
+        self.addCleanup(os.remove, file.name)
+
+        out = StringIO()
+        call_command('seed_stocks', csv_path=file.name, limit=2, stdout=out)
+
+        self.assertEqual(set(Stock.objects.values_list('symbol', flat=True)), {'OLD', 'N0', 'N1'})
+        self.assertIn('Stocks created: 2', out.getvalue())
+        self.assertIn('Stocks skipped (already exist): 1', out.getvalue())
+        self.assertIn('over --limit, rest of file not read): 3', out.getvalue())
+        self.assertIn('Rows skipped (missing symbol): 1', out.getvalue())
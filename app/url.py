@@ -1,13 +1,24 @@
 from django.urls import path
-from .views import home, portfolio_detail, get_portfolio_balance, buy_stock, sell_stock, simulate_time, stock_detail, rebalance_portfolio
+from .views import home, portfolio_detail, get_portfolio_balance, buy_stock, sell_stock, simulate_time, stock_detail, rebalance_portfolio, request_metrics_summary, list_portfolios, drifted_portfolios, latest_quotes, stock_price_history, rebalance_preview, batch_orders, portfolio_nav, portfolio_state, portfolio_risk, portfolio_monte_carlo
 
 urlpatterns = [
     path('', home, name='home'),
     path('portfolio/<int:portfolio_id>/', portfolio_detail, name='portfolio_detail'),
     path('stock/<int:stock_id>/', stock_detail, name='stock_detail'),
+    path('api/portfolios/', list_portfolios, name='list_portfolios'),
+    path('api/portfolios/drifted/', drifted_portfolios, name='drifted_portfolios'),
     path('api/portfolio/<int:portfolio_id>/balance/', get_portfolio_balance, name='get_portfolio_balance'),
+    path('api/portfolio/<int:portfolio_id>/rebalance-preview/', rebalance_preview, name='rebalance_preview'),
+    path('api/portfolio/<int:portfolio_id>/nav/', portfolio_nav, name='portfolio_nav'),
+    path('api/portfolio/<int:portfolio_id>/risk/', portfolio_risk, name='portfolio_risk'),
+    path('api/portfolio/<int:portfolio_id>/monte-carlo/', portfolio_monte_carlo, name='portfolio_monte_carlo'),
+    path('api/portfolio/<int:portfolio_id>/state/', portfolio_state, name='portfolio_state'),
+    path('api/quotes/', latest_quotes, name='latest_quotes'),
+    path('api/stock/<int:stock_id>/history/', stock_price_history, name='stock_price_history'),
     path('api/buy-stock/', buy_stock, name='buy_stock'),
     path('api/sell-stock/', sell_stock, name='sell_stock'),
+    path('api/orders/', batch_orders, name='batch_orders'),
     path('api/rebalance-portfolio/', rebalance_portfolio, name='rebalance_portfolio'),
     path('api/simulate-time/', simulate_time, name='simulate_time'),
+    path('api/debug/request-metrics/', request_metrics_summary, name='request_metrics_summary'),
 ]
\ No newline at end of file
@@ -1,13 +1,12 @@
+from django.conf import settings
 from django.shortcuts import render, redirect
 from django.contrib import messages
-from django.core.paginator import Paginator
-from django.db.models import Prefetch
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
 from decimal import Decimal, InvalidOperation
 import json
 
-from .models import Portfolio, Stock, StockPrice
-from .services import PortfolioService, StockTransactionService, StockDataService
+from .middleware import request_metrics
+from .services import RISK_DEFAULT_DAYS, LedgerService, MonteCarloService, OrderValidationError, PortfolioService, StockTransactionService, StockDataService
 
 MIN_VALUE_DIFF = Decimal("0.01")
 SHARES_Q = Decimal("0.00000001")
@@ -15,17 +14,18 @@ MONEY_Q = Decimal("0.01")
 MIN_SHARES_LEFT = Decimal("0.0001")
 
 def home(request):
-    portfolios_list = Portfolio.objects.all()
-    portfolios_paginator = Paginator(portfolios_list, 10)
-    portfolios_page = request.GET.get('portfolios_page', 1)
-    portfolios = portfolios_paginator.get_page(portfolios_page)
-    
-    stocks_list = Stock.objects.prefetch_related(
-        Prefetch('prices', queryset=StockPrice.objects.order_by('-date')[:1], to_attr='latest_price')
-    ).all()
-    stocks_paginator = Paginator(stocks_list, 10)
-    stocks_page = request.GET.get('stocks_page', 1)
-    stocks = stocks_paginator.get_page(stocks_page)
+    estimate_count = getattr(settings, 'HOME_ESTIMATED_COUNTS', False)
+    
+    # Un cursor inválido o viejo vuelve a la primera página en vez de fallar
+    try:
+        portfolios = PortfolioService.page_portfolios(request.GET.get('portfolios_cursor'), 10, estimate_count)
+    except ValueError:
+        portfolios = PortfolioService.page_portfolios(None, 10, estimate_count)
+    
+    try:
+        stocks = StockDataService.page_stocks(request.GET.get('stocks_cursor'), 10, estimate_count)
+    except ValueError:
+        stocks = StockDataService.page_stocks(None, 10, estimate_count)
     
     return render(request, 'home.html', {
         'portfolios': portfolios,
@@ -68,9 +68,9 @@ def portfolio_detail(request, portfolio_id):
         messages.error(request, f'Error al cargar portfolio: {str(e)}')
         return redirect('home')
 
-def get_portfolio_balance(request, portfolio_id):
+async def get_portfolio_balance(request, portfolio_id):
     try:
-        data = PortfolioService.get_balance(portfolio_id)
+        data = await PortfolioService.aget_balance(portfolio_id)
         return JsonResponse({
             'success': True,
             **data
@@ -81,6 +81,113 @@ def get_portfolio_balance(request, portfolio_id):
             'error': str(e)
         }, status=400)
 
+def portfolio_nav(request, portfolio_id):
+    try:
+        data = PortfolioService.get_nav_series(
+            portfolio_id,
+            start_date=request.GET.get('start_date'),
+            end_date=request.GET.get('end_date')
+        )
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    except Http404 as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=404)
+    
+    return JsonResponse({
+        'success': True,
+        'data': {
+            **data,
+            'start_date': data['start_date'].isoformat(),
+            'end_date': data['end_date'].isoformat(),
+            'dates': [day.isoformat() for day in data['dates']],
+        }
+    })
+
+def portfolio_risk(request, portfolio_id):
+    try:
+        data = PortfolioService.get_risk(
+            portfolio_id,
+            as_of=request.GET.get('as_of'),
+            days=int(request.GET.get('days', RISK_DEFAULT_DAYS))
+        )
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    except Http404 as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=404)
+    
+    return JsonResponse({'success': True, 'data': data})
+
+def portfolio_monte_carlo(request, portfolio_id):
+    try:
+        seed = request.GET.get('seed')
+        max_paths = getattr(settings, 'MONTE_CARLO_HTTP_MAX_PATHS', 5000)
+        max_horizon = getattr(settings, 'MONTE_CARLO_HTTP_MAX_HORIZON', 252)
+        paths = int(request.GET.get('paths', max_paths))
+        horizon = int(request.GET.get('horizon', max_horizon))
+        if paths > max_paths or horizon > max_horizon:
+            raise ValueError(
+                f'Por API se permiten hasta {max_paths} caminos y {max_horizon} días; '
+                'para más usa el comando monte_carlo'
+            )
+        # En el proceso del request: un pool de procesos por request agota el servidor
+        data = MonteCarloService.simulate_portfolio(
+            portfolio_id,
+            paths=paths,
+            horizon=horizon,
+            seed=int(seed) if seed else None,
+            workers=1,
+            cost_bps=Decimal(request.GET.get('cost_bps', '10'))
+        )
+    except InvalidOperation:
+        return JsonResponse({'success': False, 'error': 'cost_bps inválido'}, status=400)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    except Http404 as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=404)
+    
+    return JsonResponse({'success': True, 'data': data})
+
+def portfolio_state(request, portfolio_id):
+    try:
+        data = LedgerService.reconstruct(portfolio_id, as_of=request.GET.get('as_of'))
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    except Http404 as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=404)
+    
+    return JsonResponse({'success': True, 'data': data})
+
+def list_portfolios(request):
+    try:
+        filters = {
+            key: request.GET[key]
+            for key in ('min_value', 'max_value', 'min_drift', 'max_drift')
+            if request.GET.get(key)
+        }
+        result = PortfolioService.list_portfolios(
+            sort=request.GET.get('sort', 'id'),
+            descending=request.GET.get('order') == 'desc',
+            cursor=request.GET.get('cursor'),
+            page_size=int(request.GET.get('page_size', 50)),
+            filters=filters
+        )
+        return JsonResponse({'success': True, 'data': result})
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+def drifted_portfolios(request):
+    try:
+        threshold = Decimal(request.GET.get('threshold', '5'))
+        limit = int(request.GET.get('limit', 100))
+        if threshold < 0 or limit <= 0:
+            raise ValueError('threshold y limit deben ser positivos')
+        result = PortfolioService.drifted_portfolios(threshold, limit)
+        return JsonResponse({'success': True, 'data': result})
+    except InvalidOperation:
+        return JsonResponse({'success': False, 'error': 'threshold inválido'}, status=400)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
 def buy_stock(request):
     if request.method != 'POST':
         return JsonResponse({'success': False, 'error': 'Método no permitido'}, status=405)
@@ -164,6 +271,29 @@ def sell_stock(request):
             'error': f'Error al procesar la venta: {str(e)}'
         }, status=500)
 
+def batch_orders(request):
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Método no permitido'}, status=405)
+    
+    try:
+        payload = json.loads(request.body)
+        if not isinstance(payload, dict) or not payload.get('portfolio_id'):
+            return JsonResponse({'success': False, 'error': 'portfolio_id es requerido'}, status=400)
+        
+        result = StockTransactionService.execute_orders(payload['portfolio_id'], payload.get('legs'))
+        return JsonResponse({'success': True, 'data': result})
+    
+    except json.JSONDecodeError:
+        return JsonResponse({'success': False, 'error': 'JSON inválido'}, status=400)
+    except OrderValidationError as e:
+        return JsonResponse({'success': False, 'error': str(e), 'legs': e.errors}, status=400)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    except Http404 as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=404)
+    except Exception as e:
+        return JsonResponse({'success': False, 'error': f'Error al procesar las órdenes: {str(e)}'}, status=500)
+
 def simulate_time(request):
     if request.method != 'POST':
         return redirect('home')
@@ -171,8 +301,9 @@ def simulate_time(request):
     try:
         amount = request.POST.get('amount', 1)
         unit = request.POST.get('unit', 'days')
+        seed = request.POST.get('seed')
         
-        result = StockDataService.simulate_time_forward(amount, unit)
+        result = StockDataService.simulate_time_forward(amount, unit, seed=int(seed) if seed else None)
         
         messages.success(
             request,
@@ -212,6 +343,45 @@ def stock_detail(request, stock_id):
         return redirect('home')
 
 
+async def latest_quotes(request):
+    symbols = [symbol.strip().upper() for symbol in request.GET.get('symbols', '').split(',') if symbol.strip()]
+    try:
+        quotes = await StockDataService.aget_latest_quotes(symbols)
+        return JsonResponse({'success': True, 'data': quotes})
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+async def stock_price_history(request, stock_id):
+    try:
+        data = await StockDataService.aget_stock_price_history(
+            stock_id=stock_id,
+            start_date=request.GET.get('start_date'),
+            end_date=request.GET.get('end_date')
+        )
+    except Http404 as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=404)
+    
+    return JsonResponse({
+        'success': True,
+        'data': {
+            'stock_id': data['stock'].id,
+            'symbol': data['stock'].symbol,
+            'chart_data': data['chart_data'],
+            'stats': data['stats'],
+            'start_date': data['start_date'].isoformat(),
+            'end_date': data['end_date'].isoformat(),
+            'data_points': data['data_points'],
+            'resolution': data['resolution'],
+        }
+    })
+
+async def rebalance_preview(request, portfolio_id):
+    try:
+        result = await PortfolioService.aget_info_to_rebalance_portafolio(portfolio_id)
+        return JsonResponse({"success": True, "data": result})
+    except Http404 as e:
+        return JsonResponse({"success": False, "error": str(e)}, status=404)
+
 def rebalance_portfolio(request):
     if request.method != "POST":
         return JsonResponse({"success": False, "error": "Método no permitido"}, status=405)
@@ -233,3 +403,12 @@ def rebalance_portfolio(request):
     except Exception as e:
         return JsonResponse({"success": False, "error": f"Error al rebalancear: {str(e)}"}, status=500)
 
+
+def request_metrics_summary(request):
+    if not settings.DEBUG and not request.user.is_staff:
+        return JsonResponse({'success': False, 'error': 'No autorizado'}, status=403)
+    
+    if request.method == 'POST' and request.POST.get('reset') == 'true':
+        request_metrics.reset()
+    
+    return JsonResponse({'success': True, 'data': request_metrics.summary()})
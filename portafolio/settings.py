@@ -49,8 +49,14 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'app.middleware.QueryInstrumentationMiddleware',
 ]
 
+# Fracción de requests instrumentados (queries, tiempo de DB y latencia de la vista)
+REQUEST_METRICS_SAMPLE_RATE = 1.0
+REQUEST_METRICS_MAX_SAMPLES = 1000
+REQUEST_METRICS_HEADERS = DEBUG
+
 ROOT_URLCONF = 'portafolio.urls'
 
 TEMPLATES = [
@@ -82,6 +88,45 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# Las versiones del historial de precios y las marcas de reescritura se invalidan desde otros
+# procesos (importaciones, simulaciones, workers): el cache tiene que ser compartido, no LocMemCache.
+# En producción conviene Redis (django.core.cache.backends.redis.RedisCache)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'cache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    }
+}
+
+# Segundos que se guarda el historial de precios de cada acción
+PRICE_HISTORY_CACHE_TIMEOUT = 60 * 60
+
+# Segundos que se guarda la serie de valor (NAV) de cada portafolio; se extiende día a día
+NAV_SERIES_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Segundos que se guardan las métricas de riesgo de cada portafolio para una fecha de corte
+PORTFOLIO_RISK_CACHE_TIMEOUT = 24 * 60 * 60
+
+# Muestra en el inicio el total estimado por el planner (sin COUNT(*))
+HOME_ESTIMATED_COUNTS = False
+
+# Drift (en %) sobre el cual el scheduler rebalancea un portafolio sin banda propia
+REBALANCE_DRIFT_BAND = 5
+
+# Directorio de la matriz de precios en columnas (memmap compartido entre procesos)
+PRICE_MATRIX_DIR = BASE_DIR / 'price_matrix'
+
+# Límites de la simulación Monte Carlo del endpoint de portafolio: corre en el mismo proceso del
+# request, así que se mantiene chica; las corridas grandes van por el comando monte_carlo
+MONTE_CARLO_HTTP_MAX_PATHS = 5000
+MONTE_CARLO_HTTP_MAX_HORIZON = 252
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators